@@ -1,7 +1,9 @@
 # Initial setup for global variables. Import names from here for the main bot tasks.
 import random
+from time import perf_counter
 from datetime import datetime
 
+import asyncio as aio
 import discord as dc
 from discord.ext import commands, tasks
 
@@ -12,20 +14,92 @@ from cogs_modtools import (
     MemberStalker, Suggestions,
     )
 from cogs_statstracker import StatsTracker
+from cogs_perftracker import PerfTracker, startup_profiler
+from cogs_sqlstore import configure_sqlite, SqlWriteQueue
+from cogs_scheduler import Scheduler, Cron, Every
 
-random.seed(datetime.now())
-bot = commands.Bot(command_prefix='D--> ', intents=dc.Intents.all())
+perf_tracker = PerfTracker('perf.json')
+
+
+class InstrumentedBot(commands.Bot):
+    """
+    A Bot that times every event handler it dispatches to, including cog listeners.
+    Commands are timed separately through the invoke hooks below.
+    """
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        start = perf_counter()
+        try:
+            await coro(*args, **kwargs)
+        except aio.CancelledError:
+            perf_tracker.record(coro.__qualname__, perf_counter()-start)
+        except Exception:
+            perf_tracker.record(coro.__qualname__, perf_counter()-start, True)
+            try:
+                await self.on_error(event_name, *args, **kwargs)
+            except aio.CancelledError:
+                pass
+        else:
+            perf_tracker.record(coro.__qualname__, perf_counter()-start)
+        if event_name == 'on_ready' and startup_profiler.readies == 1:
+            startup_profiler.record(f'on_ready {coro.__qualname__}', start, perf_counter()-start, 1)
+
+    def add_cog(self, cog):
+        with startup_profiler.phase(f'add_cog {type(cog).__name__}'):
+            super().add_cog(cog)
+
+    def dispatch(self, event_name, *args, **kwargs):
+        if event_name == 'ready':
+            # The ready hooks are scheduled right here and finish in the background;
+            # they show up in the startup report as they complete.
+            startup_profiler.mark_ready()
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def on_message(self, message):
+        # Guild commands are processed by GuildConfiguration, which knows which channels ignore plebs.
+        if message.guild is None:
+            await self.process_commands(message)
+
+
+random.seed(datetime.now().timestamp())
+bot = InstrumentedBot(command_prefix='D--> ', intents=dc.Intents.all())
 bot.remove_command('help')
+# Every cog's periodic work runs off this, and none of it before the bot is ready.
+scheduler = Scheduler('schedule.json', bot.loop, bot.wait_until_ready, perf_tracker)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.perf_start = perf_counter()
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    # Groups run their hooks too when a subcommand is invoked; only time the command that was asked for.
+    if ctx.invoked_subcommand is not None and ctx.command is not ctx.invoked_subcommand:
+        return
+    perf_tracker.record(
+        f'command {ctx.command.qualified_name}',
+        perf_counter()-ctx.perf_start,
+        ctx.command_failed,
+        )
 
 help_data = []
 
-sql_engine = sql.create_engine('sqlite+pysqlite:///aqbot.db', echo=True, future=True)
+# One pooled connection per thread keeps SQLite's prepared statement cache warm;
+# in practice only the startup thread and the SQL writer thread ever connect.
+sql_engine = configure_sqlite(sql.create_engine(
+    'sqlite+pysqlite:///aqbot.db', future=True, poolclass=sql.pool.SingletonThreadPool,
+    ))
 sql_metadata = sql.MetaData()
-sql_metadata.reflect(bind=sql_engine)
+with startup_profiler.phase('sql reflect'):
+    sql_metadata.reflect(bind=sql_engine)
+sql_writer = SqlWriteQueue(sql_engine)
 
-member_stalker = MemberStalker('members.pkl')
-stats_tracker = StatsTracker('stats.pkl')
-stored_suggestions = Suggestions('suggestions.pkl')
+with startup_profiler.phase('load members.pkl'):
+    member_stalker = MemberStalker('members.pkl')
+with startup_profiler.phase('load stats.pkl'):
+    stats_tracker = StatsTracker('stats.pkl')
+with startup_profiler.phase('load suggestions.pkl'):
+    stored_suggestions = Suggestions('suggestions.pkl')
 
 CONST_ADMINS = (120187484863856640, 148346796186271744) # Mac, Dirt
 CONST_AUTHOR = (125433170047795200, 257144766901256192) # 9, WoC
@@ -43,6 +117,6 @@ def user_or_perms(user_id, **perms):
 
 
 def main():
-    with open('token.dat', 'r') as tokenfile, member_stalker, stats_tracker, stored_suggestions:
+    with open('token.dat', 'r') as tokenfile, member_stalker, stats_tracker, stored_suggestions, perf_tracker, sql_writer, scheduler:
         raw = tokenfile.read().strip()
         bot.run(''.join(chr(int(''.join(c), 16)) for c in zip(*[iter(raw)]*2)))
@@ -1,6 +1,8 @@
 # For most moderation commands.
-from datetime import datetime
-# from collections import Counter
+import io
+import re
+from time import time, perf_counter
+from datetime import datetime, timedelta
 
 import asyncio as aio
 
@@ -8,7 +10,11 @@ import discord as dc
 from discord.ext import commands
 
 from cogs_textbanks import url_bank, query_bank, response_bank
-from bot_common import bot, CONST_ADMINS, CONST_AUTHOR, stats_tracker, user_or_perms
+from bot_common import (
+    bot, CONST_ADMINS, CONST_AUTHOR, stats_tracker, perf_tracker, scheduler, startup_profiler, member_stalker, user_or_perms,
+    )
+from cogs_modtools import ChannelPurge, to_epoch, from_epoch
+from cogs_massban import read_id_lists, resolve_targets, MassBan
 
 # INFOHELP COMMANDS
 
@@ -48,8 +54,13 @@ async def modhelp(ctx):
         inline=False
         )
     embed.add_field(
-        name='`autoreact`',
-        value='(Manage Roles only) Toggle auto-react feature.',
+        name='`activity (active|inactive|retention|histogram) [args...]`',
+        value='(Manage Roles only) Query when members last spoke: active counts, inactive lists, and join retention.',
+        inline=False
+        )
+    embed.add_field(
+        name='`autoreact [add|del|list]`',
+        value='(Manage Messages only) Toggle image hearts, or manage per-channel react rules.',
         inline=False
         )
     embed.add_field(
@@ -62,6 +73,21 @@ async def modhelp(ctx):
         value='(Manage Roles only) Toggles whether or not latex commands can be used.',
         inline=False
         )
+    embed.add_field(
+        name='`togglearchive`',
+        value='(Manage Messages only) Toggle archiving attachments in a channel for the message log.',
+        inline=False
+        )
+    embed.add_field(
+        name='`trigger (add|del|list|counts) [args...]`',
+        value='(Manage Messages only) Answer, count, or report keywords and phrases in messages.',
+        inline=False
+        )
+    embed.add_field(
+        name='`search [count|top|backfill|status] <query>`',
+        value='(Manage Messages only) Search indexed message history, or count who says what. `backfill` needs Manage Server.',
+        inline=False
+        )
     embed.add_field(
         name='`channel (ban|unban) <username>`',
         value='(Manage Roles only) Add or remove a channel mute role.',
@@ -70,7 +96,12 @@ async def modhelp(ctx):
     if perms.ban_members:
         embed.add_field(
             name='`raidban <user1> [<user2> <user3> ...]`',
-            value='(Ban Members only) Ban a list of raiders.',
+            value='(Ban Members only) Ban a list of raiders, including IDs from attached text files.',
+            inline=False
+            )
+        embed.add_field(
+            name='`raidguard (mode|status|ban|clear) [args...]`',
+            value='(Ban Members only) Configure the raid detector, or ban the members it has flagged.',
             inline=False
             )
     if perms.manage_channels:
@@ -84,6 +115,16 @@ async def modhelp(ctx):
             value='(Manage Channels only) Utilizes highly dangerous Stand power to moderate the server.',
             inline=False
             )
+        embed.add_field(
+            name='`ZA HANDO [count] [filters...]`',
+            value='(Manage Channels only) Purge only messages matching user:<user>, match:<regex>, files, or within:<time>.',
+            inline=False
+            )
+        embed.add_field(
+            name='`perf [sort] [count]`',
+            value='(Manage Channels only) Show handler and command latency statistics. Sort by `startup` to time the last launch, or `jobs` for scheduled jobs.',
+            inline=False
+            )
     await ctx.send(embed=embed)
 
 @modhelp.error
@@ -119,6 +160,42 @@ async def modperms_error(ctx, error):
         return
     raise error
 
+@bot.command(name='perf')
+@commands.bot_has_permissions(send_messages=True)
+@user_or_perms(CONST_ADMINS+CONST_AUTHOR, manage_channels=True)
+async def perf_report(ctx, sort: str='total', count: int=15):
+    if sort == 'reset':
+        perf_tracker.reset()
+        await ctx.send(response_bank.perf_reset_confirm)
+        return
+    if sort == 'startup':
+        report = startup_profiler.report(max(1, min(count, 25)))
+        await ctx.send(f'{response_bank.perf_startup_head}\n```{report}```')
+        return
+    if sort == 'jobs':
+        await ctx.send(f'{response_bank.perf_jobs_head}\n```{scheduler.report()}```')
+        return
+    if sort not in perf_tracker.sort_keys:
+        await ctx.send(response_bank.perf_sort_error.format(keys=', '.join(perf_tracker.sort_keys)))
+        return
+    if not perf_tracker.handlers:
+        await ctx.send(response_bank.perf_empty)
+        return
+    report = perf_tracker.report(sort, max(1, min(count, 15)))
+    await ctx.send(
+        response_bank.perf_report_head.format(since=perf_tracker.started.strftime('%d/%m/%Y %H:%M:%S'))
+        + f'\n```{report}```'
+        )
+
+@perf_report.error
+async def perf_report_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send(response_bank.perms_error)
+        return
+    elif isinstance(error, commands.BotMissingPermissions):
+        return
+    raise error
+
 # END OF INFOHELP COMMANDS
 # BAN COMMANDS
 
@@ -126,18 +203,39 @@ async def modperms_error(ctx, error):
 @commands.bot_has_guild_permissions(ban_members=True)
 @user_or_perms(CONST_ADMINS+CONST_AUTHOR, ban_members=True)
 async def raidban(ctx, *args):
+    args = (*args, *await read_id_lists(ctx.message))
     if not args:
         return
-    members = []
-    for arg in args:
-        member = await commands.UserConverter().convert(ctx, arg)
-        members.append(f'`{member}`')
-        await ctx.guild.ban(
-            member,
-            reason='Banned by anti-raid command.',
-            delete_message_days=1,
-            )
-    desc = f'D--> The aberrants listed below have been STRONGLY executed:\n{", ".join(members)}'
+    guild_config = bot.get_cog('GuildConfiguration')
+    if guild_config is None:
+        raise RuntimeError(response_bank.unexpected_state)
+    targets, unresolved = await resolve_targets(ctx, args)
+    status_msg = await ctx.send(response_bank.raidban_progress.format(done=0, total=len(targets)))
+    last_update = perf_counter()
+
+    async def progress(done, total):
+        nonlocal last_update
+        if done == total or perf_counter() - last_update < 2: # Edits are rate limited too.
+            return
+        last_update = perf_counter()
+        await status_msg.edit(content=response_bank.raidban_progress.format(done=done, total=total))
+
+    mass_ban = MassBan(ctx.guild, 'Banned by anti-raid command.', progress=progress)
+    results = await mass_ban.run(targets, protected={ctx.author.id})
+    report = '\n'.join((
+        *(f'`{label}`: {results[user_id]}' for user_id, label in targets.items()),
+        *(f'`{arg}`: not found' for arg in unresolved),
+        ))
+    desc = response_bank.raidban_summary.format(
+        banned=mass_ban.count(), total=len(targets)+len(unresolved), elapsed=mass_ban.elapsed,
+        )
+    overflow = len(desc) + len(report) >= 1900
+    if not overflow:
+        desc = f'{desc}\n{report}'
+
+    def report_file(): # Files are consumed on send, so each destination gets its own.
+        return dc.File(io.BytesIO(report.encode()), filename='raidban.txt') if overflow else None
+
     embed = dc.Embed(
         color=ctx.author.color,
         timestamp=ctx.message.created_at,
@@ -147,13 +245,16 @@ async def raidban(ctx, *args):
         name=f'{ctx.author} used raidban command in #{ctx.channel}:',
         icon_url=ctx.author.avatar_url,
         )
-    guild_config = bot.get_cog('GuildConfiguration')
-    if guild_config is None:
-        raise RuntimeError(response_bank.unexpected_state)
-    await guild_config.log(ctx.guild, 'modlog', desc, embed=embed)
+    modlog = guild_config.getlog(ctx.guild, 'modlog')
+    if modlog:
+        await guild_config.log(ctx.guild, 'modlog', desc, embed=embed, file=report_file())
     await ctx.message.delete()
-    if ctx.channel.id != guild_config.getlog(ctx.guild, 'modlog'):
-        await ctx.send(desc)
+    if ctx.channel.id == modlog:
+        await status_msg.delete()
+        return
+    await status_msg.edit(content=desc)
+    if overflow:
+        await ctx.send(file=report_file())
 
 @raidban.error
 async def raidban_error(ctx, error):
@@ -203,14 +304,67 @@ async def special_mod_command_freeze_error(ctx, error):
         return
     raise error
 
+_purge_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+async def parse_purge_filters(ctx, filters):
+    """Turn purge filter arguments into a message check and the oldest time to purge back to."""
+    authors = set()
+    patterns = []
+    need_files = False
+    after = None
+    for arg in filters:
+        kind, _, value = arg.partition(':')
+        if kind == 'user' and value:
+            authors.add((await commands.UserConverter().convert(ctx, value)).id)
+        elif kind == 'match' and value:
+            try:
+                patterns.append(re.compile(value, re.IGNORECASE))
+            except re.error:
+                raise commands.BadArgument(arg)
+        elif arg == 'files':
+            need_files = True
+        elif kind == 'within' and (match := re.fullmatch(r'(\d+)([smhd])', value)):
+            after = datetime.utcnow() - timedelta(seconds=int(match[1])*_purge_units[match[2]])
+        else:
+            raise commands.BadArgument(arg)
+
+    def check(msg):
+        return ((not authors or msg.author.id in authors)
+            and (not need_files or msg.attachments)
+            and all(pattern.search(msg.content) for pattern in patterns)
+            )
+    return (check if authors or patterns or need_files else None), after
+
 @special_mod_command.command(name='HANDO')
-@commands.bot_has_permissions(manage_messages=True)
-async def special_mod_command_purge(ctx, limit: int=10):
+@commands.bot_has_permissions(manage_messages=True, read_message_history=True)
+async def special_mod_command_purge(ctx, limit: int=10, *filters):
     await ctx.message.delete()
     if limit < 1:
         await ctx.send(response_bank.purge_channel_zero_arg_error)
         return
-    msgs = await ctx.channel.purge(limit=limit)
+    try:
+        check, after = await parse_purge_filters(ctx, filters)
+    except commands.BadArgument as exc:
+        await ctx.send(response_bank.purge_channel_filter_error.format(arg=exc.args[0]))
+        return
+    status_msg = None
+    last_update = perf_counter()
+
+    async def progress(purge):
+        nonlocal status_msg, last_update
+        if perf_counter() - last_update < 3: # Only long purges get a progress message.
+            return
+        last_update = perf_counter()
+        status = response_bank.purge_channel_progress.format(deleted=purge.deleted, scanned=purge.scanned)
+        if status_msg is None:
+            status_msg = await ctx.send(status)
+        else:
+            await status_msg.edit(content=status)
+
+    purge = ChannelPurge(ctx.channel, check, progress)
+    await purge.run(limit, before=ctx.message, after=after)
+    if status_msg is not None:
+        await status_msg.delete()
     embed = dc.Embed(
         color=dc.Color(0x303EBB),
         timestamp=ctx.message.created_at,
@@ -227,13 +381,14 @@ async def special_mod_command_purge(ctx, limit: int=10):
         raise RuntimeError(response_bank.unexpected_state)
     if not guild_config.getlog(ctx.guild, 'msglog'): # Log immediately after.
         return
-    user_msgs = Counter(msg.author for msg in msgs)
+    user_msgs = purge.counts.most_common()
+    desc = '\n'.join(f'**@{user}**: {count} messages' for user, count in user_msgs[:40])
+    if len(user_msgs) > 40:
+        desc += f'\n...and {len(user_msgs)-40} more users.'
     log_embed = dc.Embed(
         color=dc.Color.blue(),
         timestamp=ctx.message.created_at,
-        description='\n'.join(
-            f'**@{user}**: {count} messages' for user, count in user_msgs.items()
-            ),
+        description=desc,
         )
     log_embed.set_author(
         name=f'{ctx.channel} has been purged:',
@@ -311,4 +466,79 @@ async def special_mod_command_unfreeze_error(ctx, error):
 #             f'D--> Wizard of Chaos has slurred {tards} times in this server, {ctx.author.mention}.'
 #             )
 
+@bot.group(name='activity')
+@commands.bot_has_permissions(send_messages=True)
+@user_or_perms(CONST_ADMINS+CONST_AUTHOR, manage_roles=True)
+async def activity(ctx):
+    if ctx.invoked_subcommand is None:
+        await ctx.send(response_bank.activity_usage)
+
+@activity.error
+async def activity_error(ctx, error):
+    if isinstance(error, commands.MissingPermissions):
+        await ctx.send(response_bank.perms_error)
+        return
+    elif isinstance(error, commands.BotMissingPermissions):
+        return
+    raise error
+
+activity_page_size = 20
+activity_buckets = ((1, 'under 1 day'), (7, '1-7 days'), (30, '7-30 days'), (90, '30-90 days'), (365, '90-365 days'))
+
+def days_ago(days):
+    return time() - days*86400
+
+@activity.command(name='active')
+async def activity_active(ctx, days: int=30):
+    index = member_stalker.activity(ctx.guild)
+    await ctx.send(response_bank.activity_active.format(
+        active=index.count_seen_since(days_ago(max(days, 0))), total=len(index), days=days,
+        ))
+
+@activity.command(name='inactive')
+async def activity_inactive(ctx, days: int=30, page: int=1):
+    index = member_stalker.activity(ctx.guild)
+    cutoff = days_ago(max(days, 0))
+    if not (total := index.count_not_seen_since(cutoff)):
+        await ctx.send(response_bank.activity_inactive_empty.format(days=days))
+        return
+    pages = -(-total // activity_page_size)
+    page = max(1, min(page, pages))
+    start = (page-1) * activity_page_size
+    lines = []
+    for row in index.not_seen_since(cutoff, start, start+activity_page_size):
+        member = ctx.guild.get_member(member_stalker.member_ids[row])
+        seen = 'never' if (last_seen := from_epoch(member_stalker.last_seen[row])) is None else f'{last_seen:%Y-%m-%d}'
+        lines.append(f'{str(member)[:40]:<40} {seen}')
+    await ctx.send(
+        response_bank.activity_inactive_head.format(total=total, days=days, page=page, pages=pages)
+        + '\n```{}```'.format('\n'.join(lines))
+        )
+
+@activity.command(name='retention')
+async def activity_retention(ctx, months: int=6, days: int=30):
+    index = member_stalker.activity(ctx.guild)
+    cutoff = days_ago(max(days, 0))
+    now = datetime.utcnow()
+    lines = [f'{"joined":<8} {"members":>8} {"active":>8} {"kept":>6}']
+    for back in range(max(1, min(months, 24))-1, -1, -1):
+        year, month = divmod(now.year*12 + now.month-1 - back, 12)
+        start = datetime(year, month+1, 1)
+        end = datetime(year + (month == 11), (month+1) % 12 + 1, 1)
+        cohort = index.joined_between(to_epoch(start), to_epoch(end))
+        active = sum(member_stalker.last_seen[row] >= cutoff for row in cohort) # NaN never compares true.
+        kept = f'{active/len(cohort):.0%}' if cohort else '-'
+        lines.append(f'{start:%Y-%m}{len(cohort):>10} {active:>8} {kept:>6}')
+    await ctx.send(response_bank.activity_retention_head.format(days=days) + '\n```{}```'.format('\n'.join(lines)))
+
+@activity.command(name='histogram')
+async def activity_histogram(ctx):
+    index = member_stalker.activity(ctx.guild)
+    counts = index.seen_histogram([days_ago(days) for days, _ in activity_buckets])
+    counts.append(len(index.never_seen))
+    labels = [label for _, label in activity_buckets] + ['over a year', 'never']
+    widest = max(max(counts), 1)
+    lines = [f'{label:<14} {count:>7} {"#" * round(count/widest*20)}' for label, count in zip(labels, counts)]
+    await ctx.send(response_bank.activity_histogram_head.format(total=len(index)) + '\n```{}```'.format('\n'.join(lines)))
+
 # END OF STATS
@@ -1,6 +1,4 @@
 # For most public commands.
-import re
-import random
 from datetime import datetime
 
 import asyncio as aio
@@ -11,6 +9,7 @@ from discord.ext import commands
 
 from cogs_textbanks import url_bank, query_bank, husky_bank, response_bank
 from bot_common import bot, CONST_ADMINS, CONST_AUTHOR, member_stalker, stored_suggestions
+from cogs_dice import DiceRoll, DiceSyntaxError, DiceRangeError
 
 suggest_chid = 777555413213642772
 
@@ -55,8 +54,8 @@ async def userhelp(ctx):
         value='Provides you with an image of a corpulent canine.',
         inline=False,
         ).add_field(
-        name='`roll <n>d<f>[(+|-)<m>]`',
-        value='Try your luck! Roll n f-faced dice, and maybe add a modifier m!',
+        name='`roll <n>d<f>[kh<k>|kl<k>] [(+|-) <more dice or m>...]`',
+        value='Try your luck! Roll n f-faced dice, keep the highest or lowest k, and add more dice or modifiers!',
         inline=False,
         ).add_field(
         name='`latex <latex_code>`',
@@ -203,50 +202,45 @@ async def reflect_ping_error(ctx, error):
 @bot.command(name='roll', aliases=['r'])
 @commands.bot_has_permissions(send_messages=True)
 async def dice_roller(ctx, *, args):
-    if not (match := re.match(r'(\d+)\s*d\s*(\d+)\s*(?:([-+])\s*(\d+))?$', args.strip())):
-        await ctx.send('D--> Use your words, straight from the horse\'s mouth.')
+    try:
+        dice = DiceRoll(args)
+    except DiceSyntaxError:
+        await ctx.send(response_bank.dice_roller_parse_error)
         return
-    ndice, nfaces, sign, mod = (group or '0' for group in match.groups())
-    ndice, nfaces = int(ndice), int(nfaces)
-    # Stop people from doing the 0 dice 0 faces bullshit
-    if ndice <= 0 or nfaces <= 0:
-        await ctx.send('D--> That doesn\'t math very well. I STRONGLY suggest you try again.')
+    except DiceRangeError: # Stop people from doing the 0 dice 0 faces bullshit
+        await ctx.send(response_bank.dice_roller_args_error)
         return
-    modnum = int(sign + mod)
-    # Precalc minimum length to see if roll should go
-    if modnum:
-        bfr = f'{ctx.author.mention} **rolled {ndice}d{nfaces}{sign}{mod}:** `('
-        aft = f') {sign} {mod} = '
-    else:
-        bfr = f'{ctx.author.mention} **rolled {ndice}d{nfaces}:** `('
-        aft = f') = '
-    if len(bfr+aft) + 3*(ndice-1) > 2000:
-        await ctx.send(
-            'D--> Woah there pardner, that\'s a few too many dice '
-            'or a few too large a die. Try again with something smaller.'
-            )
+    except OverflowError:
+        await ctx.send(response_bank.dice_roller_text_overflow)
         return
-    # Do the rolls
-    if ndice == nfaces == 8 and ctx.author.id == CONST_AUTHOR[0]:
-        rolls = [8] * 8
+    loaded = str(dice) == '8d8' and ctx.author.id == CONST_AUTHOR[0]
+    if dice.size > 10000: # Big rolls take a moment, don't hold up everything else for them.
+        await bot.loop.run_in_executor(None, dice.roll, loaded)
     else:
-        rolls = [random.randint(1, nfaces) for _ in range(ndice)]
-    msg = f'{bfr}{" + ".join(map(str, rolls))}{aft}{sum(rolls) + modnum}`'
-    if len(msg) > 2000:
-        await ctx.send(
-            'D--> Woah there pardner, that\'s a few too many dice '
-            'or a few too large a die. Try again with something smaller.'
-            )
+        dice.roll(loaded)
+    # Every die takes at least four characters of breakdown, so past 500 it can't fit and isn't built.
+    if dice.size <= 500:
+        msg = f'{ctx.author.mention} **rolled {dice}:** `{dice.breakdown()}`'
+    if dice.size > 500 or len(msg) > 2000: # Too many dice to list, so just give the result and the statistics.
+        msg = f'{ctx.author.mention} **rolled {dice}:** `{dice.total}`'
+    if (stats := dice.stats()) is None:
+        await ctx.send(msg)
         return
+    low, high, mean, mode = stats
     embed = dc.Embed(
         color=dc.Color(0x005682),
-        description=f'`Min: {min(rolls)}; Max: {max(rolls)}; '
-            f'Mean: {sum(rolls) / ndice:0.2f}; 1st Mode: {max(set(rolls), key=rolls.count)}`',
+        description=f'`Min: {low}; Max: {high}; Mean: {mean:0.2f}; 1st Mode: {mode}`',
         )
     embed.set_author(
         name='Roll Statistics:',
         icon_url=url_bank.roll_icon,
         )
+    if len(dice.histogram) <= 20:
+        peak = max(dice.histogram.values())
+        embed.add_field(name='Histogram:', value='```{}```'.format('\n'.join(
+            f'{face:>2}: {"#" * round(20*count/peak):<20} {count}'
+            for face, count in sorted(dice.histogram.items())
+            )))
     await ctx.send(msg, embed=embed)
 
 @dice_roller.error
@@ -290,39 +284,52 @@ async def suggest_to_dev(ctx, *, suggestion: str):
         value=f'`{suggest_id}`',
         inline=False,
         )
-    await suggestions.send(embed=embed)
+    embed_msg = await suggestions.send(embed=embed)
     await ctx.send(f'D--> Your suggestion has been noted.')
-    stored_suggestions.add_suggestion(suggest_id, ctx.author.id, ctx.channel.id) 
+    stored_suggestions.add_suggestion(suggest_id, ctx.author.id, ctx.channel.id, suggestion, embed_msg.id)
 
 @suggest_to_dev.error
 async def suggest_to_dev_error(ctx, error):
     raise error
 
+async def find_suggestion_embed(channel, msg_id):
+    # Only needed for suggestions stored before their embed message ID was.
+    async for msg in channel.history(limit=None):
+        if msg.author.id != bot.user.id:
+            continue
+        if not msg.embeds:
+            continue
+        embed = msg.embeds[0]
+        if not embed.fields:
+            continue
+        if embed.fields[0].value == f'`{msg_id}`':
+            return msg
+    return None
+
 @bot.command(name='respond')
 @commands.bot_has_permissions(send_messages=True)
 async def response_from_dev(ctx, msg_id: int, *, response: str):
     if ctx.author.id not in CONST_AUTHOR:
         return
     try:
-        channel, member = stored_suggestions.get_suggestion(bot, msg_id)
+        channel, member, suggestion, embed_msg_id = stored_suggestions.get_suggestion(bot, msg_id)
     except KeyError:
         await ctx.send('D--> Suggestion does not exist.')
         return
-    async for msg in bot.get_channel(suggest_chid).history(limit=None):
-        if msg.author.id != bot.user.id:
-            continue
-        if not msg.embeds:
-            continue
-        embed = msg.embeds[0]
-        suggestion = embed.description
-        if not embed.fields:
-            continue
-        if embed.fields[0].value == f'`{msg_id}`':
-            break
+    suggest_channel = bot.get_channel(suggest_chid)
+    if embed_msg_id is None:
+        msg = await find_suggestion_embed(suggest_channel, msg_id)
     else:
+        try:
+            msg = await suggest_channel.fetch_message(embed_msg_id)
+        except dc.NotFound:
+            msg = None
+    if msg is None:
         await ctx.send('D--> Suggestion does not exist.')
         stored_suggestions.remove_suggestion(msg_id)
         return
+    if suggestion is None:
+        suggestion = msg.embeds[0].description
     embed = dc.Embed(
         color=member.color,
         description=response,
@@ -0,0 +1,174 @@
+# Keeps local copies of attachments from watched channels, so delete logs outlive Discord's links.
+import os
+import hashlib
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio as aio
+import aiohttp
+
+import discord as dc
+
+
+class AttachmentArchiver(object):
+    """
+    Downloads attachments from watched channels as they are posted and stores each distinct file once,
+    named by its SHA-256, so a meme reposted fifty times takes the space of one. Downloads go through a
+    bounded queue and are skipped, not piled up, when it is full. Files over max_file_size are never
+    fetched, and the least recently used files are evicted once the archive passes max_total_size.
+    Which URL holds which file is appended to an index, so copies are still found after a restart,
+    and the index is rewritten without its dead lines once they outnumber the live ones.
+    """
+
+    def __init__(self, root, max_file_size=8*2**20, max_total_size=2*2**30, queue_size=256, workers=2, max_urls=100000):
+        self.root = root
+        self.index_fname = os.path.join(root, 'index.tsv')
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.max_urls = max_urls
+        self.workers = workers
+        self.files = OrderedDict() # digest -> size, least recently used first
+        self.urls = OrderedDict() # url -> (digest, filename)
+        self.total = 0
+        self.skipped = 0
+        self.queue = aio.Queue(queue_size)
+        self._workers = []
+        # Index writes and evictions go through one thread, so they happen in the order they were made.
+        self.io = ThreadPoolExecutor(max_workers=1, thread_name_prefix='aqbot-archive')
+        self.index_lines = 0
+        self.dead_lines = 0 # Lines for evicted files and forgotten URLs.
+        self.refs = Counter() # digest -> live index lines naming it
+        os.makedirs(root, exist_ok=True)
+        self.load()
+
+    def path(self, digest):
+        return os.path.join(self.root, digest)
+
+    def load(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.root) if entry.is_file() and len(entry.name) == 64),
+            key=lambda entry: entry.stat().st_mtime,
+            )
+        for entry in entries:
+            self.files[entry.name] = entry.stat().st_size
+            self.total += entry.stat().st_size
+        try:
+            with open(self.index_fname, encoding='utf-8') as index_file:
+                for line in index_file:
+                    url, digest, filename = line.rstrip('\n').split('\t')
+                    if digest in self.files:
+                        self.urls[url] = (digest, filename)
+                        self.urls.move_to_end(url)
+                        if len(self.urls) > self.max_urls:
+                            self.urls.popitem(last=False)
+        except (OSError, ValueError):
+            pass
+        # Rewrite the index without the lines for evicted files and forgotten URLs.
+        self.write_index(self.index_entries(), True, ())
+
+    def index_entries(self):
+        # URLs of evicted files are dropped here too, since their lookups fail anyway.
+        self.urls = OrderedDict((url, entry) for url, entry in self.urls.items() if entry[0] in self.files)
+        self.refs = Counter(digest for digest, _ in self.urls.values())
+        self.index_lines, self.dead_lines = len(self.urls), 0
+        return [f'{url}\t{digest}\t{filename}\n' for url, (digest, filename) in self.urls.items()]
+
+    def write_index(self, lines, compact, evicted):
+        if compact:
+            with open(self.index_fname + '.tmp', 'w', encoding='utf-8') as index_file:
+                index_file.writelines(lines)
+            os.replace(self.index_fname + '.tmp', self.index_fname)
+        else:
+            with open(self.index_fname, 'a', encoding='utf-8') as index_file:
+                index_file.writelines(lines)
+        for digest in evicted:
+            try:
+                os.remove(self.path(digest))
+            except OSError:
+                pass
+
+    def watch(self, msg):
+        """Queue a message's attachments for download. Never waits, so it is safe in on_message."""
+        for att in msg.attachments:
+            if att.size > self.max_file_size or att.url in self.urls:
+                continue
+            try:
+                self.queue.put_nowait(att)
+            except aio.QueueFull:
+                self.skipped += 1
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        while self.queue.qsize() and len(self._workers) < self.workers:
+            self._workers.append(aio.ensure_future(self.work()))
+
+    async def work(self):
+        loop = aio.get_running_loop()
+        while not self.queue.empty():
+            att = self.queue.get_nowait()
+            try:
+                data = await att.read()
+            except (dc.HTTPException, aiohttp.ClientError, aio.TimeoutError):
+                continue
+            # Hashing and writing a few megabytes is best kept off the event loop.
+            digest = await loop.run_in_executor(None, lambda: hashlib.sha256(data).hexdigest())
+            # The write is queued on self.io along with the index update, without an await in between,
+            # so it can't land between another worker evicting the same file and its removal.
+            stored = loop.run_in_executor(self.io, self.store, digest, data)
+            await loop.run_in_executor(self.io, self.write_index, *self.remember(att.url, digest, att.filename, len(data)))
+            await stored
+
+    def store(self, digest, data):
+        path = self.path(digest)
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as archive_file:
+                archive_file.write(data)
+            os.replace(path + '.tmp', path)
+
+    def remember(self, url, digest, filename, size):
+        """Record a stored file, returning the index lines and evictions for write_index to carry out."""
+        if digest in self.files:
+            self.files.move_to_end(digest)
+        else:
+            self.files[digest] = size
+            self.total += size
+        self.urls[url] = (digest, filename)
+        self.refs[digest] += 1
+        self.index_lines += 1
+        if len(self.urls) > self.max_urls:
+            _, (old_digest, _) = self.urls.popitem(last=False)
+            if old_digest in self.refs:
+                self.refs[old_digest] -= 1
+                self.dead_lines += 1
+        evicted = []
+        while self.total > self.max_total_size and len(self.files) > 1:
+            old_digest, old_size = self.files.popitem(last=False)
+            self.total -= old_size
+            self.dead_lines += self.refs.pop(old_digest, 0)
+            evicted.append(old_digest)
+        if 2 * self.dead_lines > self.index_lines:
+            return self.index_entries(), True, evicted
+        return [f'{url}\t{digest}\t{filename}\n'], False, evicted
+
+    def lookup(self, url):
+        """Returns the local path, original filename and size of an archived attachment, or None."""
+        if (entry := self.urls.get(url)) is None or (size := self.files.get(entry[0])) is None:
+            return None
+        self.files.move_to_end(entry[0])
+        return self.path(entry[0]), entry[1], size
+
+    def attach(self, urls, max_files=10, max_size=8*2**20):
+        """Files for as many archived copies of the given URLs as fit in one message."""
+        files = []
+        for url in urls:
+            if len(files) == max_files:
+                break
+            if (found := self.lookup(url)) is None:
+                continue
+            path, filename, size = found
+            if size > max_size:
+                continue
+            try:
+                files.append(dc.File(path, filename))
+            except OSError:
+                continue
+            max_size -= size
+        return files
@@ -0,0 +1,136 @@
+# Per-channel autoreact rules, compiled into one matcher per channel, and the queue their reactions go out through.
+import re
+from collections import namedtuple
+try:
+    from re import _parser as sre_parse
+except ImportError: # Before Python 3.11.
+    import sre_parse
+
+import asyncio as aio
+
+import discord as dc
+
+attachment_exts = {
+    'image': ('png', 'gif', 'jpg', 'jpeg', 'jpe', 'jfif'),
+    'video': ('mp4', 'webm', 'mov'),
+    'audio': ('mp3', 'ogg', 'wav', 'flac', 'm4a'),
+    }
+ext_kinds = {ext: kind for kind, exts in attachment_exts.items() for ext in exts}
+# 'any' doesn't care about attachments, 'file' wants at least one of any kind.
+attachment_choices = ('any', 'file', *attachment_exts)
+
+AutoReactRule = namedtuple('AutoReactRule', 'rule_id attachments role_id pattern emoji')
+max_pattern_length = 200
+_repeat_ops = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+
+def attachment_kinds(attachments):
+    kinds = {'file'}
+    for att in attachments:
+        if (kind := ext_kinds.get(att.filename.rpartition('.')[2].lower())) is not None:
+            kinds.add(kind)
+    return kinds
+
+def _subpatterns(arg):
+    if isinstance(arg, sre_parse.SubPattern):
+        yield arg
+    elif isinstance(arg, (tuple, list)):
+        for item in arg:
+            yield from _subpatterns(item)
+
+def _backtracks(pattern, repeated=False):
+    # Repeats inside repeats, and alternations inside repeats, are what backtrack exponentially.
+    for op, arg in pattern:
+        if op in _repeat_ops:
+            _, high, body = arg
+            if high > 1 and repeated:
+                return True
+            if _backtracks(body, repeated or high > 1):
+                return True
+        elif op is sre_parse.BRANCH and repeated:
+            return True
+        elif any(_backtracks(sub, repeated) for sub in _subpatterns(arg)):
+            return True
+    return False
+
+def check_pattern(pattern):
+    """Raises re.error if a pattern can't take part in a combined matcher."""
+    # Every message in the channel runs through these on the event loop, so nothing that can blow up.
+    if len(pattern) > max_pattern_length:
+        raise re.error(f'patterns are limited to {max_pattern_length} characters')
+    compiled = re.compile(pattern, re.IGNORECASE)
+    if _backtracks(sre_parse.parse(pattern, re.IGNORECASE)):
+        raise re.error('nested repeats and repeated alternatives are not supported')
+    # Group numbers and names shift once patterns are combined, so nothing may refer back to them.
+    if compiled.groupindex or re.search(r'\\[1-9]|\(\?P=|\(\?\(', pattern):
+        raise re.error('backreferences and named groups are not supported')
+    RuleMatcher([AutoReactRule(0, 'any', None, pattern, '')])
+
+
+class RuleMatcher(object):
+    """
+    Every rule of one channel, with all of their content patterns folded into a single regex.
+    Each pattern sits in an optional lookahead at the start of the message, so one match call
+    says which of them occur anywhere in it, whichever order they occur in.
+    """
+    __slots__ = ('rules', 'regex', 'needs_roles')
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        patterns = ''.join(
+            f'(?:(?=[\\s\\S]*?(?P<r{idx}>{rule.pattern})))?'
+            for idx, rule in enumerate(self.rules) if rule.pattern is not None
+            )
+        self.regex = re.compile(patterns, re.IGNORECASE) if patterns else None
+        self.needs_roles = any(rule.role_id is not None for rule in self.rules)
+
+    def match(self, msg):
+        """The emoji to react to a message with, in rule order and without repeats."""
+        found = self.regex.match(msg.content) if self.regex is not None else None
+        kinds = attachment_kinds(msg.attachments) if msg.attachments else ()
+        # Webhook authors are plain users, without roles.
+        role_ids = {role.id for role in getattr(msg.author, 'roles', ())} if self.needs_roles else ()
+        emojis = []
+        for idx, rule in enumerate(self.rules):
+            if ((rule.attachments != 'any' and rule.attachments not in kinds)
+                or (rule.role_id is not None and rule.role_id not in role_ids)
+                or (rule.pattern is not None and found.start(f'r{idx}') < 0)
+                or rule.emoji in emojis
+                ):
+                continue
+            emojis.append(rule.emoji)
+        return emojis
+
+
+class ReactionQueue(object):
+    """
+    Reactions waiting to be added, a message's worth per entry. The queue is bounded, and new
+    entries are dropped instead of piling up once it is full; a picture flood shouldn't turn
+    into minutes of hearts trickling in behind it.
+    """
+
+    def __init__(self, maxsize=256, workers=2):
+        self.queue = aio.Queue(maxsize)
+        self.workers = workers
+        self.dropped = 0
+        self._workers = []
+
+    def add(self, msg, emojis):
+        try:
+            self.queue.put_nowait((msg, emojis))
+        except aio.QueueFull:
+            self.dropped += 1
+            return
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        if len(self._workers) < self.workers:
+            self._workers.append(aio.ensure_future(self.work()))
+
+    async def work(self):
+        while not self.queue.empty():
+            msg, emojis = self.queue.get_nowait()
+            for emoji in emojis:
+                try:
+                    await msg.add_reaction(emoji)
+                except dc.NotFound: # The message is gone already.
+                    break
+                except dc.HTTPException: # An emoji that was deleted, or a reaction limit.
+                    continue
@@ -6,10 +6,10 @@ from collections import defaultdict
 from heapq import heapify, heappush, heappop
 
 import discord as dc
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 from cogs_textbanks import url_bank, query_bank, response_bank
-from bot_common import bot, CogtextManager
+from bot_common import bot, scheduler, Every, CogtextManager
 
 _unit_dict = {'h': 1, 'd': 24, 'w': 168, 'm': 732, 'y': 8766}
 def _parse_length(length):
@@ -30,11 +30,13 @@ class BanManager(CogtextManager):
         super().__init__(*args, **kwargs)
         self.guild_config = bot.get_cog('GuildConfiguration')
         print(response_bank.process_mutelist)
-        self.manage_mutelist.start()
+        # Every sweep catches up on all expired mutes anyway, so one at startup is all a restart needs.
+        scheduler.register(self.manage_mutelist, Every(minutes=30), catch_up='skip', immediate=True)
+        print(response_bank.process_mutelist_complete)
 
     def cog_unload(self):
         super().cog_unload()
-        self.manage_mutelist.cancel()
+        scheduler.cancel(self.manage_mutelist.__qualname__)
 
     def push(self, id_tuple, unban_dt):
         for entry in self.data:
@@ -53,7 +55,6 @@ class BanManager(CogtextManager):
                 heapify(self.data)
                 break
 
-    @tasks.loop(minutes=30)
     async def manage_mutelist(self):
         now = datetime.utcnow()
         while self.data and self.data[0][0] <= now:
@@ -91,11 +92,6 @@ class BanManager(CogtextManager):
                         )
                     await self.guild_config.log(guild, 'modlog', embed=embed)
 
-    @manage_mutelist.before_loop
-    async def prepare_mutelist(self):
-        await self.bot.wait_until_ready()
-        print(response_bank.process_mutelist_complete)
-
     @commands.group(name='channel')
     @commands.has_guild_permissions(send_messages=True, manage_roles=True)
     async def role_mute(self, ctx):
@@ -1,13 +1,34 @@
 # The MetaCommand Cog, which handles all batch commands.
+import copy
+from time import perf_counter
 from pathlib import Path
 
+import asyncio as aio
+
 import discord as dc
 from discord.ext import commands
 
 from cogs_textbanks import url_bank, query_bank, response_bank
+from cogs_logsender import text_file
 from bot_common import bot, CONST_AUTHOR, user_or_perms
 
 _CMD_DIR = Path('cmd')
+_MAX_PARALLEL = 10
+
+def parse_batch(lines):
+    """
+    Split a batch file into stages of (line number, command) pairs. A line of --- is a barrier:
+    everything before it finishes before anything after it starts. Blank lines and # comments are skipped.
+    """
+    stages = [[]]
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if line == '---':
+            if stages[-1]:
+                stages.append([])
+        elif line and not line.startswith('#'):
+            stages[-1].append((lineno, line))
+    return [stage for stage in stages if stage]
 
 
 class BatchCommands(commands.Cog):
@@ -50,22 +71,72 @@ class BatchCommands(commands.Cog):
     async def batch_save_error(self, ctx, error):
         raise error
 
+    async def run_line(self, ctx, content):
+        # Each line runs as its own copy of the invoking message. It stays authored by whoever ran
+        # the batch, as discord.py ignores commands from the bot itself and checks their permissions.
+        msg = copy.copy(ctx.message)
+        msg.content = content
+        line_ctx = await self.bot.get_context(msg)
+        if not line_ctx.valid:
+            return 'unknown command'
+        # What Bot.invoke does, but keeping hold of the error; Bot.invoke hands it to the
+        # error handlers and on_command_error and returns nothing.
+        self.bot.dispatch('command', line_ctx)
+        try:
+            if not await self.bot.can_run(line_ctx, call_once=True):
+                raise commands.CheckFailure('The global check once functions failed.')
+            await line_ctx.command.invoke(line_ctx)
+        except commands.CommandError as exc:
+            try:
+                await line_ctx.command.dispatch_error(line_ctx, exc)
+            except Exception: # Handlers that reraise; the line's own error is the one to report.
+                pass
+            exc = getattr(exc, 'original', exc)
+            return f'{type(exc).__name__}: {exc}'
+        self.bot.dispatch('command_completion', line_ctx)
+        return None
+
+    async def run_batch(self, ctx, stages, parallel):
+        results = []
+        limit = aio.Semaphore(parallel)
+
+        async def timed_line(lineno, content):
+            async with limit:
+                start = perf_counter()
+                error = await self.run_line(ctx, content)
+                results.append((lineno, content, perf_counter() - start, error))
+
+        for stage in stages:
+            await aio.gather(*(timed_line(lineno, content) for lineno, content in stage))
+        results.sort()
+        return results
+
     @batch.command(name='exec')
-    async def batch_exec(self, ctx, name):
+    async def batch_exec(self, ctx, name, parallel: int=1):
         if not (fp := _CMD_DIR / f'{name}.txt').exists():
             await ctx.send(response_bank.batch_exec_name_error.format(name=name))
             return
-        await ctx.send(response_bank.batch_exec_start.format(name=name))
+        if not 1 <= parallel <= _MAX_PARALLEL:
+            await ctx.send(response_bank.batch_exec_parallel_error.format(limit=_MAX_PARALLEL))
+            return
         with fp.open('r') as cmdfile:
-            msg = ctx.message
-            msg.author = bot.user
-            for line in cmdfile:
-                msg.content = line.strip()
-                try:
-                    await self.bot.process_commands(msg)
-                except Exception as exc:
-                    await ctx.send(f'{type(exc).__name__}: {"".join(exc.args)}')
-                    raise
+            stages = parse_batch(cmdfile)
+        await ctx.send(response_bank.batch_exec_start.format(name=name))
+        start = perf_counter()
+        results = await self.run_batch(ctx, stages, parallel)
+        elapsed = perf_counter() - start
+        report = '\n'.join(
+            f'{lineno:>4} {line_time*1000:>8.1f}ms {error or "ok"}: {content}'
+            for lineno, content, line_time, error in results
+            )
+        summary = response_bank.batch_exec_complete.format(
+            name=name, count=len(results), elapsed=elapsed,
+            failed=sum(error is not None for *_, error in results),
+            )
+        if len(summary) + len(report) < 1900:
+            await ctx.send(f'{summary}\n```{report}```')
+        else:
+            await ctx.send(summary, file=text_file(report, f'{name}-report.txt'))
 
     @batch_exec.error
     async def batch_exec_error(self, ctx, error):
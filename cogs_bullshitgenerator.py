@@ -39,6 +39,8 @@ class BullshitGenerator(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        print('D--> READY TO SHIT.') # Printed here, since this cog is loaded after ready has fired.
+        # self.embed = dc.Embed().set_author(icon_url=bot.user.avatar_url)
 
     def sample(self, pools, total):
         return zip(*(random.sample(map(str.strip, pool), total) for pool in pools))
@@ -60,11 +62,6 @@ class BullshitGenerator(commands.Cog):
             icon_url=client.avatar_url,
             ))
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        print('D--> READY TO SHIT.')
-        # self.embed = dc.Embed().set_author(icon_url=bot.user.avatar_url)
-
     @commands.command(name='interlinked')
     @commands.bot_has_permissions(send_messages=True)
     async def interlinked(self, ctx):
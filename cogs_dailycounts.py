@@ -4,10 +4,10 @@ from collections import Counter
 import asyncio as aio
 
 import discord as dc
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 from cogs_textbanks import url_bank, query_bank, response_bank
-from bot_common import bot, guild_whitelist, CONST_ADMINS, CONST_AUTHOR
+from bot_common import bot, guild_whitelist, scheduler, Cron, CONST_ADMINS, CONST_AUTHOR
 
 class DailyCounter(commands.Cog):
     
@@ -19,9 +19,13 @@ class DailyCounter(commands.Cog):
             guild_id: Counter({'join': 0, 'leave': 0, 'ban': 0})
             for guild_id in guild_whitelist
             }
+        print(response_bank.process_dailies)
+        # Counts don't survive a restart, so a missed midnight has nothing worth posting.
+        scheduler.register(self.post_dailies, Cron('0 0 * * *'), catch_up='skip')
+        print(response_bank.process_dailies_complete)
 
     def cog_unload(self):
-        self.post_dailies.cancel()
+        scheduler.cancel(self.post_dailies.__qualname__)
 
     def create_embed(self, guild, author, msg):
         guild_id = guild.id
@@ -42,11 +46,6 @@ class DailyCounter(commands.Cog):
         embed.add_field(name='**DISCLAIMER**:', value=msg, inline=False)
         return embed
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        print(response_bank.process_dailies)
-        self.post_dailies.start()
-
     @commands.Cog.listener()
     async def on_member_join(self, member):
         guild = member.guild
@@ -69,7 +68,6 @@ class DailyCounter(commands.Cog):
         if msg.guild.id in guild_whitelist:
             self.daily_msg[msg.guild.id][msg.channel.id] += 1
 
-    @tasks.loop(hours=24)
     async def post_dailies(self):
         for guild_id, admin_id in zip(guild_whitelist, (CONST_ADMINS[1], CONST_AUTHOR[0])):
             guild = bot.get_guild(guild_id)
@@ -87,15 +85,6 @@ class DailyCounter(commands.Cog):
                 embed=embed,
                 )
 
-    @post_dailies.before_loop
-    async def post_dailies_start_delay(self):
-        await self.bot.wait_until_ready()
-        print(response_bank.process_dailies_complete)
-        now = datetime.utcnow()
-        await aio.sleep(
-            (datetime.combine(now.date() + timedelta(1), datetime.min.time()) - now).seconds
-            )
-
     @commands.command(name='daily')
     @commands.has_guild_permissions(manage_roles=True)
     async def force_daily_post(self, ctx):
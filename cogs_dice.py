@@ -0,0 +1,135 @@
+# Dice engine for the roll command.
+import re
+import heapq
+import random
+from collections import Counter
+
+max_dice = 1000000 # Across the whole expression; this is what bounds the work, not the output.
+max_faces = 1000000000
+max_terms = 20
+term_pattern = re.compile(
+    r'\s*([-+])\s*(?:(\d*)\s*d\s*(\d+)(?:\s*(kh|kl|k|dh|dl|d)\s*(\d+))?|(\d+))\s*',
+    re.IGNORECASE,
+    )
+
+class DiceSyntaxError(ValueError):
+    pass
+
+class DiceRangeError(ValueError):
+    pass
+
+
+class DiceGroup(object):
+    """NdM, optionally keeping only the highest or lowest few dice."""
+    __slots__ = ('count', 'faces', 'keep', 'keep_high', 'rolls', 'total')
+
+    def __init__(self, count, faces, keep=None, keep_high=True):
+        self.count = count
+        self.faces = faces
+        self.keep = keep if keep is None or keep < count else None
+        self.keep_high = keep_high
+        self.rolls = ()
+        self.total = 0
+
+    def __str__(self):
+        if self.keep is None:
+            return f'{self.count}d{self.faces}'
+        return f'{self.count}d{self.faces}k{"h" if self.keep_high else "l"}{self.keep}'
+
+    def roll(self, loaded=False):
+        if loaded:
+            self.rolls = [self.faces] * self.count
+        else:
+            self.rolls = random.choices(range(1, self.faces+1), k=self.count)
+        self.total = total = sum(self.rolls)
+        if self.keep is not None:
+            # Select whichever side of the split is smaller, in O(n log k).
+            drop = self.count - self.keep
+            if self.keep <= drop:
+                self.total = sum((heapq.nlargest if self.keep_high else heapq.nsmallest)(self.keep, self.rolls))
+            else:
+                self.total = total - sum((heapq.nsmallest if self.keep_high else heapq.nlargest)(drop, self.rolls))
+
+    def breakdown(self):
+        if self.keep is None:
+            return f'({" + ".join(map(str, self.rolls))})'
+        order = sorted(range(self.count), key=self.rolls.__getitem__, reverse=self.keep_high)
+        dropped = set(order[self.keep:])
+        return '({})'.format(' + '.join(
+            f'[{roll}]' if idx in dropped else str(roll) for idx, roll in enumerate(self.rolls)
+            ))
+
+
+class DiceRoll(object):
+    """
+    A compound dice expression such as 4d6kh3 + 2d8 - 1. kN/khN and klN keep the highest or
+    lowest N dice, while dN/dlN and dhN drop them. Parsing validates the expression, and roll()
+    does the work, which the caller may want to push off the event loop for big rolls.
+    """
+
+    def __init__(self, expr):
+        self.terms = []
+        pos = 0
+        expr = expr.strip()
+        if expr[:1] not in ('+', '-'):
+            expr = '+' + expr
+        while pos < len(expr):
+            if not (match := term_pattern.match(expr, pos)) or len(self.terms) == max_terms:
+                raise DiceSyntaxError(expr[pos:])
+            pos = match.end()
+            sign = -1 if match[1] == '-' else 1
+            if match[6] is not None:
+                self.terms.append((sign, int(match[6])))
+                continue
+            count, faces = int(match[2] or 1), int(match[3])
+            if count <= 0 or faces <= 0:
+                raise DiceRangeError(match[0])
+            if faces > max_faces:
+                raise OverflowError(match[0])
+            keep, keep_high = None, True
+            if (mode := (match[4] or '').lower()):
+                amount = int(match[5])
+                keep_high = mode in ('k', 'kh', 'd', 'dl')
+                keep = amount if mode.startswith('k') else count - amount
+                if keep <= 0:
+                    raise DiceRangeError(match[0])
+            self.terms.append((sign, DiceGroup(count, faces, keep, keep_high)))
+        if not self.terms:
+            raise DiceSyntaxError(expr)
+        self.groups = [term for _, term in self.terms if isinstance(term, DiceGroup)]
+        self.size = sum(group.count for group in self.groups)
+        if self.size > max_dice:
+            raise OverflowError(expr)
+        self.total = 0
+        self.histogram = Counter()
+
+    def __str__(self):
+        text = ' '.join(f'{"-" if sign < 0 else "+"} {term}' for sign, term in self.terms)
+        return text[2:] if text.startswith('+') else f'-{text[2:]}'
+
+    def roll(self, loaded=False):
+        self.total = 0
+        self.histogram = Counter()
+        for sign, term in self.terms:
+            if isinstance(term, DiceGroup):
+                term.roll(loaded)
+                self.histogram.update(term.rolls) # Counting is one pass in C.
+                term = term.total
+            self.total += sign * term
+        return self.total
+
+    def breakdown(self):
+        text = ' '.join(
+            f'{"-" if sign < 0 else "+"} {term.breakdown() if isinstance(term, DiceGroup) else term}'
+            for sign, term in self.terms
+            )
+        text = text[2:] if text.startswith('+') else f'-{text[2:]}'
+        return f'{text} = {self.total}'
+
+    def stats(self):
+        """Returns the min, max, mean and first mode of every die rolled, all from the histogram."""
+        if not self.histogram:
+            return None
+        histogram = self.histogram
+        mean = sum(face*count for face, count in histogram.items()) / self.size
+        return min(histogram), max(histogram), mean, histogram.most_common(1)[0][0]
@@ -1,27 +1,42 @@
 # Guild Configuration Cog, for managing guild settings and bot features.
 import os
+import re
 import pickle
+from typing import Optional, Union
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, Counter
 
 import asyncio as aio
 import discord as dc
 from discord.ext import commands, tasks
 
 import sqlalchemy as sql
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from cogs_textbanks import url_bank, query_bank, response_bank
+from cogs_modtools import AuditLogTailer, RoleRestorer
+from cogs_logsender import TextBundler, LogSender, BurstAggregator, text_file, zip_file
+from cogs_messagecache import MessageCache, CachedMessage
+from cogs_archiver import AttachmentArchiver
+from cogs_autoreact import AutoReactRule, RuleMatcher, ReactionQueue, attachment_choices, check_pattern
+from cogs_perftracker import startup_profiler
 from bot_common import (
-    bot, member_stalker, guild_whitelist, CogtextManager, sql_engine, sql_metadata
+    bot, member_stalker, guild_whitelist, CogtextManager, sql_engine, sql_metadata, sql_writer
     )
 
 modref = dc.Permissions(
     administrator=True, manage_channels=True,
     manage_roles=True, manage_nicknames=True,
     )
-image_exts = ('png', 'gif', 'jpg', 'jpeg', 'jpe', 'jfif')
+heart_rule = AutoReactRule(None, 'image', None, None, '❤️') # What a plain autoreact channel does.
 avy_chid = 664541525350547496
 att_chid = 696209752434278400
+# Message contents kept for logging edits and deletes of messages discord.py no longer caches.
+message_cache_budget = 32 * 2**20 # Bytes.
+message_cache_compress_over = 512 # Bytes, or None to never compress.
+# Attachments from channels toggled with togglearchive are kept here for the delete log.
+archive_root = os.path.join('data', 'attachments')
+archive_max_size = 2 * 2**30 # Bytes, after which the least recently used files go.
 
 async def grab_avatar(user):
     avy_channel = bot.get_channel(avy_chid)
@@ -30,8 +45,7 @@ async def grab_avatar(user):
             await user.avatar_url.save(avatarfile)
         except dc.NotFound:
             return url_bank.null_avatar
-    msg_id = hex(member_stalker.member_data['avatar_count'])[2:]
-    member_stalker.member_data['avatar_count'] += 1
+    msg_id = hex(member_stalker.take_count('avatar_count'))[2:]
     with open('avatar.png', mode='rb') as avatarfile:
         await avy_channel.send(
             f'`@{user}`: UID {user.id}: MID {msg_id}',
@@ -41,10 +55,6 @@ async def grab_avatar(user):
         if msg.content.split()[-1] == msg_id:
             return msg.attachments[0].url
 
-async def grab_attachments(msg):
-    pass
-
-
 class GuildConfiguration(commands.Cog):
 
     log_map = {
@@ -54,6 +64,7 @@ class GuildConfiguration(commands.Cog):
         'autoreact': 'AutoReactChanId',
         'ignoreplebs': 'IgnoreChanId',
         'enablelatex': 'LatexChanId',
+        'archive': 'ArchiveChanId',
         }
     table_map = {
         'usrlog': 'GuildConfig',
@@ -62,11 +73,23 @@ class GuildConfiguration(commands.Cog):
         'autoreact': 'AutoReactConfig',
         'ignoreplebs': 'IgnoreConfig',
         'enablelatex': 'LatexConfig',
+        'archive': 'ArchiveConfig',
         }
+    channel_fields = ('autoreact', 'ignoreplebs', 'enablelatex', 'archive')
+    delete_burst = 3 # More deletes than this in one channel at once are logged as a single transcript.
 
     def __init__(self, bot):
         self.bot = bot
-        self.data_load()
+        self.ban_tailers = {}
+        self.text_bundlers = {}
+        self.log_senders = {}
+        self.message_cache = MessageCache(message_cache_budget, message_cache_compress_over)
+        self.archiver = AttachmentArchiver(archive_root, max_total_size=archive_max_size)
+        self.delete_bursts = BurstAggregator(self.flush_deletes)
+        self.role_restorer = RoleRestorer(member_stalker)
+        self.reactions = ReactionQueue()
+        with startup_profiler.phase('data_load GuildConfiguration'):
+            self.data_load()
 
     def data_load(self):
         is_new_style = True
@@ -80,9 +103,8 @@ class GuildConfiguration(commands.Cog):
                 sql.Column('MsgLogChanId', sql.Integer, nullable=True),
                 sql.Column('ModLogChanId', sql.Integer, nullable=True),
                 )
-            sql_metadata.create_all(sql_engine)
             is_new_style = False
-        for field in ('autoreact', 'ignoreplebs', 'enablelatex'):
+        for field in self.channel_fields:
             table_name = self.table_map[field]
             try:
                 self.__setattr__(field, sql_metadata.tables[table_name])
@@ -92,97 +114,162 @@ class GuildConfiguration(commands.Cog):
                     sql.Column(self.log_map[field], sql.Integer, nullable=False, primary_key=True),
                     sql.Column('GuildId', sql.ForeignKey('GuildConfig.GuildId'), nullable=False),
                     ))
-                sql_metadata.create_all(sql_engine)
-                is_new_style = False
-        if not is_new_style:
-            with open(os.path.join('data', 'config.pkl'), 'rb') as config_file:
-                data = pickle.load(config_file)
-            with sql_engine.connect() as dbconn:
-                for guild_id, config in data.items():
-                    dbconn.execute(self.guild_config.insert(
-                        GuildId=guild_id,
-                        UsrLogChanId=config['usrlog'],
-                        MsgLogChanId=config['msglog'],
-                        ModLogChanId=config['modlog'],
-                        ))
-                    for field in ('autoreact', 'ignoreplebs', 'enablelatex'):
-                        dbconn.execute(
-                            getattr(self, field).insert(),
-                            [{self.log_map[field]: chan_id, 'GuildId': guild_id} for chan_id in config[field]],
-                            )
-                dbconn.commit()
+        try:
+            self.react_rule_table = sql_metadata.tables['AutoReactRules']
+        except KeyError:
+            self.react_rule_table = sql.Table(
+                'AutoReactRules', sql_metadata,
+                sql.Column('RuleId', sql.Integer, nullable=False, primary_key=True),
+                sql.Column('GuildId', sql.ForeignKey('GuildConfig.GuildId'), nullable=False),
+                sql.Column('ChanId', sql.Integer, nullable=False),
+                sql.Column('Attachments', sql.String, nullable=False),
+                sql.Column('RoleId', sql.Integer, nullable=True),
+                sql.Column('Pattern', sql.String, nullable=True),
+                sql.Column('Emoji', sql.String, nullable=False),
+                )
+        sql_metadata.create_all(sql_engine)
+        if not is_new_style and os.path.exists(os.path.join('data', 'config.pkl')):
+            self.migrate_pickle()
+        # Statements are built once and reused with bound parameters,
+        # so SQLAlchemy and SQLite only ever compile and prepare them once.
+        self.set_log_stmts = {}
+        for log in ('usrlog', 'msglog', 'modlog'):
+            insert = sqlite_insert(self.guild_config)
+            column = self.log_map[log]
+            self.set_log_stmts[log] = insert.on_conflict_do_update(
+                index_elements=['GuildId'], set_={column: insert.excluded[column]},
+                )
+        self.add_channel_stmts = {}
+        self.del_channel_stmts = {}
+        for field in self.channel_fields:
+            table = getattr(self, field)
+            column = getattr(table.c, self.log_map[field])
+            self.add_channel_stmts[field] = table.insert()
+            self.del_channel_stmts[field] = table.delete().where(column == sql.bindparam('ChanId'))
+        self.add_rule_stmt = self.react_rule_table.insert()
+        self.del_rule_stmt = self.react_rule_table.delete().where(
+            self.react_rule_table.c.RuleId == sql.bindparam('Id'),
+            )
+        self.cache_load()
+
+    def migrate_pickle(self):
+        with open(os.path.join('data', 'config.pkl'), 'rb') as config_file:
+            data = pickle.load(config_file)
+        with sql_engine.begin() as dbconn: # All of it in one transaction.
+            for guild_id, config in data.items():
+                dbconn.execute(self.guild_config.insert().values(
+                    GuildId=guild_id,
+                    UsrLogChanId=config['usrlog'],
+                    MsgLogChanId=config['msglog'],
+                    ModLogChanId=config['modlog'],
+                    ))
+                for field in ('autoreact', 'ignoreplebs', 'enablelatex'):
+                    if not config[field]:
+                        continue
+                    dbconn.execute(
+                        getattr(self, field).insert(),
+                        [{self.log_map[field]: chan_id, 'GuildId': guild_id} for chan_id in config[field]],
+                        )
+
+    def cache_load(self):
+        """
+        Read the whole config into memory. It is a handful of rows per guild, and every
+        event handler needs it, so lookups never touch SQLite; writes go through sql_writer.
+        """
+        self.log_cache = {}
+        self.channel_cache = {field: defaultdict(set) for field in self.channel_fields}
+        with sql_engine.connect() as dbconn:
+            for row in dbconn.execute(sql.select(self.guild_config)):
+                self.log_cache[row.GuildId] = {
+                    log: getattr(row, self.log_map[log]) for log in ('usrlog', 'msglog', 'modlog')
+                    }
+            for field, guild_channels in self.channel_cache.items():
+                table = getattr(self, field)
+                for chan_id, guild_id in dbconn.execute(
+                    sql.select(getattr(table.c, self.log_map[field]), table.c.GuildId)
+                    ):
+                    guild_channels[guild_id].add(chan_id)
+            self.react_rules = defaultdict(dict) # channel_id -> rule_id -> AutoReactRule
+            self.react_rule_guilds = {} # channel_id -> guild_id, for channels with rules
+            for row in dbconn.execute(sql.select(self.react_rule_table)):
+                self.react_rules[row.ChanId][row.RuleId] = AutoReactRule(
+                    row.RuleId, row.Attachments, row.RoleId, row.Pattern, row.Emoji,
+                    )
+                self.react_rule_guilds[row.ChanId] = row.GuildId
+        self.next_rule_id = max((max(rules) for rules in self.react_rules.values()), default=0) + 1
+        self.react_matchers = {}
+        for chan_id, guild_id in self.react_rule_guilds.items():
+            self.compile_reacts(guild_id, chan_id)
+        for guild_id, chan_ids in self.channel_cache['autoreact'].items():
+            for chan_id in chan_ids:
+                self.compile_reacts(guild_id, chan_id)
+
+    def compile_reacts(self, guild_id, channel_id):
+        # Matchers are only rebuilt when a channel's rules change, never per message.
+        rules = list(self.react_rules.get(channel_id, {}).values())
+        if channel_id in self.channel_cache['autoreact'].get(guild_id, ()):
+            rules.insert(0, heart_rule)
+        if rules:
+            self.react_matchers[channel_id] = RuleMatcher(rules)
+        else:
+            self.react_matchers.pop(channel_id, None)
 
     def getlog(self, guild, log):
-        return self.get_channel_ids(guild, log)[0]
+        try:
+            return self.log_cache[guild.id][log]
+        except KeyError:
+            return None
 
     def get_channel_ids(self, guild, log):
         if log in ('usrlog', 'msglog', 'modlog'):
-            table = self.guild_config
-        else:
-            table = getattr(self, log)
-        with sql_engine.connect() as dbconn:
-            return [row[0] for row in dbconn.execute(sql
-                .select(getattr(table.c, self.log_map[log]))
-                .where(table.c.GuildId == guild.id)
-                )]
+            channel_id = self.getlog(guild, log)
+            return () if channel_id is None else (channel_id,)
+        return self.channel_cache[log].get(guild.id, ())
 
-    async def log(self, guild, log, *args, **kwargs):
+    async def log(self, guild, log, content=None, *, embed=None, file=None, files=None):
+        """Queue a message for a log channel. It is sent in order, batched with its neighbours if it can be."""
         channel_id = self.getlog(guild, log)
-        await self.bot.get_channel(channel_id).send(*args, **kwargs)
+        if (sender := self.log_senders.get(channel_id)) is None:
+            sender = self.log_senders[channel_id] = LogSender(self.bot.get_channel(channel_id))
+        sender.send(content, embed=embed, file=file, files=files)
 
     def check_disabled(self, msg, log):
         perms = msg.author.guild_permissions
         return ((perms.value & modref.value)
-            or msg.channel.id not in self.get_channel_ids(guild, log)
+            or msg.channel.id not in self.get_channel_ids(msg.guild, log)
             )
 
     def check_enabled(self, msg, log):
         perms = msg.author.guild_permissions
         return ((perms.value & modref.value)
-            or msg.channel.id in self.get_channel_ids(guild, log)
+            or msg.channel.id in self.get_channel_ids(msg.guild, log)
             )
 
     async def setlog(self, ctx, log):
         if log not in ('usrlog', 'msglog', 'modlog'):
             await ctx.send(response_bank.config_args_error.format(log=log))
             return
-        with sql_engine.connect() as dbconn:
-            guild_id = ctx.guild.id
-            if dbconn.execute(self.guild_config.select()
-                .where(self.guild_config.c.GuildId == guild_id)
-                ):
-                dbconn.execute(self.guild_config.update()
-                    .where(self.guild_config.c.GuildId == guild_id)
-                    .values(**{self.log_map[log]: ctx.channel.id})
-                    )
-            else:
-                dbconn.execute(
-                    self.guild_config.insert(),
-                    [{self.log_map[log]: ctx.channel.id, 'GuildId': guild_id}],
-                    )
-            dbconn.commit()
+        guild_id = ctx.guild.id
+        await sql_writer.submit(
+            self.set_log_stmts[log], {'GuildId': guild_id, self.log_map[log]: ctx.channel.id},
+            )
+        # The caches only change once the write is committed, so a failed one leaves them as they were.
+        guild_logs = self.log_cache.setdefault(guild_id, dict.fromkeys(('usrlog', 'msglog', 'modlog')))
+        guild_logs[log] = ctx.channel.id
         await ctx.send(response_bank.config_completion.format(log=log))
 
-    def toggle(self, ctx, log):
-        with sql_engine.connect() as dbconn:
-            table = getattr(self, log)
-            col = getattr(table.c, self.log_map[log])
-            channel_ids = [row[0] for row in dbconn.execute(
-                sql.select(col)
-                .where(table.c.GuildId == ctx.guild.id)
-                )]
-            channel_id = ctx.channel.id
-            if channel_id in channel_ids:
-                dbconn.execute(table.delete().where(col == channel_id))
-                dbconn.commit()
-                return False
-            else:
-                dbconn.execute(
-                    table.insert(),
-                    [{self.log_map[log]: channel_id, 'GuildId': ctx.guild.id}],
-                    )
-                dbconn.commit()
-                return True
+    async def toggle(self, ctx, log):
+        guild_channels = self.channel_cache[log][ctx.guild.id]
+        channel_id = ctx.channel.id
+        if channel_id in guild_channels:
+            await sql_writer.submit(self.del_channel_stmts[log], {'ChanId': channel_id})
+            guild_channels.discard(channel_id)
+            return False
+        await sql_writer.submit(
+            self.add_channel_stmts[log], {self.log_map[log]: channel_id, 'GuildId': ctx.guild.id},
+            )
+        guild_channels.add(channel_id)
+        return True
 
     @commands.Cog.listener()
     async def on_member_join(self, member): # Log joined members
@@ -190,7 +277,7 @@ class GuildConfiguration(commands.Cog):
         if not self.getlog(guild, 'usrlog'):
             return
         member_stalker.update('first_join', member)
-        await member_stalker.load_roles(member)
+        self.role_restorer.queue(member)
         embed = dc.Embed(
             color=dc.Color.green(),
             timestamp=datetime.utcnow(),
@@ -201,18 +288,17 @@ class GuildConfiguration(commands.Cog):
         embed.set_author(name=f'A user has joined the server!')
         embed.set_thumbnail(url=member.avatar_url)
         embed.add_field(name='**User ID**', value=f'`{member.id}`')
-        # TODO: make extensible
         banfield = "<:tereziGun:334848458940874752>"
-        if ("RTFKT" in member.name):
-            embed.add_field(name=banfield, value="banned for nft")
-            await member.ban()
-        else:
-            embed.add_field(name=banfield, value="passed checks")
+        raid_guard = self.bot.get_cog('RaidGuard') # Does the actual banning.
+        verdict = raid_guard.verdict(member) if raid_guard is not None else None
+        embed.add_field(name=banfield, value=verdict or "passed checks")
         await self.log(guild, 'usrlog', embed=embed)
 
     @commands.Cog.listener()
     async def on_member_update(self, bfr, aft): # Log role and nickname changes
         guild = bfr.guild
+        if bfr.roles != aft.roles and self.getlog(guild, 'usrlog') and not self.role_restorer.is_queued(aft):
+            member_stalker.update('last_roles', aft) # Keep the snapshot current, not just as of the last leave.
         if not self.getlog(guild, 'msglog'):
             return
         if bfr.nick != aft.nick:
@@ -251,7 +337,9 @@ class GuildConfiguration(commands.Cog):
         if not self.getlog(guild, 'usrlog'):
             return
         member_stalker.update('first_join', member)
-        member_stalker.update('last_roles', member)
+        if not self.role_restorer.cancel(member):
+            # Left before their roles came back, so keep what they had last time.
+            member_stalker.update('last_roles', member)
         now = datetime.utcnow()
         lastseen = member_stalker.get('last_seen', member)
         if lastseen is not None:
@@ -272,8 +360,9 @@ class GuildConfiguration(commands.Cog):
         embed.add_field(
             name='**Roles Snagged:**',
             value=(', '.join(
-                    f'`{guild.get_role(role).name}`'
-                    for role in member_stalker.get('last_roles', member)
+                    f'`{role.name}`'
+                    for role in map(guild.get_role, member_stalker.get('last_roles', member))
+                    if role is not None
                     )
                 or None),
             inline=False)
@@ -284,12 +373,11 @@ class GuildConfiguration(commands.Cog):
     async def on_member_ban(self, guild, user): # Log member full bans
         if not self.getlog(guild, 'modlog'):
             return
-        async for entry in guild.audit_logs(limit=256, action=dc.AuditLogAction.ban):
-            if entry.target.id == user.id:
-                break
-        else:
+        if (tailer := self.ban_tailers.get(guild.id)) is None:
+            tailer = self.ban_tailers[guild.id] = AuditLogTailer(guild, dc.AuditLogAction.ban)
+        if (entry := await tailer.find(user.id)) is None:
             await self.log(
-                guild,
+                guild, 'modlog',
                 f'The last ban of {user} `{user.id}` could not be found in the audit log.',
                 )
             return
@@ -309,8 +397,9 @@ class GuildConfiguration(commands.Cog):
         embed.add_field(
             name='**Roles Snagged:**',
             value=(', '.join(
-                    f'`{guild.get_role(role).name}`'
-                    for role in member_stalker.get('last_roles', user)
+                    f'`{role.name}`'
+                    for role in map(guild.get_role, member_stalker.get('last_roles', user))
+                    if role is not None
                     )
                 or None),
             inline=False)
@@ -385,81 +474,195 @@ class GuildConfiguration(commands.Cog):
         if msg.guild is None:
             return
         member_stalker.update('last_seen', msg)
+        if msg.author != bot.user and self.getlog(msg.guild, 'msglog'):
+            self.message_cache.add(msg)
+            if msg.attachments and msg.channel.id in self.get_channel_ids(msg.guild, 'archive'):
+                self.archiver.watch(msg)
         ctx = await bot.get_context(msg)
         dont_ignore = self.check_disabled(msg, 'ignoreplebs')
         if ctx.valid:
             if dont_ignore:
                 await bot.process_commands(msg)
-        elif dont_ignore and msg.content.strip().lower() in query_bank.affirmation:
-            await msg.channel.send(response_bank.affirmation_response)
-        elif (msg.channel.id in self.get_channel_ids(msg.guild, 'autoreact')
-            and any(any(map(att.url.lower().endswith, image_exts)) for att in msg.attachments)
-            ):
-            await msg.add_reaction('❤️')
+        elif (matcher := self.react_matchers.get(msg.channel.id)) is not None and (emojis := matcher.match(msg)):
+            self.reactions.add(msg, emojis)
        
+    def text_bundler(self, guild):
+        if (bundler := self.text_bundlers.get(guild.id)) is None:
+            async def send_archive(archive):
+                await self.log(guild, 'msglog', file=archive)
+            bundler = self.text_bundlers[guild.id] = TextBundler(send_archive)
+        return bundler
+
+    def overflow_note(self, guild, fname, text, files):
+        # Long texts become attachments, or go into the next archive during a burst of them.
+        file, archive = self.text_bundler(guild).attach(fname, text)
+        if file is not None:
+            files.append(file)
+            return f'it is attached as `{fname}`'
+        return f'it is in `{fname}` in the upcoming `{archive}`'
+
+    async def log_edit(self, guild, msg_id, channel, author, author_id, avatar_url, before, after, edited_at, jump_url):
+        files = []
+        if len(before) <= 1024:
+            bfrmsg = before
+        else:
+            note = self.overflow_note(guild, f'{msg_id}-old.txt', before, files)
+            bfrmsg = f'`D--> The pre-edit message is too long to contain, {note}.`'
+        if len(after) <= 1024:
+            aftmsg = after
+        else:
+            note = self.overflow_note(guild, f'{msg_id}-new.txt', after, files)
+            aftmsg = f'`D--> The post-edit message is too long to contain, {note}.` {jump_url}'
+        embed = dc.Embed(color=dc.Color.gold(), timestamp=edited_at or datetime.utcnow())
+        embed.set_author(name=f'@{author} edited a message in #{channel}:', icon_url=avatar_url)
+        embed.add_field(name='**Before:**', value=bfrmsg, inline=False)
+        embed.add_field(name='**After:**', value=aftmsg, inline=False)
+        embed.add_field(name='**Message ID:**', value=f'`{msg_id}`')
+        embed.add_field(name='**User ID:**', value=f'`{author_id}`')
+        await self.log(guild, 'msglog', embed=embed, files=files or None)
+
+    async def log_delete(self, guild, msg_id, channel, author, author_id, avatar_url, content, attachments):
+        files = []
+        if len(content) > 2048:
+            note = self.overflow_note(guild, f'{msg_id}.txt', content, files)
+            content = f'`D--> The deleted message is too long to contain, {note}.`'
+        embed = dc.Embed(
+            color=dc.Color.darker_grey(),
+            timestamp=dc.utils.snowflake_time(msg_id),
+            description=content,
+            )
+        embed.set_author(name=f'@{author} deleted a message in #{channel}:', icon_url=avatar_url)
+        embed.add_field(name='**Message ID:**', value=f'`{msg_id}`')
+        embed.add_field(name='**User ID:**', value=f'`{author_id}`')
+        if attachments:
+            # Copies archived when the message was posted; Discord's links die with the message.
+            archived = self.archiver.attach(attachments, max_files=10-len(files))
+            files.extend(archived)
+            embed.add_field(name='**Attachments:**', value='\n'.join(attachments), inline=False)
+            if archived:
+                embed.add_field(
+                    name='**Archived:**', value=', '.join(f'`{file.filename}`' for file in archived), inline=False,
+                    )
+        await self.log(guild, 'msglog', embed=embed, files=files or None)
+
+    def cached_author(self, cached):
+        # The author may have left since, so fall back on the name that was cached.
+        if (user := bot.get_user(cached.author_id)) is not None:
+            return user, user.avatar_url
+        return cached.author, url_bank.null_avatar
+
     @commands.Cog.listener()
     async def on_message_edit(self, bfr, aft): # Log edited messages
+        self.message_cache.update(aft.id, aft.content)
         if bfr.author == bot.user or bfr.content == aft.content:
             return
         guild = bfr.guild
         if not self.getlog(guild, 'msglog'):
             return
-        if len(bfr.content) <= 1024:
-            bfrmsg = bfr.content
-            long_edit = False
-        else:
-            bfrmsg = '`D--> The pre-edit message is too long to contain.`'
-            long_edit = True
-            with open('tmpmsg.txt', 'w') as bfrfile:
-                bfrfile.write(bfr.content)
-        if len(aft.content) <= 1024:
-            aftmsg = aft.content
-        else:
-            aftmsg = f'`D--> The post-edit message is too long, use this:` {aft.jump_url}'
-        embed = dc.Embed(color=dc.Color.gold(), timestamp=aft.edited_at)
-        embed.set_author(
-            name=f'@{bfr.author} edited a message in #{bfr.channel}:',
-            icon_url=bfr.author.avatar_url,
+        await self.log_edit(
+            guild, aft.id, bfr.channel, bfr.author, bfr.author.id, bfr.author.avatar_url,
+            bfr.content, aft.content, aft.edited_at, aft.jump_url,
             )
-        embed.add_field(name='**Before:**', value=bfrmsg, inline=False)
-        embed.add_field(name='**After:**', value=aftmsg, inline=False)
-        embed.add_field(name='**Message ID:**', value=f'`{aft.id}`')
-        embed.add_field(name='**User ID:**', value=f'`{bfr.author.id}`')
-        if long_edit:
-            with open('tmpmsg.txt', 'r') as bfrfile:
-                await self.log(
-                    guild, 'msglog', embed=embed,
-                    file=dc.File(bfrfile, f'{bfr.id}-old.txt'),
-                    )
-        else:
-            await self.log(guild, 'msglog', embed=embed)
 
     @commands.Cog.listener()
-    async def on_message_delete(self, msg): # Log deleted messages
-        if msg.guild is None:
+    async def on_raw_message_edit(self, payload): # Log edits of messages only the content cache remembers
+        if payload.cached_message is not None or 'content' not in payload.data:
             return
-        guild = msg.channel.guild
-        if not self.getlog(guild, 'msglog'):
+        if (cached := self.message_cache.get(payload.message_id)) is None or cached.content == payload.data['content']:
+            return
+        self.message_cache.update(cached.id, payload.data['content'])
+        guild = bot.get_guild(cached.guild_id)
+        if guild is None or not self.getlog(guild, 'msglog'):
             return
+        author, avatar_url = self.cached_author(cached)
+        await self.log_edit(
+            guild, cached.id, guild.get_channel(cached.channel_id) or cached.channel_id,
+            author, cached.author_id, avatar_url,
+            cached.content, payload.data['content'],
+            dc.utils.parse_time(payload.data.get('edited_timestamp')),
+            f'https://discord.com/channels/{guild.id}/{cached.channel_id}/{cached.id}',
+            )
+
+    @staticmethod
+    def deleted_record(msg):
+        return CachedMessage(
+            msg.id, msg.guild.id, msg.channel.id, msg.author.id, str(msg.author),
+            msg.content, tuple(att.url for att in msg.attachments),
+            )
+
+    async def flush_deletes(self, channel_id, records):
+        # A few deletes are logged one by one as usual; a purge becomes one entry with a transcript.
+        guild = bot.get_guild(records[0].guild_id)
+        if guild is None or not self.getlog(guild, 'msglog'):
+            return
+        channel = guild.get_channel(channel_id) or channel_id
+        if len(records) <= self.delete_burst:
+            for record in records:
+                if record.author_id is not None:
+                    author, avatar_url = self.cached_author(record)
+                    await self.log_delete(
+                        guild, record.id, channel, author, record.author_id, avatar_url,
+                        record.content, record.attachments,
+                        )
+            return
+        records.sort()
+        lines = []
+        authors = Counter()
+        for record in records:
+            when = f'{record.created_at:%Y-%m-%d %H:%M:%S}'
+            if record.author_id is None:
+                lines.append(f'[{when}] {record.id}: (not cached)')
+                continue
+            authors[record.author, record.author_id] += 1
+            lines.append(f'[{when}] {record.author} ({record.author_id}): {record.content}')
+            lines.extend(f'    {url}' for url in record.attachments)
+        transcript = '\n'.join(lines)
+        fname = f'deleted-{channel_id}-{datetime.utcnow():%Y%m%d-%H%M%S}'
+        if len(transcript) > 4 * 2**20:
+            file = zip_file([(f'{fname}.txt', transcript)], f'{fname}.zip')
+        else:
+            file = text_file(transcript, f'{fname}.txt')
         embed = dc.Embed(
             color=dc.Color.darker_grey(),
-            timestamp=msg.created_at,
-            description=msg.content,
-            )
-        embed.set_author(
-            name=f'@{msg.author} deleted a message in #{msg.channel}:',
-            icon_url=msg.author.avatar_url,
+            timestamp=datetime.utcnow(),
+            description=response_bank.bulk_delete_desc.format(count=len(records), fname=file.filename),
             )
-        embed.add_field(name='**Message ID:**', value=f'`{msg.id}`')
-        embed.add_field(name='**User ID:**', value=f'`{msg.author.id}`')
-        if msg.attachments:
-            # att_channel = bot.get_channel(att_chid)
+        if (uncached := len(records) - sum(authors.values())):
+            embed.description += '\n' + response_bank.bulk_delete_uncached.format(uncached=uncached)
+        embed.set_author(name=f'{len(records)} messages were deleted in #{channel}:', icon_url=bot.user.avatar_url)
+        if authors:
             embed.add_field(
-                name='**Attachments:**',
-                value='\n'.join(att.url for att in msg.attachments),
+                name='**Authors:**',
+                value='\n'.join(f'`{author}` ({author_id}): {count}' for (author, author_id), count in authors.most_common(10)),
                 inline=False,
                 )
-        await self.log(guild, 'msglog', embed=embed)
+        await self.log(guild, 'msglog', embed=embed, file=file)
+
+    @commands.Cog.listener()
+    async def on_message_delete(self, msg): # Log deleted messages
+        self.message_cache.discard(msg.id)
+        if msg.guild is None or not self.getlog(msg.guild, 'msglog'):
+            return
+        self.delete_bursts.add(msg.channel.id, self.deleted_record(msg))
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload): # Log deletes of messages only the content cache remembers
+        if payload.cached_message is not None or (cached := self.message_cache.pop(payload.message_id)) is None:
+            return
+        self.delete_bursts.add(cached.channel_id, cached)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload): # Log purges, cached or not
+        if (guild := bot.get_guild(payload.guild_id)) is None or not self.getlog(guild, 'msglog'):
+            return
+        cached_messages = {msg.id: msg for msg in payload.cached_messages}
+        for msg_id in payload.message_ids:
+            cached = self.message_cache.pop(msg_id)
+            if (msg := cached_messages.get(msg_id)) is not None:
+                cached = self.deleted_record(msg)
+            elif cached is None:
+                cached = CachedMessage(msg_id, guild.id, payload.channel_id, None, None, None, ())
+            self.delete_bursts.add(payload.channel_id, cached)
 
     @commands.command()
     @commands.bot_has_permissions(send_messages=True)
@@ -476,16 +679,95 @@ class GuildConfiguration(commands.Cog):
             return
         raise error
 
-    @commands.command()
+    @commands.group(invoke_without_command=True)
     @commands.bot_has_permissions(add_reactions=True, read_message_history=True)
     @commands.has_guild_permissions(manage_messages=True)
     async def autoreact(self, ctx):
-        if self.toggle(ctx, 'autoreact'):
+        enabled = await self.toggle(ctx, 'autoreact')
+        self.compile_reacts(ctx.guild.id, ctx.channel.id)
+        if enabled:
             await ctx.send(response_bank.allow_reacts)
         else:
             await ctx.send(response_bank.deny_reacts)
 
+    # Subcommands run without the group's checks, so each repeats them.
+    @autoreact.command(name='add')
+    @commands.bot_has_permissions(add_reactions=True, read_message_history=True)
+    @commands.has_guild_permissions(manage_messages=True)
+    async def autoreact_add(
+        self, ctx, emoji: Union[dc.Emoji, str], attachments: str,
+        role: Optional[dc.Role]=None, *, pattern: Optional[str]=None,
+        ):
+        attachments = attachments.lower()
+        if attachments not in attachment_choices:
+            await ctx.send(response_bank.autoreact_usage)
+            return
+        if pattern is not None:
+            try:
+                check_pattern(pattern)
+            except re.error as exc:
+                await ctx.send(response_bank.autoreact_pattern_error.format(error=exc))
+                return
+        rule_id, self.next_rule_id = self.next_rule_id, self.next_rule_id + 1
+        rule = AutoReactRule(rule_id, attachments, role and role.id, pattern, str(emoji))
+        self.react_rules[ctx.channel.id][rule_id] = rule
+        self.react_rule_guilds[ctx.channel.id] = ctx.guild.id
+        self.compile_reacts(ctx.guild.id, ctx.channel.id)
+        await sql_writer.submit(self.add_rule_stmt, {
+            'RuleId': rule_id, 'GuildId': ctx.guild.id, 'ChanId': ctx.channel.id,
+            'Attachments': attachments, 'RoleId': rule.role_id, 'Pattern': pattern, 'Emoji': rule.emoji,
+            })
+        await ctx.send(response_bank.autoreact_add_confirm.format(rule_id=rule_id, emoji=rule.emoji))
+
+    @autoreact_add.error
+    async def autoreact_add_error(self, ctx, error):
+        if isinstance(error, (commands.MissingRequiredArgument, commands.BadArgument)):
+            await ctx.send(response_bank.autoreact_usage)
+            return
+        await self.autoreact_error(ctx, error)
+
+    @autoreact.command(name='del')
+    @commands.has_guild_permissions(manage_messages=True)
+    async def autoreact_del(self, ctx, rule_id: int):
+        if self.react_rules[ctx.channel.id].pop(rule_id, None) is None:
+            await ctx.send(response_bank.autoreact_del_error.format(rule_id=rule_id))
+            return
+        self.compile_reacts(ctx.guild.id, ctx.channel.id)
+        await sql_writer.submit(self.del_rule_stmt, {'Id': rule_id})
+        await ctx.send(response_bank.autoreact_del_confirm.format(rule_id=rule_id))
+
+    @autoreact_del.error
+    async def autoreact_del_error(self, ctx, error):
+        if isinstance(error, (commands.MissingRequiredArgument, commands.BadArgument)):
+            await ctx.send(response_bank.autoreact_usage)
+            return
+        await self.autoreact_error(ctx, error)
+
+    @autoreact.command(name='list')
+    @commands.has_guild_permissions(manage_messages=True)
+    async def autoreact_list(self, ctx):
+        rules = self.react_rules.get(ctx.channel.id)
+        if not rules:
+            await ctx.send(response_bank.autoreact_list_empty)
+            return
+        lines = [response_bank.autoreact_list_head]
+        for rule in rules.values():
+            role = rule.role_id and ctx.guild.get_role(rule.role_id)
+            lines.append(
+                f'`{rule.rule_id}`: {rule.emoji} for {rule.attachments} messages'
+                + (f' from `{role.name if role else rule.role_id}`' if rule.role_id else '')
+                + (f' matching `{rule.pattern}`' if rule.pattern is not None else '')
+                )
+        chunk = []
+        for line in lines: # Dozens of rules with long patterns can outgrow a single message.
+            if sum(map(len, chunk)) + len(chunk) + len(line) > 2000:
+                await ctx.send('\n'.join(chunk))
+                chunk = []
+            chunk.append(line[:2000])
+        await ctx.send('\n'.join(chunk))
+
     @autoreact.error
+    @autoreact_list.error
     async def autoreact_error(self, ctx, error):
         if isinstance(error, commands.BotMissingPermissions):
             return
@@ -498,7 +780,7 @@ class GuildConfiguration(commands.Cog):
     @commands.bot_has_permissions(send_messages=True)
     @commands.has_guild_permissions(manage_roles=True)
     async def ignoreplebs(self, ctx):
-        if self.toggle(ctx, 'ignoreplebs'):
+        if await self.toggle(ctx, 'ignoreplebs'):
             await ctx.send(response_bank.allow_users)
         else:
             await ctx.send(response_bank.deny_users)
@@ -514,7 +796,7 @@ class GuildConfiguration(commands.Cog):
     @commands.bot_has_permissions(send_messages=True)
     @commands.has_guild_permissions(manage_roles=True)
     async def togglelatex(self, ctx):
-        if self.toggle(ctx, 'enablelatex'):
+        if await self.toggle(ctx, 'enablelatex'):
             await ctx.send(response_bank.allow_latex)
         else:
             await ctx.send(response_bank.deny_latex)
@@ -526,5 +808,21 @@ class GuildConfiguration(commands.Cog):
             return
         raise error
 
+    @commands.command()
+    @commands.bot_has_permissions(send_messages=True)
+    @commands.has_guild_permissions(manage_messages=True)
+    async def togglearchive(self, ctx):
+        if await self.toggle(ctx, 'archive'):
+            await ctx.send(response_bank.allow_archive)
+        else:
+            await ctx.send(response_bank.deny_archive)
+
+    @togglearchive.error
+    async def togglearchive_error(self, ctx, error):
+        if isinstance(error, commands.MissingPermissions):
+            await ctx.send(response_bank.perms_error)
+            return
+        raise error
+
 
 bot.add_cog(GuildConfiguration(bot))
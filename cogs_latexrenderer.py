@@ -53,8 +53,7 @@ class LatexRenderer(commands.Cog):
                 return
             # Send the image to the latex channel and embed.
             latex_channel = bot.get_channel(773594582175973376)
-            msg_id = hex(member_stalker.member_data['latex_count'])[2:]
-            member_stalker.member_data['latex_count'] += 1
+            msg_id = hex(member_stalker.take_count('latex_count'))[2:]
             await latex_channel.send(
                 f'`@{ctx.author}`: UID {ctx.author.id}: MID {msg_id}',
                 file=dc.File(io.BytesIO(await image.read()), 'latex.png')
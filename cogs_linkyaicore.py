@@ -4,12 +4,12 @@ from random import randrange, choices, sample
 from itertools import islice
 
 import discord as dc
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 from chainproofrhg import ChainProofRHG as RHG
 
 from cogs_textbanks import url_bank, query_bank, response_bank
-from bot_common import bot, CONST_ADMINS
+from bot_common import bot, scheduler, Every, CONST_ADMINS
 
 _response_pool = os.path.join('text', 'spat.txt')
 _law_pool = os.path.join('text', 'AI_laws.txt')
@@ -27,9 +27,12 @@ class LinkyBotAI(commands.Cog):
         self._extrafreq = (10, 5, 1)
         with open(_law_pool, 'r') as lawfile:
             self._law_total = sum(1 for _ in lawfile)
+        self.gen_laws() # Rolled once here, so there are laws before the first scheduled run.
+        scheduler.register(self.gen_laws, Every(minutes=45), catch_up='skip')
+        print('D--> LinkyBot sentience engine started.')
 
     def cog_unload(self):
-        self.gen_laws.cancel()
+        scheduler.cancel(self.gen_laws.__qualname__)
     
     def random_linky(self, msg):
         try:
@@ -42,11 +45,6 @@ class LinkyBotAI(commands.Cog):
                 respfile.write('i love dirt so much\n')
             return 'i love dirt so much\n'
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        print('D--> LinkyBot sentience engine started.')
-        self.gen_laws.start()
-
     @commands.Cog.listener()
     async def on_message(self, msg):
         if msg.author.id == CONST_ADMINS[1]:
@@ -58,8 +56,7 @@ class LinkyBotAI(commands.Cog):
             with open(_response_pool, 'a', encoding='utf-8') as respfile:
                 respfile.write(msg.clean_content.strip() + '\n')
 
-    @tasks.loop(minutes=45)
-    async def gen_laws(self):
+    def gen_laws(self):
         law_count = choices(range(10), self._countfreq)[0]
         if law_count == 0:
             self.laws = ''
@@ -4,11 +4,11 @@ import logging
 from datetime import datetime
 
 import discord as dc
-from discord.ext import commands, tasks
+from discord.ext import commands
 import aiohttp
 
 from cogs_textbanks import url_bank, query_bank, response_bank
-from bot_common import bot
+from bot_common import bot, perf_tracker, scheduler, Cron, Every
 
 log_chid = 830752125998596126
 
@@ -40,23 +40,22 @@ class LogManager(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        # A log that piled up while the bot was down still gets one report on the way back up.
+        scheduler.register(self.report_log, Cron('@hourly'), catch_up='once')
+        scheduler.register(self.snapshot_perf, Every(minutes=10), catch_up='skip')
 
     def cog_unload(self):
-        self.report_log.cancel()
+        scheduler.cancel(self.report_log.__qualname__)
+        scheduler.cancel(self.snapshot_perf.__qualname__)
 
-    @commands.Cog.listener()
-    async def on_ready(self):
-        print('D--> Dumping logs...')
-        self.log_channel = self.bot.get_channel(log_chid)
-        self.report_log.start()
-
-    @tasks.loop(hours=1)
     async def report_log(self):
         now = datetime.utcnow()
+        if (log_channel := self.bot.get_channel(log_chid)) is None:
+            return
         with open('discord.log', 'rb') as logfile:
             if (code:=logfile.read()):
                 logfile.seek(0)
-                await self.log_channel.send(f'ArquiusBot Log @ {now}', file=dc.File(logfile, f'errors.log'))
+                await log_channel.send(f'ArquiusBot Log @ {now}', file=dc.File(logfile, f'errors.log'))
         with open('discord.log', 'r+') as logfile:
             if not (code:=logfile.read()): return
             logfile.truncate(0)
@@ -65,7 +64,10 @@ class LogManager(commands.Cog):
                 resp = await session.post('https://pastebin.com/api/api_post.php', data=self._post_data)
                 if resp.status != 200:
                     raise LoggingError(f'Error {resp.status}: {await resp.text()}')
-                await self.log_channel.send(f'ArquiusBot Log {now} @ <{await resp.text()}>')
+                await log_channel.send(f'ArquiusBot Log {now} @ <{await resp.text()}>')
+
+    def snapshot_perf(self):
+        perf_tracker.save()
 
 
 bot.add_cog(LogManager(bot))
@@ -0,0 +1,181 @@
+# Helpers for sending log messages: batched per channel, with attachments built in memory.
+import io
+import zipfile
+from time import monotonic
+from datetime import datetime
+from collections import deque
+
+import asyncio as aio
+import aiohttp
+
+import discord as dc
+from discord.http import Route
+
+def text_file(text, fname):
+    return dc.File(io.BytesIO(text.encode()), fname)
+
+def zip_file(texts, fname):
+    """Compress a list of (fname, text) pairs into a single archive attachment."""
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for idx, (text_fname, text) in enumerate(texts):
+            archive.writestr(f'{idx:03}-{text_fname}', text) # Edits of one message share names.
+    data.seek(0)
+    return dc.File(data, fname)
+
+
+class TextBundler(object):
+    """
+    Turns overlong message texts into attachments. Texts normally come back as their own files,
+    but once more than `burst` of them arrive within `window` seconds, the rest are gathered for
+    `delay` seconds and sent together as one zip archive instead.
+    """
+
+    def __init__(self, send, burst=3, window=10.0, delay=5.0):
+        self.send = send # Coroutine function taking the archive's discord.File.
+        self.burst = burst
+        self.window = window
+        self.delay = delay
+        self.recent = deque()
+        self.pending = []
+        self.archive = None
+        self._flusher = None
+
+    def attach(self, fname, text):
+        """Returns (file, None) to attach directly, or (None, archive_name) if the text was bundled."""
+        now = monotonic()
+        recent = self.recent
+        while recent and now - recent[0] > self.window:
+            recent.popleft()
+        recent.append(now)
+        if len(recent) <= self.burst and not self.pending:
+            return text_file(text, fname), None
+        if not self.pending:
+            self.archive = f'messages-{datetime.utcnow().strftime("%Y%m%d-%H%M%S")}.zip'
+        self.pending.append((fname, text))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = aio.ensure_future(self.flush())
+        return None, self.archive
+
+    async def flush(self):
+        await aio.sleep(self.delay)
+        pending, self.pending = self.pending, []
+        if pending:
+            await self.send(zip_file(pending, self.archive))
+
+
+class BurstAggregator(object):
+    """
+    Gathers items under a key until `delay` seconds pass without another, or `max_delay` seconds
+    since the first, then hands them all to `flush` in one call. A lone item waits out the delay too.
+    """
+
+    def __init__(self, flush, delay=2.0, max_delay=10.0):
+        self.flush = flush # Coroutine function taking (key, items).
+        self.delay = delay
+        self.max_delay = max_delay
+        self.pending = {}
+        self.last = {}
+        self._flushers = {}
+
+    def add(self, key, item):
+        self.pending.setdefault(key, []).append(item)
+        self.last[key] = monotonic()
+        if key not in self._flushers:
+            self._flushers[key] = aio.ensure_future(self.wait(key))
+
+    async def wait(self, key):
+        start = monotonic()
+        try:
+            while (quiet := monotonic() - self.last[key]) < self.delay and (age := monotonic() - start) < self.max_delay:
+                await aio.sleep(min(self.delay - quiet, self.max_delay - age))
+        finally:
+            del self._flushers[key], self.last[key]
+            items = self.pending.pop(key)
+        await self.flush(key, items)
+
+
+class LogSender(object):
+    """
+    Outbound queue for one log channel. Consecutive embed-only messages are packed up to ten
+    to a message, which goes out once it is full or `delay` seconds after its first embed.
+    Anything with content or files is sent on its own, so the log keeps the order events came in.
+    """
+    max_embeds = 10
+    max_chars = 6000 # Discord's limit on the combined size of a message's embeds.
+
+    def __init__(self, channel, delay=1.0):
+        self.channel = channel
+        self.delay = delay
+        self.queue = deque()
+        self.ready = aio.Event()
+        self._worker = None
+
+    def send(self, content=None, *, embed=None, file=None, files=None):
+        if file is not None:
+            files = [file]
+        if not (content or embed or files):
+            return
+        self.queue.append((content or None, embed, files))
+        if content or files or len(self.queue) >= self.max_embeds:
+            self.ready.set()
+        if self._worker is None or self._worker.done():
+            self._worker = aio.ensure_future(self.work())
+
+    def batch_complete(self):
+        # A batch can't grow once it is full or something unbatchable is queued behind it.
+        for idx, (content, embed, files) in enumerate(self.queue):
+            if idx == self.max_embeds or content or files:
+                return True
+        return False
+
+    def take_batch(self):
+        embeds = []
+        chars = 0
+        while self.queue and len(embeds) < self.max_embeds:
+            content, embed, files = self.queue[0]
+            if content or files or embed is None or (embeds and chars + len(embed) > self.max_chars):
+                break
+            self.queue.popleft()
+            embeds.append(embed)
+            chars += len(embed)
+        return embeds
+
+    async def work(self):
+        while self.queue:
+            content, embed, files = self.queue[0]
+            if content or files:
+                self.queue.popleft()
+                await self.deliver(content, [embed] if embed is not None else [], files)
+                continue
+            self.ready.clear()
+            if not self.batch_complete():
+                try:
+                    await aio.wait_for(self.ready.wait(), self.delay)
+                except aio.TimeoutError:
+                    pass
+            if (embeds := self.take_batch()):
+                await self.deliver(None, embeds, None)
+
+    async def deliver(self, content, embeds, files):
+        # Only failures that might go away get retried; discord.py already waits out rate limits.
+        for attempt in range(8):
+            try:
+                if len(embeds) > 1: # This version of discord.py can only send one embed at a time.
+                    await self.channel._state.http.request(
+                        Route('POST', '/channels/{channel_id}/messages', channel_id=self.channel.id),
+                        json={'embeds': [embed.to_dict() for embed in embeds]},
+                        )
+                else:
+                    await self.channel.send(content, embed=embeds[0] if embeds else None, files=files)
+                return
+            except dc.HTTPException as exc:
+                if exc.status < 500:
+                    print(f'Could not log to #{self.channel}: {exc}')
+                    return
+            except (aiohttp.ClientError, aio.TimeoutError, OSError):
+                pass
+            for file in files or ():
+                file.reset()
+            await aio.sleep(min(2**attempt, 60))
+        print(f'Gave up logging to #{self.channel} after repeated server errors.')
@@ -0,0 +1,118 @@
+# Mass ban engine, for clearing out raids faster than they can arrive.
+import re
+from time import perf_counter
+
+import asyncio as aio
+
+import discord as dc
+from discord.ext import commands
+
+user_id_pattern = re.compile(r'<@!?(\d{15,21})>|(\d{15,21})')
+separator_pattern = re.compile(r'[\s,;]+')
+
+id_list_max_size = 1 << 20 # Bytes; a megabyte of IDs is over fifty thousand of them.
+
+def is_id_list(attachment):
+    if attachment.size > id_list_max_size:
+        return False
+    if attachment.content_type is not None: # Older uploads don't say.
+        return attachment.content_type.startswith('text/')
+    return attachment.filename.lower().endswith(('.txt', '.csv'))
+
+async def read_id_lists(msg):
+    """Collect ban arguments from any text attachments on the message."""
+    args = []
+    for attachment in msg.attachments:
+        if not is_id_list(attachment):
+            continue
+        try:
+            text = (await attachment.read()).decode('utf-8', 'replace')
+        except dc.HTTPException:
+            continue
+        args.extend(arg for arg in separator_pattern.split(text) if arg)
+    return args
+
+async def resolve_targets(ctx, args):
+    """
+    Turn ban arguments into snowflakes. IDs and mentions are used as they are, so they cost no API calls;
+    anything else goes through the user converter, all of them at once.
+    Returns an ordered dict of user IDs to display labels, and a list of unresolvable arguments.
+    """
+    targets = {}
+    names = []
+    for arg in args:
+        if (match := user_id_pattern.fullmatch(arg)):
+            user_id = int(match[1] or match[2])
+            targets.setdefault(user_id, str(ctx.bot.get_user(user_id) or user_id))
+        else:
+            names.append(arg)
+    users = await aio.gather(
+        *(commands.UserConverter().convert(ctx, name) for name in names),
+        return_exceptions=True,
+        )
+    unresolved = []
+    for name, user in zip(names, users):
+        if isinstance(user, commands.BadArgument):
+            unresolved.append(name)
+        elif isinstance(user, Exception):
+            raise user
+        else:
+            targets.setdefault(user.id, str(user))
+    return targets, unresolved
+
+
+class MassBan(object):
+    """
+    Bans a list of users through a small pool of workers sharing one queue.
+    discord.py already waits out the ban route's rate limit, so the pool size only bounds
+    how many requests are in flight at once. Failures are recorded per user instead of raised.
+    """
+    workers = 4
+
+    def __init__(self, guild, reason, delete_message_days=1, progress=None):
+        self.guild = guild
+        self.reason = reason
+        self.delete_message_days = delete_message_days
+        self.progress = progress # Coroutine function taking (done, total).
+        self.results = {}
+        self.elapsed = 0.0
+
+    def protected(self):
+        return {self.guild.me.id, self.guild.owner_id}
+
+    async def run(self, user_ids, protected=()):
+        queue = aio.Queue()
+        protected = self.protected().union(protected)
+        for user_id in user_ids:
+            if user_id in protected:
+                self.results[user_id] = 'protected'
+            else:
+                queue.put_nowait(user_id)
+        total = len(self.results) + queue.qsize()
+        start = perf_counter()
+        await aio.gather(*(self.worker(queue, total) for _ in range(min(self.workers, queue.qsize()))))
+        self.elapsed = perf_counter() - start
+        return self.results
+
+    async def worker(self, queue, total):
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            try:
+                await self.guild.ban(
+                    dc.Object(user_id),
+                    reason=self.reason,
+                    delete_message_days=self.delete_message_days,
+                    )
+            except dc.NotFound:
+                self.results[user_id] = 'unknown user'
+            except dc.Forbidden:
+                self.results[user_id] = 'forbidden'
+            except dc.HTTPException as exc:
+                self.results[user_id] = f'failed ({exc.status})'
+            else:
+                self.results[user_id] = 'banned'
+            if self.progress is not None:
+                await self.progress(len(self.results), total)
+
+    def count(self, status='banned'):
+        return sum(result == status for result in self.results.values())
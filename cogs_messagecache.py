@@ -0,0 +1,96 @@
+# A byte-budgeted cache of recent message contents, for logging edits and deletes of messages
+# that discord.py's own message cache has already let go of.
+import zlib
+from collections import OrderedDict, namedtuple
+
+import discord as dc
+
+
+class CachedMessage(namedtuple('CachedMessage', 'id guild_id channel_id author_id author content attachments')):
+    __slots__ = ()
+
+    @property
+    def created_at(self):
+        return dc.utils.snowflake_time(self.id)
+
+
+class MessageCache(object):
+    """
+    Keeps the author, channel, content and attachment URLs of recent messages, oldest evicted first
+    once their total size passes the budget. Entries over `compress_over` bytes are zlib compressed,
+    or none are if it is None. Every entry is charged a fixed overhead on top of its text, so the budget
+    holds for short messages too.
+    """
+    entry_overhead = 200 # Bytes for the dict slot, tuple and IDs, roughly.
+
+    def __init__(self, budget, compress_over=512):
+        self.budget = budget
+        self.compress_over = compress_over
+        self.entries = OrderedDict() # msg_id -> (guild_id, channel_id, author_id, blob, compressed)
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, msg_id):
+        return msg_id in self.entries
+
+    def pack(self, author, content, attachments):
+        # Names and URLs can't hold newlines, so only the content needs to go after the separator.
+        blob = '\n'.join((author, *attachments)).encode() + b'\0' + content.encode()
+        if self.compress_over is not None and len(blob) > self.compress_over:
+            packed = zlib.compress(blob, 6)
+            if len(packed) < len(blob):
+                return packed, True
+        return blob, False
+
+    @staticmethod
+    def unpack(blob, compressed):
+        head, _, content = (zlib.decompress(blob) if compressed else blob).decode().partition('\0')
+        author, *attachments = head.split('\n')
+        return author, content, tuple(attachments)
+
+    def store(self, msg_id, guild_id, channel_id, author_id, author, content, attachments):
+        blob, compressed = self.pack(author, content, attachments)
+        self.discard(msg_id)
+        self.entries[msg_id] = (guild_id, channel_id, author_id, blob, compressed)
+        self.size += len(blob) + self.entry_overhead
+        self.trim()
+
+    def trim(self):
+        while self.size > self.budget and self.entries:
+            _, (*_, blob, _) = self.entries.popitem(last=False)
+            self.size -= len(blob) + self.entry_overhead
+
+    def add(self, msg):
+        self.store(
+            msg.id, msg.guild.id, msg.channel.id, msg.author.id, str(msg.author),
+            msg.content, [att.url for att in msg.attachments],
+            )
+
+    def update(self, msg_id, content):
+        """Replace the content of a cached message, keeping its place in line."""
+        if (entry := self.entries.get(msg_id)) is None:
+            return
+        guild_id, channel_id, author_id, blob, compressed = entry
+        author, _, attachments = self.unpack(blob, compressed)
+        new_blob, new_compressed = self.pack(author, content, attachments)
+        self.entries[msg_id] = (guild_id, channel_id, author_id, new_blob, new_compressed)
+        self.size += len(new_blob) - len(blob)
+        self.trim()
+
+    def get(self, msg_id):
+        if (entry := self.entries.get(msg_id)) is None:
+            return None
+        guild_id, channel_id, author_id, blob, compressed = entry
+        return CachedMessage(msg_id, guild_id, channel_id, author_id, *self.unpack(blob, compressed))
+
+    def discard(self, msg_id):
+        if (entry := self.entries.pop(msg_id, None)) is not None:
+            self.size -= len(entry[3]) + self.entry_overhead
+        return entry
+
+    def pop(self, msg_id):
+        cached = self.get(msg_id)
+        self.discard(msg_id)
+        return cached
@@ -0,0 +1,298 @@
+# The MessageSearch Cog, which keeps a full-text index of guild messages for searches and keyword stats.
+from datetime import datetime
+
+import asyncio as aio
+
+import discord as dc
+from discord.ext import commands
+
+import sqlalchemy as sql
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from cogs_textbanks import url_bank, query_bank, response_bank
+from bot_common import bot, guild_whitelist, sql_engine, sql_metadata, sql_writer
+
+
+class MessageSearch(commands.Cog):
+    """
+    Messages are indexed in an SQLite FTS5 table keyed by message ID, as they are posted, edited
+    and deleted, so questions about history are index queries instead of history crawls.
+    Older messages are backfilled from history a chunk at a time, oldest message reached so far
+    recorded per channel, so a backfill picks up where it stopped after a restart.
+    """
+    backfill_chunk = 500 # Messages fetched per chunk; progress is saved after each.
+    backfill_pause = 1.0 # Seconds between chunks, to leave the history rate limit for everything else.
+    result_limit = 10
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.backfills = {} # guild_id -> task working through that guild's channels
+        self.failed_writes = 0
+        with sql_engine.begin() as dbconn:
+            dbconn.execute(sql.text(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS MessageIndex USING fts5('
+                'Content, GuildId UNINDEXED, ChanId UNINDEXED, AuthorId UNINDEXED, '
+                "tokenize='unicode61 remove_diacritics 2')"
+                ))
+        try:
+            self.progress_table = sql_metadata.tables['MessageIndexProgress']
+        except KeyError:
+            self.progress_table = sql.Table(
+                'MessageIndexProgress', sql_metadata,
+                sql.Column('ChanId', sql.Integer, nullable=False, primary_key=True),
+                sql.Column('GuildId', sql.Integer, nullable=False),
+                sql.Column('OldestId', sql.Integer, nullable=True),
+                sql.Column('Done', sql.Boolean, nullable=False, default=False),
+                )
+            sql_metadata.create_all(sql_engine, tables=[self.progress_table])
+        with sql_engine.connect() as dbconn:
+            self.progress = { # chan_id -> [guild_id, oldest_id, done]
+                row.ChanId: [row.GuildId, row.OldestId, row.Done]
+                for row in dbconn.execute(sql.select(self.progress_table))
+                }
+        # Statements are built once, like GuildConfiguration's, so they are only ever prepared once.
+        self.index_stmt = sql.text(
+            'INSERT OR REPLACE INTO MessageIndex(rowid, Content, GuildId, ChanId, AuthorId) '
+            'VALUES (:Id, :Content, :GuildId, :ChanId, :AuthorId)'
+            )
+        self.edit_stmt = sql.text('UPDATE MessageIndex SET Content = :Content WHERE rowid = :Id')
+        self.delete_stmt = sql.text('DELETE FROM MessageIndex WHERE rowid = :Id')
+        insert = sqlite_insert(self.progress_table)
+        self.progress_stmt = insert.on_conflict_do_update(
+            index_elements=['ChanId'], set_={'OldestId': insert.excluded.OldestId, 'Done': insert.excluded.Done},
+            )
+        chan_ids = sql.bindparam('ChanIds', expanding=True)
+        self.search_stmt = sql.text(
+            "SELECT rowid, ChanId, AuthorId, snippet(MessageIndex, 0, '**', '**', '...', 12) "
+            'FROM MessageIndex WHERE MessageIndex MATCH :Query AND GuildId = :GuildId AND ChanId IN :ChanIds '
+            'ORDER BY rank LIMIT :Limit'
+            ).bindparams(chan_ids)
+        self.count_stmt = sql.text(
+            'SELECT COUNT(*) FROM MessageIndex '
+            'WHERE MessageIndex MATCH :Query AND GuildId = :GuildId AND AuthorId = :AuthorId AND ChanId IN :ChanIds'
+            ).bindparams(chan_ids)
+        self.top_stmt = sql.text(
+            'SELECT AuthorId, COUNT(*) AS Said FROM MessageIndex '
+            'WHERE MessageIndex MATCH :Query AND GuildId = :GuildId AND ChanId IN :ChanIds '
+            'GROUP BY AuthorId ORDER BY Said DESC LIMIT :Limit'
+            ).bindparams(chan_ids)
+        self.total_stmt = sql.text('SELECT COUNT(*) FROM MessageIndex WHERE GuildId = :GuildId')
+
+    @staticmethod
+    def indexable(msg):
+        return msg.guild is not None and msg.guild.id in guild_whitelist and not msg.author.bot and msg.content
+
+    @staticmethod
+    def visible_channels(ctx):
+        # Only channels the invoker can read, and if the answer goes somewhere public, only public ones.
+        everyone = ctx.guild.default_role
+        public = ctx.channel.permissions_for(everyone).read_messages
+        return [
+            channel.id for channel in ctx.guild.text_channels
+            if channel.permissions_for(ctx.author).read_messages
+            and (not public or channel.permissions_for(everyone).read_messages)
+            ]
+
+    @staticmethod
+    def row(msg):
+        return {
+            'Id': msg.id, 'Content': msg.content,
+            'GuildId': msg.guild.id, 'ChanId': msg.channel.id, 'AuthorId': msg.author.id,
+            }
+
+    def write(self, stmt, params):
+        # Nothing waits on index writes, but a failed one should still be noticed.
+        sql_writer.submit(stmt, params).add_done_callback(self.check_write)
+
+    def check_write(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.failed_writes += 1
+
+    async def query(self, stmt, params):
+        # Reads go through the SQL thread as well, behind any writes still queued.
+        def run_query():
+            with sql_engine.connect() as dbconn:
+                return dbconn.execute(stmt, params).fetchall()
+        return await sql_writer.run(run_query)
+
+    @commands.Cog.listener()
+    async def on_message(self, msg):
+        if self.indexable(msg):
+            self.write(self.index_stmt, self.row(msg))
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        if 'content' in payload.data and payload.guild_id in guild_whitelist:
+            self.write(self.edit_stmt, {'Id': payload.message_id, 'Content': payload.data['content']})
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        if payload.guild_id in guild_whitelist:
+            self.write(self.delete_stmt, {'Id': payload.message_id})
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        if payload.guild_id in guild_whitelist:
+            self.write(self.delete_stmt, [{'Id': msg_id} for msg_id in payload.message_ids])
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Carry on with any backfill a restart interrupted.
+        for chan_id, (guild_id, _, done) in self.progress.items():
+            if not done and (guild := self.bot.get_guild(guild_id)) is not None:
+                self.start_backfill(guild, [])
+
+    def start_backfill(self, guild, channels):
+        for channel in channels:
+            self.progress.setdefault(channel.id, [guild.id, None, False])
+        task = self.backfills.get(guild.id)
+        if task is None or task.done():
+            self.backfills[guild.id] = self.bot.loop.create_task(self.backfill(guild))
+
+    async def backfill(self, guild):
+        # One channel at a time, so a guild's backfill never has more than one history crawl going.
+        while (chan_id := next((
+            chan_id for chan_id, (guild_id, _, done) in self.progress.items() if guild_id == guild.id and not done
+            ), None)) is not None:
+            progress = self.progress[chan_id]
+            if (channel := guild.get_channel(chan_id)) is None:
+                progress[2] = True
+            else:
+                try:
+                    await self.backfill_chunk_of(channel, progress)
+                except dc.Forbidden:
+                    progress[2] = True
+                except dc.HTTPException:
+                    await aio.sleep(self.backfill_pause * 10)
+                    continue
+            self.write(self.progress_stmt, {
+                'ChanId': chan_id, 'GuildId': guild.id, 'OldestId': progress[1], 'Done': progress[2],
+                })
+            await aio.sleep(self.backfill_pause)
+
+    async def backfill_chunk_of(self, channel, progress):
+        rows = []
+        fetched = 0
+        before = dc.Object(progress[1]) if progress[1] is not None else None
+        async for msg in channel.history(limit=self.backfill_chunk, before=before):
+            fetched += 1
+            progress[1] = msg.id
+            if self.indexable(msg):
+                rows.append(self.row(msg))
+        if rows:
+            self.write(self.index_stmt, rows)
+        progress[2] = fetched < self.backfill_chunk
+
+    @commands.group(name='search', invoke_without_command=True)
+    @commands.has_guild_permissions(manage_messages=True)
+    async def search(self, ctx, *, query: str):
+        try:
+            results = await self.query(self.search_stmt, {
+                'Query': query, 'GuildId': ctx.guild.id, 'Limit': self.result_limit,
+                'ChanIds': self.visible_channels(ctx),
+                })
+        except sql.exc.OperationalError:
+            await ctx.send(response_bank.search_syntax_error)
+            return
+        if not results:
+            await ctx.send(response_bank.search_empty)
+            return
+        embed = dc.Embed(
+            color=dc.Color.blue(),
+            timestamp=datetime.utcnow(),
+            description='\n'.join(
+                f'<@{author_id}> in <#{chan_id}>: {snippet[:300]} '
+                f'[jump](https://discord.com/channels/{ctx.guild.id}/{chan_id}/{msg_id})'
+                for msg_id, chan_id, author_id, snippet in results
+                ),
+            )
+        embed.set_author(name=response_bank.search_head.format(query=query[:200]))
+        await ctx.send(embed=embed)
+
+    @search.error
+    async def search_error(self, ctx, error):
+        if isinstance(error, commands.MissingPermissions):
+            await ctx.send(response_bank.perms_error)
+            return
+        elif isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(response_bank.search_usage)
+            return
+        raise error
+
+    # Subcommands run without the group's checks, so each repeats them.
+    @search.command(name='count')
+    @commands.has_guild_permissions(manage_messages=True)
+    async def search_count(self, ctx, member: dc.Member, *, query: str):
+        try:
+            (count,), = await self.query(self.count_stmt, {
+                'Query': query, 'GuildId': ctx.guild.id, 'AuthorId': member.id,
+                'ChanIds': self.visible_channels(ctx),
+                })
+        except sql.exc.OperationalError:
+            await ctx.send(response_bank.search_syntax_error)
+            return
+        await ctx.send(response_bank.search_count.format(member=member, count=count))
+
+    @search_count.error
+    async def search_count_error(self, ctx, error):
+        if isinstance(error, (commands.MissingRequiredArgument, commands.BadArgument)):
+            await ctx.send(response_bank.search_usage)
+            return
+        await self.search_error(ctx, error)
+
+    @search.command(name='top')
+    @commands.has_guild_permissions(manage_messages=True)
+    async def search_top(self, ctx, *, query: str):
+        try:
+            results = await self.query(self.top_stmt, {
+                'Query': query, 'GuildId': ctx.guild.id, 'Limit': self.result_limit,
+                'ChanIds': self.visible_channels(ctx),
+                })
+        except sql.exc.OperationalError:
+            await ctx.send(response_bank.search_syntax_error)
+            return
+        if not results:
+            await ctx.send(response_bank.search_empty)
+            return
+        lines = []
+        for author_id, said in results:
+            member = ctx.guild.get_member(author_id)
+            lines.append(f'`{member or author_id}`: {said}')
+        await ctx.send('\n'.join((response_bank.search_top_head.format(query=query[:200]), *lines)))
+
+    @search_top.error
+    async def search_top_error(self, ctx, error):
+        if isinstance(error, commands.MissingRequiredArgument):
+            await ctx.send(response_bank.search_usage)
+            return
+        await self.search_error(ctx, error)
+
+    @search.command(name='backfill')
+    @commands.bot_has_permissions(read_message_history=True)
+    @commands.has_guild_permissions(manage_guild=True) # A whole guild's history is a lot of work to start.
+    async def search_backfill(self, ctx, *channels: dc.TextChannel):
+        if ctx.guild.id not in guild_whitelist:
+            return
+        channels = channels or [
+            channel for channel in ctx.guild.text_channels
+            if channel.permissions_for(ctx.guild.me).read_message_history
+            ]
+        self.start_backfill(ctx.guild, channels)
+        await ctx.send(response_bank.search_backfill_start.format(channels=len(channels)))
+
+    @search.command(name='status')
+    @commands.has_guild_permissions(manage_messages=True)
+    async def search_status(self, ctx):
+        (total,), = await self.query(self.total_stmt, {'GuildId': ctx.guild.id})
+        guild_progress = [done for guild_id, _, done in self.progress.values() if guild_id == ctx.guild.id]
+        await ctx.send(response_bank.search_status.format(
+            total=total, done=sum(guild_progress), channels=len(guild_progress),
+            ))
+
+    @search_backfill.error
+    @search_status.error
+    async def search_admin_error(self, ctx, error):
+        await self.search_error(ctx, error)
+
+
+bot.add_cog(MessageSearch(bot))
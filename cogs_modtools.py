@@ -1,13 +1,21 @@
 # Moderation data classes
 import os
 import pickle
-from datetime import datetime
-from collections import defaultdict
+from math import nan, isnan
+from time import monotonic
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict, OrderedDict, Counter
+
+import asyncio as aio
 
 import discord as dc
 from discord.ext import commands
 
 from cogs_textbanks import query_bank, response_bank
+from cogs_perftracker import startup_profiler
+from cogs_snapshot import SnapshotError, load_snapshot, write_snapshot
 
 guild_whitelist = (
     152981670507577344, 663452978237407262, 402880303065989121, 431698070510501891,
@@ -22,7 +30,8 @@ class CogtextManager(commands.Cog):
     def __init__(self, bot):
         self._fname = os.path.join('data', self.__class__.__name__+'.pkl')
         self.bot = bot
-        self.data_load()
+        with startup_profiler.phase(f'data_load {self.__class__.__name__}'):
+            self.data_load()
 
     def cleanup_on_save(self):
         """
@@ -35,23 +44,24 @@ class CogtextManager(commands.Cog):
         """
 
     def data_save(self):
-        """
-        Save the data file. Currently uses pickle, which isn't the smartest format.
-        This will work for now.
-        """
+        """Save the data file as a snapshot, one record per key if the data is a dict."""
         self.cleanup_on_save()
-        with open(self._fname, 'wb') as data_file:
-            pickle.dump(self.data, data_file)
+        write_snapshot(self._fname, self.data)
 
     def data_load(self):
-        """Load from the data file."""
+        """
+        Load from the data file. Dict data is left in the file and decoded a key at a time
+        as it is used, and nothing is written until the next save.
+        """
+        empty = self._generate_empty()
         try:
-            with open(self._fname, 'rb') as data_file:
-                self.data = pickle.load(data_file)
+            try:
+                self.data = load_snapshot(self._fname, getattr(empty, 'default_factory', None))
+            except SnapshotError: # Pickled before snapshots; the next save converts it.
+                with open(self._fname, 'rb') as data_file:
+                    self.data = pickle.load(data_file)
         except (OSError, EOFError):
-            self.data = self._generate_empty()
-            with open(self._fname, 'wb') as data_file:
-                pickle.dump(self.data, data_file)
+            self.data = empty
         else:
             self.cleanup_on_load()
 
@@ -74,15 +84,79 @@ def callback(): # Lambdas can't be pickled, but named functions can.
         'autoreact': set(), 'ignoreplebs': set(), 'enablelatex': set(),
         }
 
+# Only needed to unpickle member files from before the columnar store.
 def guild_callback():
     return {'first_join': None, 'last_seen': None, 'last_roles': ()}
 
 def member_callback():
     return defaultdict(guild_callback)
 
+def to_epoch(when):
+    return nan if when is None else when.replace(tzinfo=timezone.utc).timestamp()
+
+def from_epoch(epoch):
+    # discord.py hands out naive UTC datetimes, so give back the same.
+    return None if isnan(epoch) else datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+class ActivityIndex(object):
+    """
+    Sorted views of one guild's last seen and first join times, so activity queries are
+    a few bisections plus whatever rows they return instead of a scan of every member.
+    """
+    __slots__ = ('built', 'seen_times', 'seen_rows', 'join_times', 'join_rows', 'never_seen')
+
+    def __init__(self, stalker, rows):
+        self.built = monotonic()
+        seen = sorted((stalker.last_seen[row], row) for row in rows if not isnan(stalker.last_seen[row]))
+        joined = sorted((stalker.first_join[row], row) for row in rows if not isnan(stalker.first_join[row]))
+        self.seen_times = array('d', (when for when, _ in seen))
+        self.seen_rows = array('q', (row for _, row in seen))
+        self.join_times = array('d', (when for when, _ in joined))
+        self.join_rows = array('q', (row for _, row in joined))
+        self.never_seen = array('q', (row for row in rows if isnan(stalker.last_seen[row])))
+
+    def __len__(self):
+        return len(self.seen_rows) + len(self.never_seen)
+
+    def count_seen_since(self, cutoff):
+        return len(self.seen_times) - bisect_left(self.seen_times, cutoff)
+
+    def not_seen_since(self, cutoff, start=0, stop=None):
+        """A page of the rows not seen since the cutoff, never seen first, then the longest silent."""
+        total = self.count_not_seen_since(cutoff)
+        stop = total if stop is None else min(stop, total)
+        never = len(self.never_seen)
+        return [*self.never_seen[start:min(stop, never)], *self.seen_rows[max(start-never, 0):max(stop-never, 0)]]
+
+    def count_not_seen_since(self, cutoff):
+        return len(self.never_seen) + bisect_left(self.seen_times, cutoff)
+
+    def joined_between(self, start, end):
+        return self.join_rows[bisect_left(self.join_times, start):bisect_left(self.join_times, end)]
+
+    def seen_histogram(self, edges):
+        """Counts of rows last seen between each pair of descending cutoffs, with the rest at the end."""
+        cuts = [len(self.seen_times)] + [bisect_left(self.seen_times, edge) for edge in edges]
+        return [upper - lower for upper, lower in zip(cuts, cuts[1:])] + [cuts[-1]]
+
+
 class MemberStalker(Singleton):
+    """
+    What the bot remembers of each member in each guild, as parallel array columns with one row
+    per member and guild. Last roles are slices of one shared pool of role IDs.
+    Rows are only ever added by updates, so looking up a stranger costs nothing.
+    """
+    version = 2
+    index_staleness = 60 # Seconds an activity index is reused for, even if members have changed since.
+    columns = {
+        'member_ids': 'q', 'guild_ids': 'q',
+        'first_join': 'd', 'last_seen': 'd', # Epoch seconds, NaN if unknown.
+        'role_start': 'q', 'role_count': 'H', 'role_pool': 'q',
+        }
+
     def __init__(self, fname):
         self.fname = os.path.join('data', fname)
+        self.snapshot = None
         self.load()
 
     def __enter__(self):
@@ -91,43 +165,241 @@ class MemberStalker(Singleton):
     def __exit__(self, etype, evalue, etrace):
         self.save()
 
+    def clear(self):
+        for name, typecode in self.columns.items():
+            setattr(self, name, array(typecode))
+        self.rows = {} # guild_id -> member_id -> row
+        self.counters = {'avatar_count': 0, 'latex_count': 0}
+        self.indexes = {}
+        self.changed = set()
+
+    def __getattr__(self, name):
+        # Only reached for columns still in the snapshot, and the row lookup that needs two of them.
+        if name == 'rows':
+            value = {}
+            for row, (member_id, guild_id) in enumerate(zip(self.member_ids, self.guild_ids)):
+                value.setdefault(guild_id, {})[member_id] = row
+        elif name in self.columns and self.snapshot is not None:
+            value = self.snapshot[name]
+        else:
+            raise AttributeError(f'{self.__class__.__name__!r} object has no attribute {name!r}')
+        setattr(self, name, value)
+        return value
+
+    def __len__(self):
+        return len(self.member_ids)
+
     def save(self):
-        with open(self.fname, 'wb') as member_file:
-            pickle.dump(self.member_data, member_file)
+        self.compact_roles()
+        # Every column is read out of the old snapshot here, so it can be let go of.
+        data = {'version': self.version, 'counters': self.counters}
+        data.update((name, getattr(self, name)) for name in self.columns)
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+        write_snapshot(self.fname, data)
 
     def load(self):
+        """Columns are left in the snapshot, one raw array each, until something reads them."""
+        self.clear()
+        try:
+            self.snapshot = load_snapshot(self.fname)
+        except SnapshotError:
+            pass
+        except OSError:
+            return
+        else:
+            if self.snapshot.get('version') == self.version:
+                self.counters.update(self.snapshot['counters'])
+                for name in (*self.columns, 'rows'):
+                    delattr(self, name)
+                return
+            self.snapshot.close()
+            self.snapshot = None
+        # Pickled before snapshots; the next save converts it.
         try:
             with open(self.fname, 'rb') as member_file:
-                self.member_data = pickle.load(member_file)
+                data = pickle.load(member_file)
         except (OSError, EOFError):
-            self.member_data = defaultdict(member_callback, {'avatar_count': 0, 'latex_count': 0})
+            return
+        if isinstance(data, dict) and data.get('version') == self.version:
+            self.counters.update(data['counters'])
+            for name, column in data['columns'].items():
+                setattr(self, name, column)
+            for row, (member_id, guild_id) in enumerate(zip(self.member_ids, self.guild_ids)):
+                self.rows.setdefault(guild_id, {})[member_id] = row
         else:
-            self.member_data.default_factory = member_callback
-        self.save()
+            self.migrate(data)
+
+    def migrate(self, member_data):
+        """Convert the old member_id -> guild_id -> dict file into columns."""
+        for member_id, guilds in member_data.items():
+            if not isinstance(member_id, int):
+                self.counters[member_id] = guilds
+                continue
+            for guild_id, entry in guilds.items():
+                if not (entry['first_join'] or entry['last_seen'] or entry['last_roles']):
+                    continue # Left behind by a lookup; the old store grew on reads.
+                row = self.add_row(member_id, guild_id)
+                self.first_join[row] = to_epoch(entry['first_join'])
+                self.last_seen[row] = to_epoch(entry['last_seen'])
+                self.set_roles(row, entry['last_roles'])
+
+    def find_row(self, member_id, guild_id):
+        guild_rows = self.rows.get(guild_id)
+        return None if guild_rows is None else guild_rows.get(member_id)
+
+    def add_row(self, member_id, guild_id):
+        guild_rows = self.rows.setdefault(guild_id, {})
+        if (row := guild_rows.get(member_id)) is not None:
+            return row
+        guild_rows[member_id] = row = len(self.member_ids)
+        self.member_ids.append(member_id)
+        self.guild_ids.append(guild_id)
+        self.first_join.append(nan)
+        self.last_seen.append(nan)
+        self.role_start.append(0)
+        self.role_count.append(0)
+        return row
+
+    def get_roles(self, row):
+        start = self.role_start[row]
+        return tuple(self.role_pool[start:start+self.role_count[row]])
+
+    def set_roles(self, row, role_ids):
+        # Overwrite in place when the new roles fit, otherwise append; save compacts the leftovers.
+        if len(role_ids) > self.role_count[row]:
+            self.role_start[row] = len(self.role_pool)
+            self.role_pool.extend(role_ids)
+        else:
+            start = self.role_start[row]
+            self.role_pool[start:start+len(role_ids)] = array('q', role_ids)
+        self.role_count[row] = len(role_ids)
+
+    def compact_roles(self):
+        if sum(self.role_count) * 2 >= len(self.role_pool):
+            return
+        pool = array('q')
+        for row in range(len(self.member_ids)):
+            start = self.role_start[row]
+            self.role_start[row] = len(pool)
+            pool.extend(self.role_pool[start:start+self.role_count[row]])
+        self.role_pool = pool
+
+    def take_count(self, counter):
+        """Returns the next value of a running counter, such as the one naming avatar files."""
+        value = self.counters.get(counter, 0)
+        self.counters[counter] = value + 1
+        return value
+
+    def activity(self, guild):
+        """The activity index of a guild's current members, rebuilt when it is both stale and out of date."""
+        index = self.indexes.get(guild.id)
+        if index is None or (guild.id in self.changed and monotonic() - index.built > self.index_staleness):
+            self.changed.discard(guild.id)
+            guild_rows = self.rows.get(guild.id, {})
+            rows = [row for member_id, row in guild_rows.items() if guild.get_member(member_id) is not None]
+            self.indexes[guild.id] = index = ActivityIndex(self, rows)
+        return index
 
     def get(self, field, member):
-        return self.member_data[member.id][member.guild.id][field]
+        if (row := self.find_row(member.id, member.guild.id)) is None:
+            return () if field == 'last_roles' else None
+        if field == 'first_join':
+            return from_epoch(self.first_join[row])
+        elif field == 'last_seen':
+            return from_epoch(self.last_seen[row])
+        elif field == 'last_roles':
+            return self.get_roles(row)
 
     def update(self, field, data):
+        self.changed.add(data.guild.id)
         if field == 'first_join': # data is a discord.Member instance
-            member_data = self.member_data[data.id][data.guild.id]
-            if not member_data[field]:
-                member_data[field] = data.joined_at
+            row = self.add_row(data.id, data.guild.id)
+            if isnan(self.first_join[row]) and data.joined_at is not None:
+                self.first_join[row] = to_epoch(data.joined_at)
         elif field == 'last_seen': # data is a discord.Message instance
-            self.member_data[data.author.id][data.guild.id][field] = data.created_at
+            row = self.add_row(data.author.id, data.guild.id)
+            self.last_seen[row] = to_epoch(data.created_at)
         elif field == 'last_roles': # data is a discord.Member instance
-            self.member_data[data.id][data.guild.id][field] = tuple(role.id for role in data.roles[1:])
+            row = self.add_row(data.id, data.guild.id)
+            self.set_roles(row, [role.id for role in data.roles[1:]])
+
+
+def restorable_roles(guild, role_ids):
+    """The roles the bot can still hand out: not deleted, not @everyone, not managed by an integration, and below its own."""
+    me = guild.me
+    if not me.guild_permissions.manage_roles:
+        return []
+    top_role = me.top_role
+    return [
+        role for role in map(guild.get_role, role_ids)
+        if role is not None and not role.is_default() and not role.managed and role < top_role
+        ]
+
+class RoleRestorer(object):
+    """
+    Gives rejoining members back the roles they last had, in one role edit each. Members with nothing
+    to give back never touch the API. Restores queue per guild and after the first go out at most one
+    per `interval` seconds, so a rejoin wave doesn't eat the rate limit that mod commands share.
+    Which of the queued roles can still be given is checked again right before each edit.
+    """
+
+    def __init__(self, stalker, interval=1.0):
+        self.stalker = stalker
+        self.interval = interval
+        self.pending = {} # guild_id -> member_id -> role IDs, oldest first
+        self.restored = 0
+        self._workers = {}
+
+    def queue(self, member):
+        guild = member.guild
+        role_ids = self.stalker.get('last_roles', member)
+        if not restorable_roles(guild, role_ids):
+            return False
+        self.pending.setdefault(guild.id, OrderedDict())[member.id] = role_ids
+        if guild.id not in self._workers:
+            self._workers[guild.id] = aio.ensure_future(self.work(guild))
+        return True
+
+    def is_queued(self, member):
+        return member.id in self.pending.get(member.guild.id, ())
+
+    def cancel(self, member):
+        """Drop a member's queued restore, returning whether there was one."""
+        return self.pending.get(member.guild.id, {}).pop(member.id, None) is not None
+
+    async def work(self, guild):
+        pending = self.pending[guild.id]
+        try:
+            while pending:
+                member_id, role_ids = pending.popitem(last=False)
+                if (member := guild.get_member(member_id)) is None:
+                    continue
+                if not (roles := restorable_roles(guild, role_ids)):
+                    continue
+                try:
+                    # Non-atomic means one edit with the whole role list, not one request per role.
+                    await member.add_roles(*roles, reason='Restore last roles', atomic=False)
+                except dc.HTTPException:
+                    pass
+                else:
+                    self.restored += 1
+                if pending:
+                    await aio.sleep(self.interval)
+        finally:
+            del self._workers[guild.id], self.pending[guild.id]
 
-    async def load_roles(self, member):
-        await member.add_roles(
-            *map(member.guild.get_role, self.member_data[member.id][member.guild.id]['last_roles']),
-            reason='Restore last roles'
-            )
 
-    
 class Suggestions(Singleton):
+    """
+    Stores pending suggestions as msg_id -> (channel_id, author_id, text, embed_msg_id).
+    Changes are appended to a journal as they happen, and only folded into the main file on save.
+    """
+
     def __init__(self, fname):
         self.fname = os.path.join('data', fname)
+        self.journal_fname = self.fname + '.journal'
         self.load()
 
     def __enter__(self):
@@ -137,27 +409,163 @@ class Suggestions(Singleton):
         self.save()
         
     def load(self):
+        # The journal is replayed on top, and only folded into the file by the next save.
+        try:
+            self.suggestions = load_snapshot(self.fname)
+        except SnapshotError:
+            self.load_pickle()
+        except OSError:
+            self.suggestions = {}
+        try:
+            with open(self.journal_fname, 'rb') as journal:
+                while True:
+                    msg_id, entry = pickle.load(journal)
+                    if entry is None:
+                        self.suggestions.pop(msg_id, None)
+                    else:
+                        self.suggestions[msg_id] = entry
+        except (OSError, EOFError, pickle.UnpicklingError): # A torn last write only loses that write.
+            pass
+
+    def load_pickle(self):
+        # Saved before snapshots; the next save converts it.
         try:
             with open(self.fname, 'rb') as suggests:
-                self.suggestions = pickle.load(suggests)
-            if isinstance(self.suggestions, defaultdict):
-                self.suggestions = dict(self.suggestions)
+                self.suggestions = dict(pickle.load(suggests))
         except (OSError, EOFError):
             self.suggestions = {}
-            self.save()
+        for msg_id, entry in self.suggestions.items():
+            if len(entry) == 2: # Stored before the text and embed were kept.
+                self.suggestions[msg_id] = (*entry, None, None)
 
     def save(self):
-        with open(self.fname, 'wb') as suggests:
-            pickle.dump(self.suggestions, suggests)
-            
-    def add_suggestion(self, msg_id, author, channel):
-        self.suggestions[msg_id] = (channel, author)
-        self.save()
+        write_snapshot(self.fname, self.suggestions)
+        with open(self.journal_fname, 'wb'):
+            pass
+
+    def log(self, msg_id, entry):
+        with open(self.journal_fname, 'ab') as journal:
+            pickle.dump((msg_id, entry), journal)
+
+    def add_suggestion(self, msg_id, author, channel, text=None, embed_msg_id=None):
+        self.suggestions[msg_id] = entry = (channel, author, text, embed_msg_id)
+        self.log(msg_id, entry)
 
     def get_suggestion(self, ctx, msg_id):
-        chn_id, usr_id = self.suggestions[msg_id]
+        chn_id, usr_id, text, embed_msg_id = self.suggestions[msg_id]
         channel = ctx.get_channel(chn_id)
-        return (channel, channel.guild.get_member(usr_id))
+        return (channel, channel.guild.get_member(usr_id), text, embed_msg_id)
         
     def remove_suggestion(self, msg_id):
-        removed = self.suggestions.pop(msg_id)
+        if self.suggestions.pop(msg_id, None) is not None:
+            self.log(msg_id, None)
+
+
+class AuditLogTailer(object):
+    """
+    Follows one guild's audit log for a single action type, indexing entries by target ID.
+    Only entries newer than the newest one seen are fetched, and lookups made while a fetch
+    is in flight wait on that fetch instead of starting their own.
+    """
+    max_lag = timedelta(minutes=1) # How far an entry may predate the event it explains.
+
+    def __init__(self, guild, action, maxlen=1024, seed=100):
+        self.guild = guild
+        self.action = action
+        self.maxlen = maxlen
+        self.seed = seed
+        self.entries = OrderedDict()
+        self.newest = None
+        self._fetching = None
+
+    async def _fetch(self):
+        if seeding := self.newest is None: # First fetch, only look back a little way.
+            history = self.guild.audit_logs(limit=self.seed, action=self.action, oldest_first=False)
+        else:
+            history = self.guild.audit_logs(limit=None, action=self.action, after=self.newest)
+        entries = self.entries
+        seen = set()
+        async for entry in history:
+            if self.newest is None or entry.id > self.newest.id:
+                self.newest = dc.Object(entry.id)
+            if entry.target is None:
+                continue
+            if seeding: # Newest first, so only the first entry for a target is its latest.
+                if entry.target.id in seen:
+                    continue
+                seen.add(entry.target.id)
+            entries[entry.target.id] = entry
+            entries.move_to_end(entry.target.id)
+            if len(entries) > self.maxlen:
+                entries.popitem(last=False)
+
+    async def refresh(self):
+        if self._fetching is None or self._fetching.done():
+            self._fetching = aio.ensure_future(self._fetch())
+        await aio.shield(self._fetching)
+
+    async def find(self, target_id, retry_delay=1.0):
+        """
+        Return and consume the newest entry for a target, fetching only if it isn't indexed yet.
+        The gateway event can beat the audit log entry, so a miss is retried once after a delay.
+        Entries from well before the call belong to some earlier action and are passed over.
+        """
+        since = datetime.utcnow() - self.max_lag
+        if (entry := self.entries.pop(target_id, None)) is not None and entry.created_at >= since:
+            return entry
+        for delay in (0, retry_delay):
+            await aio.sleep(delay)
+            await self.refresh()
+            if (entry := self.entries.pop(target_id, None)) is not None and entry.created_at >= since:
+                return entry
+        return None
+
+
+class ChannelPurge(object):
+    """
+    Deletes matching messages from a channel while its history streams in, bulk deleting up
+    to 100 at a time. Only the current batch and per-author counts are ever held in memory.
+    """
+    batch_size = 100
+
+    def __init__(self, channel, check=None, progress=None):
+        self.channel = channel
+        self.check = check
+        self.progress = progress # Coroutine function taking this purge.
+        self.counts = Counter()
+        self.scanned = 0
+        self.deleted = 0
+
+    async def run(self, limit, before=None, after=None):
+        """Search the last `limit` messages before `before`, stopping early at any older than `after`."""
+        # Bulk delete refuses messages older than two weeks, so those go one by one.
+        bulk_cutoff = dc.utils.time_snowflake(datetime.utcnow() - timedelta(days=14))
+        batch = []
+        async for msg in self.channel.history(limit=limit, before=before, oldest_first=False):
+            if after is not None and msg.created_at < after:
+                break
+            self.scanned += 1
+            if self.check is None or self.check(msg):
+                if msg.id > bulk_cutoff:
+                    batch.append(msg)
+                    if len(batch) == self.batch_size:
+                        await self.delete(batch)
+                        batch = []
+                else:
+                    await self.delete([msg])
+            if self.progress is not None:
+                await self.progress(self)
+        if batch:
+            await self.delete(batch)
+        return self.counts
+
+    async def delete(self, msgs):
+        try:
+            if len(msgs) == 1:
+                await msgs[0].delete()
+            else:
+                await self.channel.delete_messages(msgs)
+        except dc.NotFound: # Someone got to it first.
+            return
+        self.deleted += len(msgs)
+        self.counts.update(msg.author for msg in msgs)
@@ -0,0 +1,175 @@
+# Performance data classes, for timing event handlers and commands.
+import os
+import json
+import math
+from time import perf_counter
+from array import array
+from datetime import datetime
+from contextlib import contextmanager
+
+# Latency histograms use log-scaled buckets: 4 buckets per doubling starting at 10us,
+# so any percentile read off a histogram is within ~19% of the true value.
+# The last bucket catches everything slower than ~3 minutes, and reads as the peak.
+_BUCKET_BASE = 1e-5
+_BUCKET_STEPS = 4
+_BUCKET_COUNT = 98
+
+def _bucket_index(elapsed):
+    if elapsed <= _BUCKET_BASE:
+        return 0
+    return min(_BUCKET_COUNT - 1, 1 + int(math.log2(elapsed / _BUCKET_BASE) * _BUCKET_STEPS))
+
+def _bucket_bound(index):
+    return _BUCKET_BASE * 2 ** (index / _BUCKET_STEPS)
+
+
+class HandlerStats(object):
+    # Everything here is only ever touched from the event loop thread, so plain
+    # counters are enough; no locks are needed to keep the numbers consistent.
+    __slots__ = ('calls', 'errors', 'total', 'peak', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.peak = 0.0
+        self.buckets = array('L', bytes(_BUCKET_COUNT * array('L').itemsize))
+
+    def record(self, elapsed, failed=False):
+        self.calls += 1
+        self.errors += failed
+        self.total += elapsed
+        if elapsed > self.peak:
+            self.peak = elapsed
+        self.buckets[_bucket_index(elapsed)] += 1
+
+    def percentile(self, pct):
+        if not self.calls:
+            return 0.0
+        rank = math.ceil(self.calls * pct / 100)
+        seen = 0
+        for idx, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return self.peak if idx == _BUCKET_COUNT - 1 else min(self.peak, _bucket_bound(idx))
+        return self.peak
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.peak,
+            }
+
+
+class StartupProfiler(object):
+    """
+    Times the phases of bringing the bot up, in the order they finished. Phases may nest,
+    so an import shows the cogs it added and the data they loaded underneath it.
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.phases = []
+        self.ready_at = None
+        self.readies = 0 # Reconnects fire ready again; only the first belongs to startup.
+        self._depth = 0
+
+    def record(self, name, start, elapsed, depth=0):
+        self.phases.append((name, start - self.started, elapsed, depth))
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        depth = self._depth
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth = depth
+            self.record(name, start, perf_counter() - start, depth)
+
+    def mark_ready(self):
+        self.readies += 1
+        if self.ready_at is None:
+            self.ready_at = perf_counter() - self.started
+
+    def summary(self):
+        return {
+            'ready_at': self.ready_at,
+            'phases': [
+                {'name': name, 'start': start, 'elapsed': elapsed, 'depth': depth}
+                for name, start, elapsed, depth in self.phases
+                ],
+            }
+
+    def report(self, limit=40):
+        # Phases finish innermost first, so order by start time to put parents above their children.
+        lines = [f'{"phase":<44} {"start":>9} {"elapsed":>9}']
+        for name, start, elapsed, depth in sorted(self.phases, key=lambda phase: (phase[1], phase[3]))[:limit]:
+            lines.append(f'{("  "*depth + name)[:44]:<44} {start:>8.3f}s {elapsed*1000:>7.1f}ms')
+        if self.ready_at is not None:
+            lines.append(f'{"ready":<44} {self.ready_at:>8.3f}s')
+        return '\n'.join(lines)
+
+startup_profiler = StartupProfiler()
+
+
+class PerfTracker(object):
+    sort_keys = ('total', 'calls', 'errors', 'mean', 'p50', 'p95', 'p99', 'max')
+
+    def __init__(self, fname):
+        self.fname = os.path.join('data', fname)
+        self.started = datetime.utcnow()
+        self.handlers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, etrace):
+        self.save()
+
+    def record(self, name, elapsed, failed=False):
+        try:
+            stats = self.handlers[name]
+        except KeyError:
+            stats = self.handlers[name] = HandlerStats()
+        stats.record(elapsed, failed)
+
+    def reset(self):
+        self.started = datetime.utcnow()
+        self.handlers.clear()
+
+    def snapshot(self):
+        return {
+            'started': self.started.isoformat(),
+            'taken': datetime.utcnow().isoformat(),
+            'handlers': {name: stats.summary() for name, stats in self.handlers.items()},
+            'startup': startup_profiler.summary(),
+            }
+
+    def save(self):
+        tmpname = self.fname + '.tmp'
+        with open(tmpname, 'w') as perf_file:
+            json.dump(self.snapshot(), perf_file, indent=1, sort_keys=True)
+        os.replace(tmpname, self.fname)
+
+    def report(self, sort='total', limit=15):
+        """Render the slowest handlers as a fixed-width table, sorted by the given column."""
+        rows = []
+        for name, stats in self.handlers.items():
+            summary = stats.summary()
+            summary['total'] = stats.total
+            rows.append((name, summary))
+        rows.sort(key=lambda row: row[1][sort], reverse=True)
+        lines = [f'{"handler":<40} {"calls":>7} {"errs":>5} {"p50":>8} {"p95":>8} {"p99":>8} {"max":>8}']
+        for name, summary in rows[:limit]:
+            lines.append(
+                f'{name[:40]:<40} {summary["calls"]:>7} {summary["errors"]:>5} '
+                + ' '.join(f'{summary[key]*1000:>6.1f}ms' for key in ('p50', 'p95', 'p99', 'max'))
+                )
+        return '\n'.join(lines)
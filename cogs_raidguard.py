@@ -0,0 +1,260 @@
+# The RaidGuard Cog, which watches the join stream for raid waves.
+import re
+from time import monotonic
+from datetime import datetime, timedelta
+from collections import deque, Counter, OrderedDict
+
+import asyncio as aio
+
+import discord as dc
+from discord.ext import commands
+
+from cogs_textbanks import url_bank, query_bank, response_bank
+from cogs_massban import MassBan
+from bot_common import bot, guild_whitelist, CogtextManager
+
+# Names matching these are banned on sight in every guild, the rest only count as suspicious.
+ban_patterns = re.compile(r'RTFKT')
+sus_patterns = re.compile(
+    r'free\W*nitro|nitro\W*(?:gift|drop)|air\W*drop|\bnft\b|discord\W*gg|steam\W*gift|giveaway',
+    re.IGNORECASE,
+    )
+_confusables = str.maketrans('0134578$@!|', 'oleastbsaii')
+_skeleton_junk = re.compile(r'[^a-z]+')
+
+def name_skeleton(name):
+    """Reduce a name to the letters it is built from, so freenitro01 and Fr33_N1tro_07 collide."""
+    return _skeleton_junk.sub('', name.lower().translate(_confusables))
+
+
+class JoinWindow(object):
+    """
+    Sliding window over one guild's recent joins, with a running count of name skeletons.
+    Both are bounded by the window length and maxlen, so a flood can't grow them without limit.
+    """
+    __slots__ = ('joins', 'skeletons', 'length')
+
+    def __init__(self, length, maxlen):
+        self.joins = deque(maxlen=maxlen)
+        self.skeletons = Counter()
+        self.length = length
+
+    def __len__(self):
+        return len(self.joins)
+
+    def expire(self, now):
+        joins, skeletons = self.joins, self.skeletons
+        while joins and (now - joins[0][0] > self.length or len(joins) == joins.maxlen):
+            _, _, skeleton = joins.popleft()
+            if (count := skeletons[skeleton] - 1):
+                skeletons[skeleton] = count
+            else:
+                del skeletons[skeleton]
+
+    def add(self, now, member_id, skeleton):
+        self.expire(now)
+        self.joins.append((now, member_id, skeleton))
+        self.skeletons[skeleton] += 1
+        return self.skeletons[skeleton]
+
+    def cluster(self, skeleton):
+        return [member_id for _, member_id, other in self.joins if other == skeleton]
+
+
+class RaidGuard(CogtextManager):
+    window = 60 # Seconds of joins considered at once.
+    window_maxlen = 2000
+    raid_rate = 10 # Joins within the window before a guild counts as raided.
+    cluster_size = 3 # Joins sharing a name skeleton before they count as a cluster.
+    suspect_score = 3
+    alert_delay = 5 # Seconds to gather a wave before reporting or banning it.
+    flagged_maxlen = 1000
+    modes = ('off', 'alert', 'ban')
+
+    @staticmethod
+    def _generate_empty():
+        return {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.guild_config = bot.get_cog('GuildConfiguration')
+        self.windows = {guild_id: JoinWindow(self.window, self.window_maxlen) for guild_id in guild_whitelist}
+        self.flagged = {guild_id: OrderedDict() for guild_id in guild_whitelist}
+        self.pending = {guild_id: OrderedDict() for guild_id in guild_whitelist}
+        self.to_ban = {guild_id: OrderedDict() for guild_id in guild_whitelist}
+        self.reporters = {}
+
+    def get_mode(self, guild):
+        return self.data.get(guild.id, 'alert')
+
+    def guards(self, guild):
+        return guild.id in guild_whitelist and self.get_mode(guild) != 'off'
+
+    def score(self, member, cluster=0):
+        """Returns the suspicion score of a member along with the reasons for it."""
+        reasons = []
+        score = 0
+        age = datetime.utcnow() - member.created_at
+        if age < timedelta(days=1):
+            score += 2
+            reasons.append('brand new account')
+        elif age < timedelta(days=7):
+            score += 1
+            reasons.append('new account')
+        if sus_patterns.search(member.name):
+            score += 2
+            reasons.append('suspicious name')
+        if member.avatar is None:
+            score += 1
+            reasons.append('default avatar')
+        if cluster >= self.cluster_size:
+            score += 2
+            reasons.append(f'{cluster} similar names')
+        return score, reasons
+
+    def verdict(self, member):
+        """A one line summary of how a member fared, for the join log."""
+        if ban_patterns.search(member.name):
+            return 'banned for nft'
+        if not self.guards(member.guild): # Nothing was checked, so there is nothing to report.
+            return None
+        window = self.windows.get(member.guild.id)
+        cluster = window.skeletons[name_skeleton(member.name)] if window is not None else 0
+        score, reasons = self.score(member, cluster)
+        if score >= self.suspect_score:
+            return f'flagged: {", ".join(reasons)}'
+        return None
+
+    def flag(self, guild_id, member_id, label):
+        flagged = self.flagged[guild_id]
+        flagged[member_id] = label
+        if len(flagged) > self.flagged_maxlen:
+            flagged.popitem(last=False)
+        self.pending[guild_id][member_id] = label
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        guild = member.guild
+        if not self.guards(guild):
+            if ban_patterns.search(member.name): # Banned on sight everywhere, whatever the guard is set to.
+                await member.ban()
+            return
+        mode = self.get_mode(guild)
+        window = self.windows[guild.id]
+        skeleton = name_skeleton(member.name)
+        cluster = window.add(monotonic(), member.id, skeleton)
+        if ban_patterns.search(member.name):
+            self.to_ban[guild.id][member.id] = str(member)
+            self.schedule_report(guild)
+            return
+        if len(window) < self.raid_rate:
+            return
+        score, _ = self.score(member, cluster)
+        if score >= self.suspect_score:
+            self.flag(guild.id, member.id, str(member))
+        if cluster == self.cluster_size: # Flag the rest of a cluster as soon as it forms.
+            for member_id in window.cluster(skeleton):
+                if member_id not in self.flagged[guild.id] and (other := guild.get_member(member_id)):
+                    self.flag(guild.id, member_id, str(other))
+        if self.pending[guild.id]:
+            if mode == 'ban':
+                self.to_ban[guild.id].update(self.pending[guild.id])
+            self.schedule_report(guild)
+
+    def schedule_report(self, guild):
+        # One reporter per guild gathers the wave for a few seconds, so a raid is one message, not hundreds.
+        reporter = self.reporters.get(guild.id)
+        if reporter is None or reporter.done():
+            self.reporters[guild.id] = self.bot.loop.create_task(self.report(guild))
+
+    async def report(self, guild):
+        await aio.sleep(self.alert_delay)
+        pending, self.pending[guild.id] = self.pending[guild.id], OrderedDict()
+        to_ban, self.to_ban[guild.id] = self.to_ban[guild.id], OrderedDict()
+        mass_ban = None
+        if to_ban:
+            mass_ban = MassBan(guild, 'Banned by raid guard.')
+            await mass_ban.run(to_ban)
+            for member_id in to_ban:
+                self.flagged[guild.id].pop(member_id, None)
+        if not self.guild_config.getlog(guild, 'modlog') or not (pending or to_ban):
+            return
+        embed = dc.Embed(
+            color=dc.Color.red(),
+            timestamp=datetime.utcnow(),
+            description=response_bank.raidguard_alert_desc.format(
+                joins=len(self.windows[guild.id]), window=self.window,
+                ),
+            )
+        embed.set_author(name=response_bank.raidguard_alert_head.format(guild=guild), icon_url=bot.user.avatar_url)
+        if (suspects := [label for member_id, label in pending.items() if member_id not in to_ban]):
+            embed.add_field(name='**Flagged:**', value=self.format_labels(suspects), inline=False)
+        if mass_ban is not None:
+            embed.add_field(
+                name='**Banned:**',
+                value=response_bank.raidguard_ban_desc.format(
+                    banned=mass_ban.count(), total=len(to_ban), elapsed=mass_ban.elapsed,
+                    ),
+                inline=False,
+                )
+        await self.guild_config.log(guild, 'modlog', embed=embed)
+
+    @staticmethod
+    def format_labels(labels, limit=1000):
+        text = ', '.join(f'`{label}`' for label in labels)
+        if len(text) <= limit:
+            return text
+        return f'{text[:limit].rsplit(", ", 1)[0]} and more...'
+
+    @commands.group(name='raidguard')
+    @commands.has_guild_permissions(ban_members=True)
+    async def raid_guard(self, ctx):
+        if ctx.invoked_subcommand is None:
+            await ctx.send(response_bank.raidguard_usage)
+
+    @raid_guard.error
+    async def raid_guard_error(self, ctx, error):
+        if isinstance(error, commands.MissingPermissions):
+            await ctx.send(response_bank.perms_error)
+            return
+        raise error
+
+    @raid_guard.command(name='mode')
+    async def raid_guard_mode(self, ctx, mode: str):
+        if mode not in self.modes or ctx.guild.id not in guild_whitelist:
+            await ctx.send(response_bank.raidguard_mode_error)
+            return
+        self.data[ctx.guild.id] = mode
+        self.data_save()
+        await ctx.send(response_bank.raidguard_mode_confirm.format(mode=mode))
+
+    @raid_guard.command(name='status')
+    async def raid_guard_status(self, ctx):
+        if (window := self.windows.get(ctx.guild.id)) is None:
+            return
+        window.expire(monotonic())
+        await ctx.send(response_bank.raidguard_status.format(
+            joins=len(window), window=self.window,
+            flagged=len(self.flagged[ctx.guild.id]), mode=self.get_mode(ctx.guild),
+            ))
+
+    @raid_guard.command(name='ban')
+    @commands.bot_has_guild_permissions(ban_members=True)
+    async def raid_guard_ban(self, ctx):
+        flagged = self.flagged.get(ctx.guild.id)
+        if not flagged:
+            await ctx.send(response_bank.raidguard_ban_empty)
+            return
+        # Hand the wave to raidban, which does the banning, reporting and logging.
+        user_ids = [str(member_id) for member_id in flagged]
+        flagged.clear()
+        await ctx.invoke(self.bot.get_command('raidban'), *user_ids)
+
+    @raid_guard.command(name='clear')
+    async def raid_guard_clear(self, ctx):
+        if (flagged := self.flagged.get(ctx.guild.id)) is not None:
+            flagged.clear()
+        await ctx.send(response_bank.raidguard_clear_confirm)
+
+
+bot.add_cog(RaidGuard(bot))
@@ -1,26 +1,33 @@
 # The ReactRoleTagger cog and all associated commands and data.
 import os
 import pickle
+from time import perf_counter
 from datetime import datetime
 from collections import defaultdict
 from typing import Union, List, Optional
 
+import asyncio as aio
+
 import discord as dc
 from discord.ext import commands
 
 from cogs_textbanks import url_bank, query_bank, response_bank
+from cogs_perftracker import startup_profiler
 from bot_common import bot, CogtextManager
 
 EmojiUnion = Union[dc.Emoji, dc.PartialEmoji, str]
 
 react_timetable = {}
 
-def get_react_id(react: Union[dc.Reaction, EmojiUnion]) -> int:
+def get_react_id(react: Union[dc.Reaction, EmojiUnion]) -> Union[int, str]:
+    """Custom emoji are keyed by ID, unicode emoji by their text, so keys mean the same thing after a restart."""
     if isinstance(react, dc.Reaction):
         react = react.emoji
     if isinstance(react, (dc.Emoji, dc.PartialEmoji)):
-        return react.id
-    return hash(react)
+        if react.id is not None:
+            return react.id
+        react = react.name
+    return react.replace('\ufe0f', '') # Clients disagree on whether to send the variation selector.
 
 async def process_role_grant(bot, msg, react, role, members) -> None:
     role_manager = bot.get_cog('RoleManager')
@@ -36,136 +43,155 @@ async def process_role_grant(bot, msg, react, role, members) -> None:
 
 
 class ReactRoleTagger(CogtextManager):
+    grant_delay = 5 # Seconds after ready before catching up, so startup traffic goes first.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.grant_task = None
+
+    # Data is {'roles': {(msg_id, emoji key): role_id}, 'messages': {msg_id: chn_id}}.
+    # Reactions on any other message are turned away by one lookup in messages.
     @staticmethod
-    def _generate_msg_dict():
+    def _generate_empty():
+        return {'roles': {}, 'messages': {}}
+
+    @staticmethod
+    def _generate_msg_dict(): # Still needed to unpickle data saved before the flat index.
         return defaultdict(dict)
 
-    def _generate_empty(self):
-        return defaultdict(self._generate_msg_dict)
+    def cleanup_on_load(self):
+        if 'roles' in self.data and 'messages' in self.data:
+            return
+        # Convert from channel -> message -> emoji -> role, dropping the empty entries lookups left behind.
+        # Unicode emoji used to be keyed by their hash, which changes every restart, so those need adding again.
+        legacy, self.data = self.data, self._generate_empty()
+        for chn_id, msg_dict in legacy.items():
+            for msg_id, emoji_dict in msg_dict.items():
+                for emoji_id, role_id in emoji_dict.items():
+                    self.add_entry(chn_id, msg_id, emoji_id, role_id)
+
+    def add_entry(self, chn_id, msg_id, key, role_id):
+        self.data['roles'][msg_id, key] = role_id
+        self.data['messages'][msg_id] = chn_id
+
+    def remove_entry(self, msg_id, key):
+        if self.data['roles'].pop((msg_id, key), None) is None:
+            return False
+        if not any(entry_msg_id == msg_id for entry_msg_id, _ in self.data['roles']):
+            del self.data['messages'][msg_id]
+        return True
+
+    def drop_message(self, msg_id):
+        if self.data['messages'].pop(msg_id, None) is None:
+            return False
+        roles = self.data['roles']
+        for key in [key for key in roles if key[0] == msg_id]:
+            del roles[key]
+        return True
 
-    def cleanup_before_save(self):
-        for chn_id, msg_dict in self.data.items():
-            for msg_id in list(msg_dict):
-                if not msg_dict[msg_id]:
-                    del msg_dict[msg_id]
-    
     def remove_reaction(self, msg, react):
-        try:
-            del self.data[msg.channel.id][msg.id][get_react_id(react)]
-        except KeyError:
+        if not self.remove_entry(msg.id, get_react_id(react)):
             print(response_bank.role_remove_react_error.format(react=react, msg=msg))
             return
         self.data_save()
 
     async def force_grant_all(self):
         # This is a horrible fucking way of granting all the pending roles. Too bad!
-        for chn_id, msg_dict in self.data.items():
-            channel = bot.get_channel(chn_id)
-            for msg_id, emoji_dict in msg_dict.items():
-                try:
-                    msg = await channel.fetch_message(msg_id)
-                except (AttributeError, dc.NotFound): # This message entry will be cleared when the bot closes.
-                    emoji_dict.clear()
-                    continue
-                for react in msg.reactions:
-                    if (emoji_id := get_react_id(react)) in emoji_dict:
-                        role = msg.guild.get_role(emoji_dict[emoji_id])
-                        members = [m async for m in react.users() if m.id != bot.user.id]
-                        await process_role_grant(self.bot, msg, react, role, members)
+        # Runs in the background, so walk a copy in case reactroles change meanwhile.
+        roles = self.data['roles']
+        dropped = False
+        for msg_id, chn_id in list(self.data['messages'].items()):
+            try:
+                msg = await bot.get_channel(chn_id).fetch_message(msg_id)
+            except (AttributeError, dc.NotFound):
+                dropped = self.drop_message(msg_id) or dropped
+                continue
+            for react in msg.reactions:
+                if (role_id := roles.get((msg_id, get_react_id(react)))) is not None:
+                    role = msg.guild.get_role(role_id)
+                    members = [m async for m in react.users() if m.id != bot.user.id]
+                    await process_role_grant(self.bot, msg, react, role, members)
+        if dropped:
+            self.data_save()
 
     @commands.Cog.listener()
     async def on_ready(self):
+        # Catching up means fetching every reactrole message, so it happens once, off the ready path.
+        if self.grant_task is None:
+            self.grant_task = self.bot.loop.create_task(self.grant_leftovers())
+
+    async def grant_leftovers(self):
+        await aio.sleep(self.grant_delay)
         print(response_bank.process_reacts)
+        start = perf_counter()
         await self.force_grant_all()
+        startup_profiler.record('force_grant_all', start, perf_counter()-start)
         print(response_bank.process_reacts_complete)
 
     @commands.Cog.listener()
     async def on_message_delete(self, msg):
         # If a message with a react is removed, remove associated data if it exists.
-        try:
-            del self.data[msg.channel.id][msg.id]
-        except KeyError:
-            return
-        self.data_save()
+        if self.drop_message(msg.id):
+            self.data_save()
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload): # Reaction is added to message
         # Not on_reaction_add because of this weird assed queue of messages CHRIST i hate discord
         # Because discord can't save every message in RAM, this is what suffering looks like.
+        msg_id = payload.message_id
+        if msg_id not in self.data['messages']:
+            return
+        # Checks if the react is in the message
+        if (role_id := self.data['roles'].get((msg_id, get_react_id(payload.emoji)))) is None:
+            return
         guild = bot.get_guild(payload.guild_id)
         if guild is None:
             return
         member = guild.get_member(payload.user_id)
-        if member.id == bot.user.id:
-            return 
+        if member is None or member.id == bot.user.id:
+            return
         emoji = payload.emoji
-        chn_id = payload.channel_id
-        msg_id = payload.message_id
-        # Checks if the message is in the dict
-        if react_map := self.data[chn_id][msg_id]:
-            # Checks if the react is in the message
-            try:
-                role = guild.get_role(react_map[emoji.id])
-            except KeyError: # If emoji is not in the message, ignore.
-                return
-            except commands.RoleNotFound as exc:
-                print(exc.args[0])
+        # There should be another exception clause here for missing roles but fuck that shit
+        role = guild.get_role(role_id)
+        # Toggle role addition/removal.
+        msg = await guild.get_channel(payload.channel_id).fetch_message(msg_id)
+        if (last_react := react_timetable.get(member.id)) is not None:
+            if (datetime.utcnow() - last_react).seconds < 2*60:
+                await msg.remove_reaction(emoji, member)
                 return
-            # There should be another exception clause here for missing roles but fuck that shit
-            # Toggle role addition/removal.
-            msg = await guild.get_channel(chn_id).fetch_message(msg_id)
-            if (last_react := react_timetable.get(member.id)) is not None:
-                if (datetime.utcnow() - last_react).seconds < 2*60:
-                    await msg.remove_reaction(emoji, member)
-                    return
-            react_timetable[member.id] = datetime.utcnow()
-            await process_role_grant(self.bot, msg, emoji, role, (member,))
+        react_timetable[member.id] = datetime.utcnow()
+        await process_role_grant(self.bot, msg, emoji, role, (member,))
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload): # Reaction is removed from message
         # If reacts from the bot are removed from messages under the role reacts, remove the associated data.
-        if (guild := bot.get_guild(payload.guild_id)) is None:
+        if payload.message_id not in self.data['messages'] or payload.user_id != bot.user.id:
             return
-        if payload.user_id != bot.user.id:
+        if (guild := bot.get_guild(payload.guild_id)) is None:
             return
         emoji = payload.emoji
-        chn_id = payload.channel_id
-        msg_id = payload.message_id
-        # Checks if the message is in the dict
-        if react_map := self.data[chn_id][msg_id]:
-            # Find the reaction with matching emoji, then prune all further reacts.
-            msg = await guild.get_channel(chn_id).fetch_message(msg_id)
-            self.remove_reaction(msg, emoji)
-            for react in msg.reactions:
-                if str(react.emoji) == str(emoji):
-                    async for member in react.users():
-                        await msg.remove_reaction(emoji, member)
-                    return
+        # Find the reaction with matching emoji, then prune all further reacts.
+        msg = await guild.get_channel(payload.channel_id).fetch_message(payload.message_id)
+        self.remove_reaction(msg, emoji)
+        for react in msg.reactions:
+            if str(react.emoji) == str(emoji):
+                async for member in react.users():
+                    await msg.remove_reaction(emoji, member)
+                return
 
     @commands.Cog.listener()
     async def on_raw_reaction_clear_emoji(self, payload): # All reacts of one emoji cleared from message
         # If all reacts of a certain emoji are removed, remove associated data if it exists.
-        if (guild := bot.get_guild(payload.guild_id)) is None:
+        if payload.message_id not in self.data['messages']:
             return
-        emoji = payload.emoji
-        chn_id = payload.channel_id
-        msg_id = payload.message_id
-        # Checks if the message is in the dict
-        if react_map := self.data[chn_id][msg_id]:
-            # Find the reaction with matching emoji, then prune all further reacts.
-            msg = await guild.get_channel(chn_id).fetch_message(msg_id)
+        if self.remove_entry(payload.message_id, get_react_id(payload.emoji)):
+            self.data_save()
 
     @commands.Cog.listener()
     async def on_raw_reaction_clear(self, payload): # All reacts cleared from message
         # If all reacts from a message are removed, remove associated data if it exists.
-        if (guild := bot.get_guild(payload.guild_id)) is None:
-            return
-        msg = await guild.get_channel(payload.channel_id).fetch_message(payload.message_id)
-        try:
-            del self.data[msg.channel.id][msg.id]
-        except KeyError:
-            return
-        self.data_save()
+        if self.drop_message(payload.message_id):
+            self.data_save()
 
     @commands.group()
     @commands.bot_has_permissions(send_messages=True, read_message_history=True)
@@ -244,7 +270,7 @@ class ReactRoleTagger(CogtextManager):
                 raise commands.EmojiNotFound('invalid emoji argument')
             await ctx.send(response_bank.reactrole_add_error)
             return
-        self.data[msg.channel.id][msg.id][get_react_id(emoji)] = role.id
+        self.add_entry(msg.channel.id, msg.id, get_react_id(emoji), role.id)
         self.data_save()
         await ctx.send(response_bank.reactrole_add_confirm.format(role=role))
 
@@ -268,14 +294,12 @@ class ReactRoleTagger(CogtextManager):
     @commands.bot_has_permissions(read_message_history=True)
     async def reactrole_del(self, ctx, msg: dc.Message, emoji: Optional[EmojiUnion]=None):
         if not emoji:
-            try:
-                del self.data[msg.channel.id][msg.id]
-            except KeyError:
+            if not self.drop_message(msg.id):
                 await ctx.send(response_bank.react_error)
                 return
             self.data_save()
             await msg.clear_reactions()
-        elif self.data[msg.channel.id][msg.id]:
+        elif msg.id in self.data['messages']:
             self.remove_reaction(msg, emoji)
             await msg.clear_reaction(emoji)
         await ctx.send(response_bank.reactrole_del_confirm)
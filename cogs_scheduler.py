@@ -0,0 +1,271 @@
+# One timer heap for every periodic job of the bot, with cron or interval schedules that survive restarts.
+import os
+import json
+import random
+import traceback
+from time import time, perf_counter
+from heapq import heappush, heappop
+from datetime import datetime, timedelta, timezone
+
+import asyncio as aio
+
+catch_up_policies = ('skip', 'once', 'all')
+_cron_macros = {
+    '@hourly': '0 * * * *', '@daily': '0 0 * * *', '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *', '@yearly': '0 0 1 1 *',
+    }
+_cron_bounds = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+class Every(object):
+    """Runs every so many seconds, counted from the previous scheduled run rather than when it finished."""
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds=0, *, minutes=0, hours=0):
+        self.seconds = seconds + 60*minutes + 3600*hours
+        if self.seconds <= 0:
+            raise ValueError('interval must be positive')
+
+    def __str__(self):
+        return f'every {timedelta(seconds=self.seconds)}'
+
+    def next_after(self, when):
+        return when + self.seconds
+
+
+class Cron(object):
+    """
+    A five field cron expression, minute hour day-of-month month day-of-week, in UTC.
+    Fields take *, lists, ranges and steps, and day-of-week counts Sunday as 0 or 7.
+    As in cron, a day matches either day field when both are restricted.
+    """
+    __slots__ = ('expr', 'minutes', 'hours', 'days', 'months', 'weekdays', 'any_day', 'any_weekday')
+
+    def __init__(self, expr):
+        self.expr = expr
+        fields = _cron_macros.get(expr, expr).split()
+        if len(fields) != 5:
+            raise ValueError(f'cron expressions have 5 fields, not {len(fields)}: {expr!r}')
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self.parse_field(field, low, high) for field, (low, high) in zip(fields, _cron_bounds)
+            )
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.any_day, self.any_weekday = fields[2] == '*', fields[4] == '*'
+        self.next_after(time()) # Fail now on expressions that can never match, like 30 February.
+
+    def __str__(self):
+        return self.expr
+
+    @staticmethod
+    def parse_field(field, low, high):
+        values = set()
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            if span == '*':
+                start, stop = low, high
+            elif '-' in span:
+                start, stop = map(int, span.split('-'))
+            else:
+                start = stop = int(span)
+                if step:
+                    stop = high
+            if not (low <= start <= stop <= high):
+                raise ValueError(f'cron field {field!r} is out of range {low}-{high}')
+            values.update(range(start, stop+1, int(step) if step else 1))
+        return frozenset(values)
+
+    def day_matches(self, day):
+        in_month = day.day in self.days
+        in_week = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, when):
+        moment = datetime.fromtimestamp(when, timezone.utc).replace(second=0, microsecond=0)
+        moment += timedelta(minutes=1)
+        limit = moment.year + 5
+        # Skip whole months, days and hours at a time, so this takes dozens of steps, not thousands.
+        while moment.year <= limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f'cron expression {self.expr!r} never matches')
+
+
+class Job(object):
+    __slots__ = (
+        'name', 'func', 'schedule', 'catch_up', 'jitter', 'next_run', 'generation', 'task', 'skipped', 'deferred',
+        )
+
+    def __init__(self, name, func, schedule, catch_up, jitter):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.catch_up = catch_up
+        self.jitter = jitter
+        self.next_run = None
+        self.generation = 0
+        self.task = None
+        self.skipped = 0
+        self.deferred = False
+
+
+class Scheduler(object):
+    """
+    Runs registered jobs from a single heap of fire times, with one task sleeping until the
+    earliest. Each job's next scheduled run is saved as it changes, so a restart neither
+    shifts nor forgets it. Runs missed while the bot was down are handled by the job's policy:
+    'skip' waits for the next one, 'once' runs a single make-up run, and 'all' replays every
+    missed run up to max_catch_up. Jitter delays each run by up to that many seconds, but the
+    run after it is still counted from the unjittered time. A run that would overlap the
+    previous one still going is skipped, or for 'all' jobs, held until that one finishes.
+    """
+    max_sleep = 300 # Never sleep longer than this, so a jump of the wall clock is noticed.
+    max_catch_up = 24
+
+    def __init__(self, fname, loop, ready=None, tracker=None):
+        self.fname = os.path.join('data', fname)
+        self.loop = loop
+        self.ready = ready # Coroutine function to wait on before running anything.
+        self.tracker = tracker
+        self.jobs = {}
+        self.heap = [] # (fire time, sequence, job name, job generation)
+        self.sequence = 0
+        self.wakeup = aio.Event()
+        self._runner = None
+        try:
+            with open(self.fname) as schedule_file:
+                self.saved = json.load(schedule_file)
+        except (OSError, ValueError):
+            self.saved = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, etrace):
+        self.save()
+
+    def save(self):
+        self.saved.update((name, job.next_run) for name, job in self.jobs.items())
+        with open(self.fname + '.tmp', 'w') as schedule_file:
+            json.dump(self.saved, schedule_file, indent=1, sort_keys=True)
+        os.replace(self.fname + '.tmp', self.fname)
+
+    def register(self, func, schedule, *, name=None, catch_up='once', jitter=0, immediate=False):
+        """
+        Schedule a function or coroutine function. Registering a name again replaces the job,
+        so cogs can register from on_ready or on reload without doubling up.
+        With immediate, the job also runs as soon as the scheduler starts.
+        """
+        if catch_up not in catch_up_policies:
+            raise ValueError(f'catch_up must be one of {catch_up_policies}')
+        name = name or func.__qualname__
+        self.cancel(name)
+        job = self.jobs[name] = Job(name, func, schedule, catch_up, jitter)
+        now = time()
+        if immediate:
+            job.next_run = now
+        elif (saved := self.saved.get(name)) is None:
+            job.next_run = schedule.next_after(now)
+        elif saved > now or catch_up == 'all':
+            job.next_run = saved
+            if catch_up == 'all':
+                job.next_run = self.catch_up_from(schedule, saved, now)
+        elif catch_up == 'once':
+            job.next_run = now
+        else:
+            job.next_run = schedule.next_after(now)
+        self.push(job, job.next_run)
+        if self._runner is None or self._runner.done():
+            self._runner = self.loop.create_task(self.run())
+        return job
+
+    def catch_up_from(self, schedule, start, now):
+        # Replay at most max_catch_up of the runs missed since start, the latest ones.
+        missed = []
+        when = start
+        while when <= now:
+            missed.append(when)
+            if len(missed) > self.max_catch_up:
+                del missed[0]
+            when = schedule.next_after(when)
+        return missed[0] if missed else when
+
+    def cancel(self, name):
+        if (job := self.jobs.pop(name, None)) is None:
+            return
+        job.generation += 1
+        if job.task is not None:
+            job.task.cancel()
+
+    def push(self, job, when):
+        self.sequence += 1
+        fire_at = when + (random.uniform(0, job.jitter) if job.jitter else 0)
+        heappush(self.heap, (fire_at, self.sequence, job.name, job.generation))
+        self.wakeup.set()
+
+    async def run(self):
+        if self.ready is not None:
+            await self.ready()
+        while True:
+            self.wakeup.clear()
+            while self.heap and self.heap[0][0] <= time():
+                _, _, name, generation = heappop(self.heap)
+                if (job := self.jobs.get(name)) is not None and job.generation == generation:
+                    self.fire(job)
+            delay = self.heap[0][0] - time() if self.heap else self.max_sleep
+            try:
+                await aio.wait_for(self.wakeup.wait(), min(delay, self.max_sleep))
+            except aio.TimeoutError:
+                pass
+
+    def fire(self, job):
+        now = time()
+        busy = job.task is not None and not job.task.done()
+        if busy and job.catch_up == 'all':
+            job.deferred = True # Replays wait for the run before them instead of being dropped.
+            return
+        next_run = job.schedule.next_after(job.next_run)
+        if next_run <= now and job.catch_up != 'all':
+            next_run = job.schedule.next_after(now)
+        job.next_run = next_run
+        self.push(job, next_run)
+        self.save()
+        if busy:
+            job.skipped += 1
+            return
+        job.task = self.loop.create_task(self.execute(job))
+
+    async def execute(self, job):
+        start = perf_counter()
+        failed = False
+        try:
+            result = job.func()
+            if aio.iscoroutine(result):
+                await result
+        except aio.CancelledError:
+            raise
+        except Exception:
+            failed = True
+            print(f'D--> Scheduled job {job.name} failed:')
+            traceback.print_exc()
+        if self.tracker is not None:
+            self.tracker.record(f'job {job.name}', perf_counter()-start, failed)
+        if job.deferred and self.jobs.get(job.name) is job:
+            job.deferred = False
+            self.push(job, job.next_run)
+
+    def report(self):
+        lines = [f'{"job":<32} {"schedule":<20} {"next run (UTC)":<19} {"skips":>5}']
+        for job in sorted(self.jobs.values(), key=lambda job: job.next_run):
+            next_run = datetime.fromtimestamp(job.next_run, timezone.utc).strftime('%d/%m/%Y %H:%M:%S')
+            lines.append(f'{job.name[:32]:<32} {str(job.schedule)[:20]:<20} {next_run:<19} {job.skipped:>5}')
+        return '\n'.join(lines)
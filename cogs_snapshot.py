@@ -0,0 +1,252 @@
+# Versioned snapshot files for the data/ stores, memory-mapped and decoded a record at a time.
+import os
+import mmap
+import pickle
+import struct
+from array import array
+from hashlib import blake2b
+from collections.abc import MutableMapping
+
+magic = b'AQSNAP'
+version = 1
+flag_single = 1 # The file holds one value under the key None, rather than a mapping.
+
+# magic, version, flags, record count, index offset
+_header = struct.Struct('<6sHHQQ')
+# key hash, key length, value length, kind: 0 for a pickle, else the typecode of a raw array
+_record = struct.Struct('<QIIB')
+# key hash, record offset; sorted, so a key is a binary search away
+_index_entry = struct.Struct('<QQ')
+_missing = object()
+
+
+class SnapshotError(ValueError):
+    """The file isn't a snapshot this version can read."""
+
+
+def key_hash(key):
+    # Has to agree across runs, so no hash(); equal ints and bools hash alike, as in a dict.
+    if isinstance(key, int) and -2**63 <= key < 2**63:
+        return key & 0xFFFFFFFFFFFFFFFF
+    data = key.encode('utf-8', 'surrogatepass') if isinstance(key, str) else pickle.dumps(key, 4)
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), 'little')
+
+def encode_record(key, value):
+    if type(value) is array and value.typecode != 'u':
+        kind, payload = ord(value.typecode), value.tobytes()
+    else:
+        kind, payload = 0, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    hashed = key_hash(key)
+    key_data = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+    return hashed, b''.join((_record.pack(hashed, len(key_data), len(payload), kind), key_data, payload))
+
+
+class Snapshot(object):
+    """
+    An open snapshot file. Opening maps the file and reads the header, nothing else;
+    keys and values are decoded from the map only when asked for.
+    Raw arrays are stored in native byte order, like the pickles of them were.
+    """
+    __slots__ = ('fname', 'mmap', 'flags', 'count', 'index_offset')
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as snapshot_file:
+            try:
+                self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # An empty file can't be mapped.
+                raise SnapshotError(f'{fname} is empty') from None
+        if len(self.mmap) < _header.size or self.mmap[:len(magic)] != magic:
+            self.close()
+            raise SnapshotError(f'{fname} is not a snapshot')
+        _, file_version, self.flags, self.count, self.index_offset = _header.unpack_from(self.mmap)
+        if file_version > version:
+            self.close()
+            raise SnapshotError(f'{fname} is snapshot version {file_version}, newer than {version}')
+
+    def close(self):
+        self.mmap.close()
+
+    def find(self, key):
+        """The offset of the key's record, or -1."""
+        hashed = key_hash(key)
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            if _index_entry.unpack_from(self.mmap, self.index_offset + mid*_index_entry.size)[0] < hashed:
+                low = mid + 1
+            else:
+                high = mid
+        for idx in range(low, self.count):
+            entry_hash, offset = _index_entry.unpack_from(self.mmap, self.index_offset + idx*_index_entry.size)
+            if entry_hash != hashed:
+                break
+            if self.key_at(offset) == key:
+                return offset
+        return -1
+
+    def records(self):
+        """Yields (offset, key hash) for every record, in the order they were saved."""
+        offset = _header.size
+        while offset < self.index_offset:
+            hashed, key_len, value_len, _ = _record.unpack_from(self.mmap, offset)
+            yield offset, hashed
+            offset += _record.size + key_len + value_len
+
+    def raw(self, offset):
+        _, key_len, value_len, _ = _record.unpack_from(self.mmap, offset)
+        return self.mmap[offset:offset + _record.size + key_len + value_len]
+
+    def key_at(self, offset):
+        _, key_len, _, _ = _record.unpack_from(self.mmap, offset)
+        start = offset + _record.size
+        return pickle.loads(self.mmap[start:start+key_len])
+
+    def value_at(self, offset):
+        _, key_len, value_len, kind = _record.unpack_from(self.mmap, offset)
+        start = offset + _record.size + key_len
+        if kind:
+            return array(chr(kind), self.mmap[start:start+value_len])
+        return pickle.loads(self.mmap[start:start+value_len])
+
+
+class SnapshotDict(MutableMapping):
+    """
+    A dict whose values stay in the snapshot file until they are first looked up, and are
+    held in memory from then on. Saving copies the records nobody touched across as they are,
+    without decoding them. Like a defaultdict, a default_factory fills in missing keys.
+    """
+
+    def __init__(self, snapshot=None, default_factory=None):
+        self.snapshot = snapshot
+        self.default_factory = default_factory
+        self.loaded = {} # Keys in the snapshot that have been decoded or replaced.
+        self.added = {} # Keys that aren't in the snapshot.
+        self.deleted = set()
+        self.touched = set() # Hashes of loaded and deleted keys; every other record is saved as is.
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.snapshot and self.snapshot.fname!r}, {len(self)} keys)'
+
+    def in_snapshot(self, key):
+        return key not in self.deleted and (key in self.loaded or (
+            key not in self.added and self.snapshot is not None and self.snapshot.find(key) >= 0
+            ))
+
+    def lookup(self, key):
+        if key in self.loaded:
+            return self.loaded[key]
+        if key in self.added:
+            return self.added[key]
+        if key in self.deleted or self.snapshot is None or (offset := self.snapshot.find(key)) < 0:
+            return _missing
+        value = self.loaded[key] = self.snapshot.value_at(offset)
+        self.touched.add(key_hash(key))
+        return value
+
+    def __getitem__(self, key):
+        if (value := self.lookup(key)) is _missing:
+            if self.default_factory is None:
+                raise KeyError(key)
+            value = self[key] = self.default_factory()
+        return value
+
+    def get(self, key, default=None):
+        value = self.lookup(key)
+        return default if value is _missing else value
+
+    def __contains__(self, key):
+        return key in self.added or self.in_snapshot(key)
+
+    def __setitem__(self, key, value):
+        if key in self.deleted or self.in_snapshot(key):
+            self.deleted.discard(key)
+            self.loaded[key] = value
+            self.touched.add(key_hash(key))
+        else:
+            self.added[key] = value
+
+    def __delitem__(self, key):
+        if key in self.added:
+            del self.added[key]
+        elif self.in_snapshot(key):
+            self.loaded.pop(key, None)
+            self.deleted.add(key)
+            self.touched.add(key_hash(key))
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        if self.snapshot is not None:
+            for offset, _ in self.snapshot.records():
+                if (key := self.snapshot.key_at(offset)) not in self.deleted:
+                    yield key
+        yield from self.added
+
+    def __len__(self):
+        return (self.snapshot.count if self.snapshot is not None else 0) - len(self.deleted) + len(self.added)
+
+    def raw_records(self):
+        if self.snapshot is not None:
+            for offset, hashed in self.snapshot.records():
+                if hashed not in self.touched:
+                    yield hashed, self.snapshot.raw(offset)
+                elif (key := self.snapshot.key_at(offset)) in self.loaded:
+                    yield encode_record(key, self.loaded[key])
+                elif key not in self.deleted:
+                    yield hashed, self.snapshot.raw(offset)
+        for key, value in self.added.items():
+            yield encode_record(key, value)
+
+    def reopen(self, fname):
+        # After a save, whatever is still undecoded is read from the new file instead.
+        old, self.snapshot = self.snapshot, Snapshot(fname)
+        self.loaded.update(self.added)
+        self.added.clear()
+        self.deleted.clear()
+        self.touched = {key_hash(key) for key in self.loaded}
+        if old is not None:
+            old.close()
+
+    def close(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+
+
+def load_snapshot(fname, default_factory=None):
+    """
+    Open a snapshot. A mapping comes back as a SnapshotDict without anything decoded yet;
+    any other value is decoded and returned. Raises SnapshotError for files in another
+    format, which callers read the old way and convert on their next save.
+    """
+    snapshot = Snapshot(fname)
+    if not snapshot.flags & flag_single:
+        return SnapshotDict(snapshot, default_factory)
+    try:
+        return snapshot.value_at(snapshot.find(None))
+    finally:
+        snapshot.close()
+
+def write_snapshot(fname, data):
+    """Save a mapping as one record per key, or anything else as a single record, replacing the file atomically."""
+    if isinstance(data, SnapshotDict):
+        records, flags = data.raw_records(), 0
+    elif isinstance(data, dict):
+        records, flags = (encode_record(key, value) for key, value in data.items()), 0
+    else:
+        records, flags = (encode_record(None, data),), flag_single
+    index = []
+    with open(fname + '.tmp', 'wb') as snapshot_file:
+        snapshot_file.write(_header.pack(magic, version, flags, 0, 0))
+        offset = _header.size
+        for hashed, record in records:
+            index.append((hashed, offset))
+            snapshot_file.write(record)
+            offset += len(record)
+        index.sort()
+        snapshot_file.write(b''.join(_index_entry.pack(*entry) for entry in index))
+        snapshot_file.seek(0)
+        snapshot_file.write(_header.pack(magic, version, flags, len(index), offset))
+    os.replace(fname + '.tmp', fname)
+    if isinstance(data, SnapshotDict):
+        data.reopen(fname)
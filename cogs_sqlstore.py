@@ -0,0 +1,96 @@
+# SQL storage helpers, for keeping SQLite work off the event loop.
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio as aio
+
+import sqlalchemy as sql
+
+def configure_sqlite(engine):
+    """
+    Switch every connection of the engine to WAL journaling, so readers never wait on
+    writers and a commit costs one fsync of the log instead of two of the database.
+    """
+    @sql.event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_conn, conn_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+    return engine
+
+
+class SqlWriteQueue(object):
+    """
+    Runs SQL statements on a single dedicated thread so that the event loop never blocks on SQLite.
+    Writes submitted while a batch is being committed are committed together in the next
+    transaction, in the order they were submitted.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='aqbot-sql')
+        self._pending = []
+        self._flusher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, evalue, etrace):
+        self.close()
+
+    def submit(self, stmt, params=None):
+        """Queue a write, returning a future that resolves once it has been committed."""
+        loop = aio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((stmt, params, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush())
+        return future
+
+    async def run(self, func, *args):
+        """Run a blocking database function on the SQL thread, behind any queued writes."""
+        # Queued writes only reach the thread once the flusher gets to them, so wait for it first.
+        if self._flusher is not None and not self._flusher.done():
+            await aio.shield(self._flusher)
+        return await aio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _flush(self):
+        loop = aio.get_running_loop()
+        while self._pending:
+            batch, self._pending = self._pending, []
+            results = await loop.run_in_executor(self.executor, self._commit, batch)
+            for (*_, future), exc in zip(batch, results):
+                if future.done():
+                    continue
+                if exc is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(exc)
+
+    def _commit(self, batch):
+        try:
+            with self.engine.begin() as dbconn:
+                for stmt, params, _ in batch:
+                    dbconn.execute(stmt, params)
+        except Exception:
+            pass
+        else:
+            return [None] * len(batch)
+        # One bad statement shouldn't sink the whole batch, so retry them one by one.
+        results = []
+        for stmt, params, _ in batch:
+            try:
+                with self.engine.begin() as dbconn:
+                    dbconn.execute(stmt, params)
+            except Exception as exc:
+                results.append(exc)
+            else:
+                results.append(None)
+        return results
+
+    def close(self):
+        """Commit anything still queued and stop the SQL thread."""
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self.executor.submit(self._commit, batch).result()
+        self.executor.shutdown(wait=True)
@@ -6,6 +6,7 @@ from collections import Counter, defaultdict
 import discord as dc
 
 from cogs_textbanks import url_bank, query_bank, response_bank
+from cogs_snapshot import SnapshotError, load_snapshot, write_snapshot
 
 CONST_WOC_ID = 125433170047795200
 
@@ -28,19 +29,17 @@ class StatsTracker(object):
         self.save()
 
     def save(self):
-        with open(self.fname, 'wb') as role_file:
-            pickle.dump(self.stats, role_file)
+        write_snapshot(self.fname, self.stats)
 
     def load(self):
         try:
-            with open(self.fname, 'rb') as role_file:
-                self.stats = pickle.load(role_file)
-            self.stats = defaultdict(callback, self.stats)
+            try:
+                self.stats = load_snapshot(self.fname, callback)
+            except SnapshotError: # Pickled before snapshots; the next save converts it.
+                with open(self.fname, 'rb') as role_file:
+                    self.stats = defaultdict(callback, pickle.load(role_file))
         except (OSError, EOFError):
             self.stats = defaultdict(callback, defaultdict(dict, {}))
-        else:
-            self.stats.default_factory = callback
-        self.save()
 
     async def take(self, stat, ctx, args):
         if self.locked:
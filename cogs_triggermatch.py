@@ -0,0 +1,88 @@
+# Aho-Corasick matching of many keywords and phrases at once, for triggers and keyword counters.
+from collections import deque
+
+trigger_modes = ('word', 'substring', 'exact')
+
+
+class TriggerAutomaton(object):
+    """
+    Matches every phrase it was built with in one pass over a text, however many there are.
+    Matching ignores case and surrounding whitespace. Each phrase comes with a mode: 'substring'
+    matches anywhere, 'word' only between non-word characters, and 'exact' only the whole text.
+    Exact phrases are a dict lookup and stay out of the automaton, so texts are only scanned at all
+    if there is something to scan for. Building takes time in proportion to the total length of the phrases, so rebuilding on every
+    config change is cheap.
+    """
+    __slots__ = ('goto', 'fail', 'out', 'exact', 'triggers')
+
+    def __init__(self, triggers):
+        # triggers: (phrase, mode, value) triples.
+        self.triggers = [(phrase.strip().lower(), mode, value) for phrase, mode, value in triggers]
+        goto = [{}]
+        out = [()]
+        self.exact = {}
+        for idx, (phrase, mode, _) in enumerate(self.triggers):
+            if mode == 'exact':
+                self.exact[phrase] = self.exact.get(phrase, ()) + (idx,)
+                continue
+            if not phrase:
+                continue
+            state = 0
+            for char in phrase:
+                if (next_state := goto[state].get(char)) is None:
+                    next_state = goto[state][char] = len(goto)
+                    goto.append({})
+                    out.append(())
+                state = next_state
+            out[state] += (idx,)
+        # Breadth first, so every state's failure target is finished before the state itself.
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                target = fail[state]
+                while target and char not in goto[target]:
+                    target = fail[target]
+                fail[next_state] = goto[target].get(char, 0)
+                out[next_state] += out[fail[next_state]]
+        self.goto, self.fail, self.out = goto, fail, out
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def scan(self, text):
+        """Yields (start, end, trigger index) for every occurrence of every phrase in the text."""
+        goto, fail, out, triggers = self.goto, self.fail, self.out, self.triggers
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for idx in out[state]:
+                yield end - len(triggers[idx][0]), end, idx
+
+    def matches(self, text):
+        """The values of the triggers found in a text, each once, in the order they were found."""
+        text = text.strip().lower()
+        found = {idx: self.triggers[idx][2] for idx in self.exact.get(text, ())}
+        if len(self.goto) == 1:
+            return list(found.values())
+        for start, end, idx in self.scan(text):
+            _, mode, value = self.triggers[idx]
+            if idx in found:
+                continue
+            if mode == 'word' and (
+                (start and is_word(text[start-1])) or (end < len(text) and is_word(text[end]))
+                ):
+                continue
+            found[idx] = value
+        return list(found.values())
+
+    def search(self, text):
+        return bool(self.matches(text))
+
+
+def is_word(char):
+    return char.isalnum() or char == '_'
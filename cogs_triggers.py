@@ -0,0 +1,162 @@
+# The TriggerManager Cog, which answers, counts and reports configured keywords in messages.
+from datetime import datetime
+from collections import Counter
+
+import asyncio as aio
+
+import discord as dc
+from discord.ext import commands
+
+from cogs_textbanks import url_bank, query_bank, response_bank
+from cogs_triggermatch import TriggerAutomaton, trigger_modes
+from bot_common import bot, CogtextManager
+
+trigger_actions = ('respond', 'count', 'alert')
+# Every guild gets these on top of its own; they can't be deleted.
+builtin_triggers = tuple(
+    (phrase, 'exact', ('respond', response_bank.affirmation_response)) for phrase in query_bank.affirmation
+    )
+
+
+class TriggerManager(CogtextManager):
+    save_delay = 60 # Seconds counts are held before saving, since every match changes them.
+
+    @staticmethod
+    def _generate_empty():
+        # triggers: guild_id -> trigger_id -> (phrase, mode, action, payload)
+        return {'triggers': {}, 'counts': {}, 'next_id': 1}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.guild_config = bot.get_cog('GuildConfiguration')
+        self.automata = {}
+        self._saver = None
+
+    def automaton(self, guild_id):
+        # Built on the first message after a change, from the built-ins and the guild's own triggers.
+        if (automaton := self.automata.get(guild_id)) is None:
+            automaton = self.automata[guild_id] = TriggerAutomaton((
+                *builtin_triggers,
+                *(
+                    (phrase, mode, (action, payload or phrase, trigger_id))
+                    for trigger_id, (phrase, mode, action, payload) in self.data['triggers'].get(guild_id, {}).items()
+                    ),
+                ))
+        return automaton
+
+    def schedule_save(self):
+        if self._saver is None or self._saver.done():
+            self._saver = self.bot.loop.create_task(self.delayed_save())
+
+    async def delayed_save(self):
+        await aio.sleep(self.save_delay)
+        self.data_save()
+
+    @commands.Cog.listener()
+    async def on_message(self, msg):
+        if msg.guild is None or msg.author.bot or msg.content.startswith(bot.command_prefix):
+            return
+        if not (found := self.automaton(msg.guild.id).matches(msg.content)):
+            return
+        responds = self.guild_config.check_disabled(msg, 'ignoreplebs')
+        counts = None
+        for action, payload, *trigger_id in found:
+            if action == 'respond' and responds:
+                await msg.channel.send(payload)
+                responds = False # One answer per message is plenty.
+            elif action == 'count':
+                counts = self.data['counts'].setdefault(msg.guild.id, Counter())
+                counts[payload] += 1
+            elif action == 'alert' and self.guild_config.getlog(msg.guild, 'modlog'):
+                embed = dc.Embed(
+                    color=dc.Color.orange(),
+                    timestamp=datetime.utcnow(),
+                    description=response_bank.trigger_alert_desc.format(
+                        author=msg.author, channel=msg.channel, phrase=payload, url=msg.jump_url,
+                        ),
+                    )
+                embed.set_author(name=response_bank.trigger_alert_head, icon_url=msg.author.avatar_url)
+                embed.add_field(name='**User ID:**', value=f'`{msg.author.id}`')
+                embed.add_field(name='**Trigger ID:**', value=f'`{trigger_id[0]}`')
+                await self.guild_config.log(msg.guild, 'modlog', embed=embed)
+        if counts is not None:
+            self.schedule_save()
+
+    @commands.group(name='trigger')
+    @commands.has_guild_permissions(manage_messages=True)
+    async def trigger(self, ctx):
+        if ctx.invoked_subcommand is None:
+            await ctx.send(response_bank.trigger_usage)
+
+    @trigger.error
+    async def trigger_error(self, ctx, error):
+        if isinstance(error, commands.MissingPermissions):
+            await ctx.send(response_bank.perms_error)
+            return
+        raise error
+
+    @trigger.command(name='add')
+    async def trigger_add(self, ctx, action: str, mode: str, phrase: str, *, payload: str=None):
+        action, mode = action.lower(), mode.lower()
+        if action not in trigger_actions or mode not in trigger_modes or not phrase.strip():
+            await ctx.send(response_bank.trigger_usage)
+            return
+        if action == 'respond' and not payload:
+            await ctx.send(response_bank.trigger_usage)
+            return
+        trigger_id = self.data['next_id']
+        self.data['next_id'] += 1
+        self.data['triggers'].setdefault(ctx.guild.id, {})[trigger_id] = (phrase, mode, action, payload)
+        self.automata.pop(ctx.guild.id, None)
+        self.data_save()
+        await ctx.send(response_bank.trigger_add_confirm.format(trigger_id=trigger_id))
+
+    @trigger_add.error
+    async def trigger_add_error(self, ctx, error):
+        if isinstance(error, (commands.MissingRequiredArgument, commands.BadArgument)):
+            await ctx.send(response_bank.trigger_usage)
+            return
+        raise error
+
+    @trigger.command(name='del')
+    async def trigger_del(self, ctx, trigger_id: int):
+        if self.data['triggers'].get(ctx.guild.id, {}).pop(trigger_id, None) is None:
+            await ctx.send(response_bank.trigger_del_error.format(trigger_id=trigger_id))
+            return
+        self.automata.pop(ctx.guild.id, None)
+        self.data_save()
+        await ctx.send(response_bank.trigger_del_confirm.format(trigger_id=trigger_id))
+
+    @trigger_del.error
+    async def trigger_del_error(self, ctx, error):
+        if isinstance(error, (commands.MissingRequiredArgument, commands.BadArgument)):
+            await ctx.send(response_bank.trigger_usage)
+            return
+        raise error
+
+    @trigger.command(name='list')
+    async def trigger_list(self, ctx):
+        if not (triggers := self.data['triggers'].get(ctx.guild.id)):
+            await ctx.send(response_bank.trigger_list_empty)
+            return
+        lines = [response_bank.trigger_list_head]
+        for trigger_id, (phrase, mode, action, payload) in triggers.items():
+            line = f'`{trigger_id}`: {action} on {mode} `{phrase}`' + (f' with `{payload}`' if payload else '')
+            if sum(map(len, lines)) + len(lines) + len(line) > 2000:
+                await ctx.send('\n'.join(lines))
+                lines = []
+            lines.append(line[:2000])
+        await ctx.send('\n'.join(lines))
+
+    @trigger.command(name='counts')
+    async def trigger_counts(self, ctx):
+        if not (counts := self.data['counts'].get(ctx.guild.id)):
+            await ctx.send(response_bank.trigger_counts_empty)
+            return
+        await ctx.send('\n'.join((
+            response_bank.trigger_counts_head,
+            *(f'`{name}`: {count}' for name, count in counts.most_common(20)),
+            )))
+
+
+bot.add_cog(TriggerManager(bot))
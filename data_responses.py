@@ -34,10 +34,28 @@ quirked_responses = {
     "search_self": "I understand the need to look at yourself in the mirror.",
     "allow_reacts": "❤️",
     "deny_reacts": "💔",
+    "autoreact_usage": (
+        "Usage of the autoreact command: `autoreact [subcommand] [args...]`\n\n"
+        "`autoreact`: Toggle hearts on images posted in this channel.\n"
+        "`autoreact add <emoji> (any|file|image|video|audio) [role] [regex]`: "
+        "React to messages with that kind of attachment, from that role, matching that regex.\n"
+        "`autoreact del <rule id>`: Delete a rule from this channel.\n"
+        "`autoreact list`: List the rules of this channel."
+        ),
+    "autoreact_pattern_error": "That regex will not do: {error}",
+    "autoreact_add_confirm": "Rule {rule_id} added; I shall react with {emoji}.",
+    "autoreact_del_confirm": "Rule {rule_id} deleted.",
+    "autoreact_del_error": "There is no rule {rule_id} in this channel.",
+    "autoreact_list_head": "The autoreact rules of this channel:",
+    "autoreact_list_empty": "This channel has no autoreact rules.",
     "allow_users": "I shall listen only to blue blooded commands.",
     "deny_users": "Unfortunately, I must now listen to the lower classes.",
     "allow_latex": "Rendering latex is now allowed.",
     "deny_latex": "Take your latex elsewhere.",
+    "bulk_delete_desc": "The transcript of all {count} messages is attached as `{fname}`.",
+    "bulk_delete_uncached": "{uncached} of them were too old for me to remember.",
+    "allow_archive": "Attachments posted here will be archived for the message log.",
+    "deny_archive": "Attachments posted here will no longer be archived.",
     "render_latex_head": "Latex render for {ctx.author}",
     "render_latex_args_error": "Your latex code is beneighth contempt. Try again.",
     "dice_roller_parse_error": "Use your words, straight from the horse's mouth.",
@@ -90,7 +108,8 @@ quirked_responses = {
     "batch_usage_format": (
         'Usage of the batch command: `batch (save|exec) <name>`\n\n'
         '`batch save <name>`: Save a batch command file attached to the message as a batch command.\n'
-        '`batch exec <name>`: Execute a previously saved batch command.\n'
+        '`batch exec <name> [parallel]`: Execute a previously saved batch command, '
+        'running up to [parallel] lines at once between `---` barrier lines.\n'
         ),
     "batch_save_name_error": "Command names only support alphanumeric characters and underscores.",
     "batch_save_missing_file": "Missing batch command file.",
@@ -98,6 +117,10 @@ quirked_responses = {
     "batch_save_confirm": "Batch command `{name}` saved.",
     "batch_exec_name_error": "Batch command `{name}` does not exist.",
     "batch_exec_start": "Executing batch command `{name}`:",
+    "batch_exec_parallel_error": "I can only run between 1 and {limit} lines at once.",
+    "batch_exec_complete": (
+        "Batch command `{name}` ran {count} lines in {elapsed:.2f} seconds, with {failed} failures."
+        ),
     "fat_husky_head": "A corpulent canine.",
     "positive_flex_head": "I strongly agree.",
     "positive_flex_desc": (
@@ -125,6 +148,10 @@ quirked_responses = {
         "I shall show you the magnificent strength of my hand, **#{ctx.channel}**!"
         ),
     "purge_channel_zero_arg_error": "You foolish creature.",
+    "purge_channel_filter_error": (
+        "I do not understand the filter {arg}. Use user:<user>, match:<regex>, files, or within:<number>(s|m|h|d)."
+        ),
+    "purge_channel_progress": "{deleted} messages crushed out of {scanned} searched so far...",
     "star_wars_punish_confirm": "It will be done, my lord.",
     "star_wars_punish_args_error": "Vocalize your command strongly, my lord.",
     "star_wars_punish_perms_error": "Only the senate may execute this order, {ctx.author.name}.",
@@ -135,6 +162,74 @@ quirked_responses = {
         "has been expressly forbidden by the powers that be, and has thus been "
         "strongly punished accordingly."
         ),
+    "perf_report_head": "Handler latencies since {since} UTC:",
+    "perf_sort_error": "I can only sort by one of: {keys}.",
+    "perf_reset_confirm": "Handler statistics have been reset.",
+    "perf_empty": "Nothing has been timed yet. Patience is a virtue.",
+    "perf_startup_head": "Startup phases, timed from launch:",
+    "perf_jobs_head": "Scheduled jobs, soonest first:",
+    "raidban_progress": "Executing aberrants... {done}/{total} so far.",
+    "raidban_summary": "{banned} of the {total} aberrants listed below have been STRONGLY executed in {elapsed:.1f} seconds:",
+    "raidguard_usage": (
+        "Usage of the raidguard command: `raidguard (subcommand) [args...]`\n\n"
+        "`raidguard mode (off|alert|ban)`: Ignore joins, report raid waves, or ban them outright.\n"
+        "`raidguard status`: Show the current join rate and flagged members.\n"
+        "`raidguard ban`: Ban every flagged member through raidban.\n"
+        "`raidguard clear`: Forget the flagged members."
+        ),
+    "trigger_usage": (
+        "Usage of the trigger command: `trigger (subcommand) [args...]`\n\n"
+        "`trigger add (respond|count|alert) (word|substring|exact) <phrase> [response or counter]`: "
+        "Answer, count, or report to the mod log every message with the phrase. Quote phrases with spaces.\n"
+        "`trigger del <trigger id>`: Delete a trigger.\n"
+        "`trigger list`: List the triggers of this server.\n"
+        "`trigger counts`: Show the counters."
+        ),
+    "trigger_add_confirm": "Trigger {trigger_id} is armed.",
+    "trigger_del_confirm": "Trigger {trigger_id} is disarmed.",
+    "trigger_del_error": "There is no trigger {trigger_id} in this server.",
+    "trigger_list_head": "The triggers of this server:",
+    "trigger_list_empty": "This server has no triggers.",
+    "trigger_counts_head": "The most common triggers:",
+    "trigger_counts_empty": "Nothing has been counted yet.",
+    "trigger_alert_head": "Trigger phrase spotted!",
+    "trigger_alert_desc": "**{author}** said `{phrase}` in {channel.mention}: [jump]({url})",
+    "search_usage": (
+        "Usage of the search command: `search [subcommand] <query>`\n\n"
+        "`search <query>`: Find the messages that best match the query.\n"
+        "`search count <user> <query>`: Count how many messages of a user match the query.\n"
+        "`search top <query>`: Show who sends the most messages matching the query.\n"
+        "`search backfill [channels...]`: Index older messages, of every channel by default.\n"
+        "`search status`: Show how much of the server is indexed.\n"
+        "Queries are FTS5 queries: words, \"quoted phrases\", OR, NOT, and prefix*."
+        ),
+    "search_head": "Messages matching {query}",
+    "search_empty": "Nothing matches. Perhaps it was never said.",
+    "search_syntax_error": "I cannot make sense of that query. Quote anything unusual.",
+    "search_count": "{member} has said that in {count} messages.",
+    "search_top_head": "Who says {query} the most:",
+    "search_backfill_start": "Indexing the history of {channels} channels. This will take a while.",
+    "search_status": "{total} messages indexed; {done} of {channels} channels fully backfilled.",
+    "raidguard_alert_head": "Possible raid on {guild}!",
+    "raidguard_alert_desc": "{joins} members have joined in the last {window} seconds.",
+    "raidguard_ban_desc": "{banned} of {total} aberrants STRONGLY executed in {elapsed:.1f} seconds.",
+    "raidguard_mode_confirm": "Raid guard set to {mode}.",
+    "raidguard_mode_error": "The raid guard only knows the modes off, alert, and ban.",
+    "raidguard_status": "{joins} joins in the last {window} seconds, {flagged} members flagged. Mode: {mode}.",
+    "raidguard_ban_empty": "There is no raid wave to execute. Peace reigns.",
+    "raidguard_clear_confirm": "Flagged members have been forgiven.",
+    "activity_usage": (
+        "Usage of the activity command: `activity (subcommand) [args...]`\n\n"
+        "`activity active [days]`: Count the members who have spoken in the last few days.\n"
+        "`activity inactive [days] [page]`: List the members who haven't, longest silent first.\n"
+        "`activity retention [months] [days]`: How many of each month's joins are still active.\n"
+        "`activity histogram`: Break members down by how long ago they last spoke."
+        ),
+    "activity_active": "{active} of {total} members have spoken in the last {days} days.",
+    "activity_inactive_head": "{total} members have not spoken in the last {days} days. Page {page} of {pages}:",
+    "activity_inactive_empty": "Everyone has spoken in the last {days} days. How chatty.",
+    "activity_retention_head": "Members active in the last {days} days, by the month they joined:",
+    "activity_histogram_head": "When the {total} members I know of last spoke:",
     "config_args_error": "It seems that {log} is not a valid status log type.",
     "config_completion": "The {log} channel has been set and saved.",
     "stats_busy": (
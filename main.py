@@ -1,19 +1,37 @@
 # The actual script you run directly.
-from bot_common import main
-import bot_events
-import bot_modcommands
-import bot_usercommands
+from importlib import import_module
 
-import cogs_logmanager
-import cogs_guildconfig
-import cogs_latexrenderer
-import cogs_dailycounts
-import cogs_banmanager
-import cogs_rolemanager
-import cogs_reactroletagger
-import cogs_batchcmds
-import cogs_linkyaicore
-import cogs_bullshitgenerator
+import asyncio as aio
+
+from cogs_perftracker import startup_profiler
+
+with startup_profiler.phase('import bot_common'):
+    from bot_common import bot, main
+
+# Imported in this order, since later cogs look up earlier ones when they're added.
+modules = (
+    'bot_events', 'bot_modcommands', 'bot_usercommands',
+    'cogs_logmanager', 'cogs_guildconfig', 'cogs_triggers', 'cogs_raidguard', 'cogs_latexrenderer',
+    'cogs_dailycounts', 'cogs_banmanager', 'cogs_rolemanager', 'cogs_reactroletagger',
+    'cogs_batchcmds', 'cogs_messageindex',
+    )
+# Nothing depends on these, so they can wait until the bot is already answering commands.
+deferred_modules = ('cogs_linkyaicore', 'cogs_bullshitgenerator')
+
+for name in modules:
+    with startup_profiler.phase(f'import {name}'):
+        import_module(name)
+
+async def load_deferred():
+    await bot.wait_until_ready()
+    for name in deferred_modules:
+        await aio.sleep(0) # Let whatever arrived meanwhile go first.
+        try:
+            with startup_profiler.phase(f'import {name} (deferred)'):
+                import_module(name)
+        except Exception as exc:
+            print(f'D--> Could not load {name}: {exc!r}')
 
 if __name__ == '__main__':
+    bot.loop.create_task(load_deferred())
     main()
@@ -0,0 +1,633 @@
+# Offline stand-ins for the Discord gateway and API, used to drive the real cogs without a network.
+import io
+import random
+import itertools
+from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+
+import asyncio as aio
+import discord as dc
+from discord.http import Route
+
+_DISCORD_EPOCH = 1420070400000
+_increment = itertools.count()
+
+def emoji_key(emoji):
+    """Key reactions the way the API does: custom emoji by ID, unicode emoji by text."""
+    if isinstance(emoji, dc.Reaction):
+        emoji = emoji.emoji
+    if getattr(emoji, 'id', None):
+        return emoji.id
+    emoji = str(emoji)
+    name, _, tail = emoji.strip('<>').rpartition(':')
+    return int(tail) if name and tail.isdigit() else emoji
+
+def snowflake(dt=None):
+    """Generate a unique, time-ordered snowflake like Discord does."""
+    millis = int(((dt or datetime.utcnow()) - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return ((millis - _DISCORD_EPOCH) << 22) | (next(_increment) & 0x3FFFFF)
+
+
+class FakeHTTP(object):
+    """
+    The fake API layer. Every coroutine on the fake models that would hit Discord goes
+    through request(), which adds configurable latency and enforces per-route rate limits
+    the same way discord.py waits them out, while counting every call.
+    """
+    # (requests, per seconds) per bucket. Buckets are per route and major parameter.
+    default_limits = {
+        'send_message': (5, 5.0),
+        'edit_message': (5, 5.0),
+        'delete_message': (5, 1.0),
+        'bulk_delete': (1, 1.0),
+        'add_reaction': (1, 0.25),
+        'remove_reaction': (1, 0.25),
+        'get_reaction_users': (5, 1.0),
+        'get_message': (5, 1.0),
+        'history': (5, 1.0),
+        'audit_logs': (5, 1.0),
+        'ban': (5, 1.0),
+        'edit_member': (10, 10.0),
+        'get_member': (5, 1.0),
+        }
+
+    def __init__(self, latency=0.0, jitter=0.0, ratelimit=True, limits=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.ratelimit = ratelimit
+        self.limits = dict(self.default_limits, **(limits or {}))
+        self.calls = Counter()
+        self.waited = Counter()
+        self._buckets = {}
+
+    async def request(self, route, major=None, **kwargs):
+        if isinstance(route, Route):
+            return await self.raw_request(route, **kwargs)
+        loop = aio.get_running_loop()
+        self.calls[route] += 1
+        if self.ratelimit and route in self.limits:
+            count, per = self.limits[route]
+            key = (route, major)
+            while True:
+                now = loop.time()
+                remaining, reset_at = self._buckets.get(key, (count, now + per))
+                if now >= reset_at:
+                    remaining, reset_at = count, now + per
+                if remaining:
+                    self._buckets[key] = (remaining - 1, reset_at)
+                    break
+                self.waited[route] += reset_at - now
+                await aio.sleep(reset_at - now)
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await aio.sleep(delay)
+
+    def reset(self):
+        self.calls.clear()
+        self.waited.clear()
+        self._buckets.clear()
+
+    async def raw_request(self, route, *, json=None, **kwargs):
+        # For cogs that build their own discord.http.Route for what discord.py lacks a method for.
+        if route.method == 'POST' and route.path == '/channels/{channel_id}/messages':
+            channel = self.gateway.bot.get_channel(route.channel_id)
+            return await channel.send(
+                json.get('content'), embeds=[dc.Embed.from_dict(embed) for embed in json.get('embeds', ())],
+                )
+        raise NotImplementedError(f'{route.method} {route.path}')
+
+    # Context.send() and discord.Reaction.users() go straight to the state's http client.
+    async def send_message(self, channel_id, content, *, embed=None, **kwargs):
+        channel = self.gateway.bot.get_channel(channel_id)
+        return await channel.send(content, embed=embed and dc.Embed.from_dict(embed))
+
+    async def send_files(self, channel_id, *, files, content=None, embed=None, **kwargs):
+        channel = self.gateway.bot.get_channel(channel_id)
+        return await channel.send(content, embed=embed and dc.Embed.from_dict(embed), files=files)
+
+    # discord.Reaction.users() pulls straight from the state's http client.
+    async def get_reaction_users(self, channel_id, message_id, emoji, limit, after=None):
+        await self.request('get_reaction_users', channel_id)
+        message = self.gateway.messages[message_id]
+        users = sorted(message.reactors[emoji_key(emoji)])
+        if after is not None:
+            users = [user_id for user_id in users if user_id > after]
+        return [self.gateway.users[user_id].to_dict() for user_id in users[:limit]]
+
+
+class _FakeState(object):
+    allowed_mentions = None
+
+    def __init__(self, http):
+        self.http = http
+
+    def create_message(self, *, channel, data):
+        return data # The fake http client already hands back the message.
+
+
+class FakeRole(object):
+    def __init__(self, guild, name, position, role_id=None, managed=False):
+        self.id = role_id or snowflake()
+        self.guild = guild
+        self.name = name
+        self.position = position
+        self.managed = managed
+        self.color = self.colour = dc.Color.default()
+        self.permissions = dc.Permissions.none()
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f'<FakeRole id={self.id} name={self.name!r}>'
+
+    def __lt__(self, other):
+        return (self.position, self.id) < (other.position, other.id)
+
+    @property
+    def mention(self):
+        return f'<@&{self.id}>'
+
+    def is_default(self):
+        return self.id == self.guild.id
+
+
+class FakeUser(object):
+    def __init__(self, gateway, name, user_id=None, bot=False, created_at=None, avatar=None):
+        self.gateway = gateway
+        self.id = user_id or snowflake(created_at)
+        self.name = name
+        self.discriminator = f'{random.randrange(10000):04}'
+        self.bot = bot
+        self.avatar = avatar
+        self.created_at = created_at or dc.utils.snowflake_time(self.id).replace(tzinfo=None)
+        self.color = self.colour = dc.Color.default()
+        gateway.users[self.id] = self
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+    def __eq__(self, other):
+        return isinstance(other, (FakeUser, dc.abc.Snowflake)) and other.id == self.id
+
+    def __hash__(self):
+        return self.id >> 22
+
+    @property
+    def mention(self):
+        return f'<@{self.id}>'
+
+    @property
+    def display_name(self):
+        return self.name
+
+    @property
+    def avatar_url(self):
+        return f'https://cdn.example/avatars/{self.id}/{self.avatar or "default"}.png'
+
+    def to_dict(self):
+        return {
+            'id': str(self.id), 'username': self.name, 'discriminator': self.discriminator,
+            'avatar': self.avatar, 'bot': self.bot,
+            }
+
+    async def create_dm(self):
+        return FakeTextChannel(self.gateway, None, f'dm-{self.name}')
+
+    async def send(self, *args, **kwargs):
+        return await (await self.create_dm()).send(*args, **kwargs)
+
+
+class FakeMember(FakeUser):
+    def __init__(self, gateway, guild, name, joined_at=None, roles=(), nick=None, **kwargs):
+        super().__init__(gateway, name, **kwargs)
+        self.guild = guild
+        self.joined_at = joined_at or datetime.utcnow()
+        self.nick = nick
+        self.roles = [guild.default_role, *roles]
+        self.guild_permissions = dc.Permissions.none()
+
+    @property
+    def display_name(self):
+        return self.nick or self.name
+
+    @property
+    def top_role(self):
+        return max(self.roles)
+
+    async def add_roles(self, *roles, reason=None, atomic=True):
+        await self.gateway.http.request('edit_member', self.guild.id)
+        for role in roles:
+            if role is None:
+                raise dc.NotFound(_FakeResponse(404), 'Unknown Role')
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles, reason=None, atomic=True):
+        await self.gateway.http.request('edit_member', self.guild.id)
+        self.roles = [role for role in self.roles if role not in roles]
+
+    async def edit(self, *, reason=None, **fields):
+        await self.gateway.http.request('edit_member', self.guild.id)
+        if 'roles' in fields:
+            self.roles = [self.guild.default_role, *fields.pop('roles')]
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    async def ban(self, **kwargs):
+        await self.guild.ban(self, **kwargs)
+
+
+class _FakeResponse(object):
+    def __init__(self, status):
+        self.status = status
+        self.reason = 'Fake'
+
+
+class FakeAttachment(object):
+    def __init__(self, filename, data=b'', url=None):
+        self.id = snowflake()
+        self.filename = filename
+        self.size = len(data)
+        self.url = url or f'https://cdn.example/attachments/{self.id}/{filename}'
+        self.proxy_url = self.url
+        self.content_type = None
+        self._data = data
+
+    async def read(self, *, use_cached=False):
+        return self._data
+
+    async def save(self, fp, *, seek_begin=True, use_cached=False):
+        data = await self.read()
+        if isinstance(fp, io.IOBase) and fp.writable():
+            fp.write(data)
+            if seek_begin:
+                fp.seek(0)
+            return len(data)
+        with open(fp, 'wb') as out:
+            return out.write(data)
+
+
+class FakeMessage(object):
+    def __init__(self, gateway, channel, author, content='', attachments=(), embeds=(), created_at=None):
+        self.gateway = gateway
+        self._state = gateway.state
+        self.id = snowflake(created_at)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = list(attachments)
+        self.embeds = list(embeds)
+        self.created_at = created_at or datetime.utcnow()
+        self.edited_at = None
+        self.type = dc.MessageType.default
+        self.webhook_id = None
+        self.mentions = []
+        self.role_mentions = []
+        self.reactors = defaultdict(set)
+        self._emoji = {}
+        gateway.messages[self.id] = self
+
+    def __repr__(self):
+        return f'<FakeMessage id={self.id} author={self.author}>'
+
+    @property
+    def clean_content(self):
+        return self.content
+
+    @property
+    def jump_url(self):
+        return f'https://discord.com/channels/{self.guild and self.guild.id}/{self.channel.id}/{self.id}'
+
+    @property
+    def reactions(self):
+        return [
+            dc.Reaction(message=self, data={'count': len(users), 'me': False}, emoji=self._emoji[key])
+            for key, users in self.reactors.items() if users
+            ]
+
+    async def add_reaction(self, emoji, user=None):
+        await self.gateway.http.request('add_reaction', self.channel.id)
+        self._emoji.setdefault(emoji_key(emoji), emoji)
+        self.reactors[emoji_key(emoji)].add((user or self.gateway.bot_user).id)
+
+    async def remove_reaction(self, emoji, member):
+        await self.gateway.http.request('remove_reaction', self.channel.id)
+        self.reactors[emoji_key(emoji)].discard(member.id)
+
+    async def clear_reactions(self):
+        await self.gateway.http.request('remove_reaction', self.channel.id)
+        self.reactors.clear()
+
+    async def clear_reaction(self, emoji):
+        await self.gateway.http.request('remove_reaction', self.channel.id)
+        self.reactors.pop(emoji_key(emoji), None)
+
+    async def edit(self, *, content=None, embed=None, **kwargs):
+        await self.gateway.http.request('edit_message', self.channel.id)
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embeds = [embed]
+        self.edited_at = datetime.utcnow()
+
+    async def delete(self, *, delay=None):
+        if delay:
+            await aio.sleep(delay)
+        await self.gateway.http.request('delete_message', self.channel.id)
+        self.gateway.dispatch('message_delete', self)
+        self.gateway.dispatch('raw_message_delete', self.gateway.delete_payload(self))
+
+
+class _FakeTyping(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeTextChannel(object):
+    def __init__(self, gateway, guild, name, channel_id=None, category_id=None):
+        self.gateway = gateway
+        self.guild = guild
+        self.id = channel_id or snowflake()
+        self.name = name
+        self.category_id = category_id
+        self.type = dc.ChannelType.text
+        self._state = gateway.state
+        self.sent = []
+        self._history = []
+        self._overwrites = {}
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def mention(self):
+        return f'<#{self.id}>'
+
+    def _append(self, msg):
+        self._history.append(msg)
+
+    def _remove(self, msg):
+        try:
+            self._history.remove(msg)
+        except ValueError:
+            pass
+        self.gateway.messages.pop(msg.id, None)
+
+    def typing(self):
+        return _FakeTyping()
+
+    def overwrites_for(self, role):
+        return self._overwrites.get(role.id, dc.PermissionOverwrite())
+
+    async def set_permissions(self, target, *, overwrite=None, reason=None, **perms):
+        await self.gateway.http.request('edit_channel', self.id)
+        self._overwrites[target.id] = overwrite or dc.PermissionOverwrite(**perms)
+
+    def permissions_for(self, member):
+        return dc.Permissions.all()
+
+    async def send(self, content=None, *, embed=None, embeds=None, file=None, files=None, **kwargs):
+        await self.gateway.http.request('send_message', self.id)
+        embeds = list(embeds or ()) + ([embed] if embed is not None else [])
+        files = list(files or ()) + ([file] if file is not None else [])
+        attachments = [
+            FakeAttachment(f.filename, f.fp.read() if hasattr(f.fp, 'read') else b'')
+            for f in files
+            ]
+        msg = FakeMessage(
+            self.gateway, self, self.gateway.bot_member(self.guild),
+            content or '', attachments, embeds,
+            )
+        self.sent.append(msg)
+        self._append(msg)
+        return msg
+
+    async def fetch_message(self, msg_id):
+        await self.gateway.http.request('get_message', self.id)
+        msg = self.gateway.messages.get(msg_id)
+        if msg is None or msg.channel is not self:
+            raise dc.NotFound(_FakeResponse(404), 'Unknown Message')
+        return msg
+
+    async def history(self, limit=100, before=None, after=None, oldest_first=None):
+        before = getattr(before, 'id', None) or (before and snowflake(before))
+        after = getattr(after, 'id', None) or (after and snowflake(after))
+        msgs = [
+            msg for msg in reversed(self._history)
+            if (before is None or msg.id < before) and (after is None or msg.id > after)
+            ]
+        if oldest_first or (oldest_first is None and after is not None):
+            msgs.reverse()
+        if limit is not None:
+            msgs = msgs[:limit]
+        for start in range(0, len(msgs), 100):
+            await self.gateway.http.request('history', self.id)
+            for msg in msgs[start:start+100]:
+                yield msg
+
+    async def delete_messages(self, messages):
+        messages = list(messages)
+        if len(messages) == 1:
+            await messages[0].delete()
+            return
+        await self.gateway.http.request('bulk_delete', self.id)
+        for msg in messages:
+            self._remove(msg)
+        payload = dc.RawBulkMessageDeleteEvent({
+            'ids': [msg.id for msg in messages], 'channel_id': self.id, 'guild_id': self.guild.id,
+            })
+        payload.cached_messages = messages
+        self.gateway.dispatch('raw_bulk_message_delete', payload)
+
+    async def purge(self, *, limit=100, check=None, before=None, after=None, bulk=True):
+        doomed = [msg async for msg in self.history(limit=limit, before=before, after=after)]
+        doomed = [msg for msg in doomed if check is None or check(msg)]
+        for start in range(0, len(doomed), 100):
+            await self.delete_messages(doomed[start:start+100])
+        return doomed
+
+
+class FakeAuditEntry(object):
+    def __init__(self, action, user, target, reason=None):
+        self.id = snowflake()
+        self.action = action
+        self.user = user
+        self.target = target
+        self.reason = reason
+        self.created_at = datetime.utcnow()
+
+
+class FakeGuild(object):
+    def __init__(self, gateway, name, guild_id=None):
+        self.gateway = gateway
+        self.id = guild_id or snowflake()
+        self.name = name
+        self.default_role = FakeRole(self, '@everyone', 0, role_id=self.id)
+        self.roles = [self.default_role]
+        self.channels = {}
+        self.members = {}
+        self.bans = {}
+        self.audit_log = []
+        self.me = None
+        self.owner_id = None
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def member_count(self):
+        return len(self.members)
+
+    @property
+    def text_channels(self):
+        return list(self.channels.values())
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def add_role(self, name, managed=False):
+        role = FakeRole(self, name, len(self.roles), managed=managed)
+        self.roles.append(role)
+        return role
+
+    def add_channel(self, name, category_id=None):
+        channel = FakeTextChannel(self.gateway, self, name, category_id=category_id)
+        self.channels[channel.id] = channel
+        return channel
+
+    def add_member(self, name, **kwargs):
+        member = FakeMember(self.gateway, self, name, **kwargs)
+        self.members[member.id] = member
+        return member
+
+    async def fetch_member(self, member_id):
+        await self.gateway.http.request('get_member', self.id)
+        if (member := self.members.get(member_id)) is None:
+            raise dc.NotFound(_FakeResponse(404), 'Unknown Member')
+        return member
+
+    async def ban(self, user, *, reason=None, delete_message_days=1):
+        await self.gateway.http.request('ban', self.id)
+        user = self.gateway.users.get(user.id, user)
+        self.bans[user.id] = reason
+        self.members.pop(user.id, None)
+        self.audit_log.append(FakeAuditEntry(dc.AuditLogAction.ban, self.me, user, reason))
+
+    async def unban(self, user, *, reason=None):
+        await self.gateway.http.request('ban', self.id)
+        self.bans.pop(user.id, None)
+
+    async def audit_logs(self, *, limit=100, before=None, after=None, oldest_first=None, user=None, action=None):
+        entries = [
+            entry for entry in reversed(self.audit_log)
+            if (action is None or entry.action == action)
+            and (user is None or entry.user.id == user.id)
+            and (before is None or entry.id < before.id)
+            and (after is None or entry.id > after.id)
+            ]
+        if oldest_first or (oldest_first is None and after is not None):
+            entries.reverse()
+        if limit is not None:
+            entries = entries[:limit]
+        for start in range(0, max(1, len(entries)), 100):
+            await self.gateway.http.request('audit_logs', self.id)
+            for entry in entries[start:start+100]:
+                yield entry
+
+
+class FakeGateway(object):
+    """
+    Owns the fake world and plugs it into a real commands.Bot so that bot.get_guild,
+    bot.get_channel, bot.get_user and bot.user resolve to the fakes.
+    """
+
+    def __init__(self, bot, http=None):
+        self.bot = bot
+        self.http = http or FakeHTTP()
+        self.http.gateway = self
+        self.state = _FakeState(self.http)
+        self.users = {}
+        self.messages = {}
+        self.guilds = {}
+        self.bot_user = FakeUser(self, 'ArquiusBot', bot=True)
+        self._bot_members = {}
+        connection = bot._connection
+        connection.user = self.bot_user
+        connection._guilds = self.guilds
+        connection._users = self.users
+
+    def bot_member(self, guild):
+        if guild is None:
+            return self.bot_user
+        return self._bot_members[guild.id]
+
+    def add_guild(self, name, guild_id=None):
+        guild = FakeGuild(self, name, guild_id)
+        top = guild.add_role('Arquius')
+        guild.me = guild.add_member(self.bot_user.name, user_id=self.bot_user.id, bot=True, roles=(top,))
+        guild.me.guild_permissions = dc.Permissions.all()
+        self._bot_members[guild.id] = guild.me
+        self.users[self.bot_user.id] = self.bot_user
+        self.guilds[guild.id] = guild
+        return guild
+
+    def message(self, channel, author, content='', attachments=(), created_at=None):
+        msg = FakeMessage(self, channel, author, content, attachments, created_at=created_at)
+        channel._append(msg)
+        return msg
+
+    def reaction_payload(self, msg, member, emoji, event_type='REACTION_ADD'):
+        if event_type == 'REACTION_ADD':
+            msg._emoji.setdefault(emoji_key(emoji), emoji)
+            msg.reactors[emoji_key(emoji)].add(member.id)
+        else:
+            msg.reactors[emoji_key(emoji)].discard(member.id)
+        data = {
+            'message_id': msg.id, 'channel_id': msg.channel.id,
+            'user_id': member.id, 'guild_id': msg.guild.id,
+            }
+        return dc.RawReactionActionEvent(data, emoji, event_type)
+
+    def delete_payload(self, msg, cached=True):
+        msg.channel._remove(msg)
+        payload = dc.RawMessageDeleteEvent({
+            'id': msg.id, 'channel_id': msg.channel.id, 'guild_id': msg.guild.id,
+            })
+        payload.cached_message = msg if cached else None
+        return payload
+
+    def edit_payload(self, msg, content):
+        # An edit of a message discord.py has already dropped from its cache.
+        return dc.RawMessageUpdateEvent({
+            'id': msg.id, 'channel_id': msg.channel.id, 'guild_id': msg.guild.id,
+            'content': content, 'edited_timestamp': datetime.utcnow().isoformat(),
+            })
+
+    def dispatch(self, event, *args, **kwargs):
+        self.bot.dispatch(event, *args, **kwargs)
+
+    async def drain(self):
+        """Wait for every event handler task scheduled so far to finish."""
+        current = aio.current_task()
+        while pending := [
+            task for task in aio.all_tasks()
+            if task is not current and isinstance(task, dc.client._ClientEventTask) and not task.done()
+            ]:
+            await aio.wait(pending)
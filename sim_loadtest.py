@@ -0,0 +1,471 @@
+# Offline load tests: drives the real cogs through synthetic event streams on the fake gateway.
+# Usage: python sim_loadtest.py [scenario ...] [--latency SECONDS] [--no-ratelimit] [--scale N]
+import os
+import sys
+import time
+import pickle
+import shutil
+import random
+import argparse
+import tempfile
+import traceback
+import importlib
+from datetime import datetime, timedelta
+
+import asyncio as aio
+
+_REPO = os.path.dirname(os.path.abspath(__file__))
+_COGS = (
+    'bot_modcommands', 'bot_usercommands', 'cogs_guildconfig', 'cogs_dailycounts', 'cogs_rolemanager',
+    'cogs_reactroletagger', 'cogs_banmanager', 'cogs_linkyaicore', 'cogs_raidguard', 'cogs_triggers',
+    'cogs_messageindex',
+    )
+
+
+def prepare_sandbox():
+    """Run from a scratch directory so the bot's data files never touch the real ones."""
+    sandbox = tempfile.mkdtemp(prefix='aqbot-sim-')
+    os.mkdir(os.path.join(sandbox, 'data'))
+    # Copied rather than linked, since some cogs write to their text files.
+    shutil.copytree(os.path.join(_REPO, 'text'), os.path.join(sandbox, 'text'))
+    shutil.copytree(os.path.join(_REPO, 'cmd'), os.path.join(sandbox, 'cmd'))
+    os.chdir(sandbox)
+    sys.path.insert(0, _REPO)
+    return sandbox
+
+
+class World(object):
+    """A single whitelisted guild populated with log channels, roles and members."""
+
+    def __init__(self, gateway, guild_id, members=500):
+        self.gateway = gateway
+        self.guild = guild = gateway.add_guild('Simulated Hive', guild_id)
+        self.usrlog = guild.add_channel('user-log')
+        self.msglog = guild.add_channel('message-log')
+        self.modlog = guild.add_channel('mod-log')
+        self.art = guild.add_channel('art')
+        self.chat = [guild.add_channel(f'chat-{i}') for i in range(8)]
+        self.roles = [guild.add_role(f'role-{i}') for i in range(20)]
+        now = datetime.utcnow()
+        self.members = [
+            guild.add_member(
+                f'member{i}',
+                created_at=now - timedelta(days=random.randrange(30, 3000)),
+                joined_at=now - timedelta(days=random.randrange(0, 900)),
+                roles=random.sample(self.roles, 3),
+                )
+            for i in range(members)
+            ]
+
+    def legacy_config(self):
+        # The shape GuildConfiguration migrates from data/config.pkl into SQL on first start.
+        return {self.guild.id: {
+            'usrlog': self.usrlog.id, 'msglog': self.msglog.id, 'modlog': self.modlog.id,
+            'autoreact': {self.art.id}, 'ignoreplebs': set(), 'enablelatex': set(),
+            }}
+
+
+class LoadTest(object):
+    def __init__(self, bot, gateway, world, perf_tracker, scale=1):
+        self.bot = bot
+        self.gateway = gateway
+        self.world = world
+        self.perf_tracker = perf_tracker
+        self.scale = scale
+        self.results = []
+
+    async def measure(self, name, events, driver):
+        self.perf_tracker.reset()
+        self.gateway.http.reset()
+        start = time.perf_counter()
+        await driver()
+        await self.gateway.drain()
+        await self.flush_logs()
+        elapsed = time.perf_counter() - start
+        self.results.append((name, events, elapsed))
+        print(f'\n=== {name}: {events} events in {elapsed:.2f}s ({events/elapsed:,.0f} events/sec) ===')
+        http = self.gateway.http
+        if http.calls:
+            print('API calls: ' + ', '.join(
+                f'{route}={count}' + (f' (waited {http.waited[route]:.1f}s)' if http.waited[route] else '')
+                for route, count in http.calls.most_common()
+                ))
+        if self.perf_tracker.handlers:
+            print(self.perf_tracker.report('total', 12))
+
+    async def flush_logs(self):
+        # Log messages are queued and batched, so wait for them to go out before counting API calls.
+        guild_config = self.bot.get_cog('GuildConfiguration')
+        await aio.gather(*guild_config.delete_bursts._flushers.values()) # Bursts of deletes wait to be complete.
+        workers = [sender._worker for sender in guild_config.log_senders.values() if sender._worker]
+        await aio.gather(*workers)
+        await aio.gather(*guild_config.reactions._workers)
+
+    async def paced(self, events, rate):
+        """Dispatch (event, args) pairs at a fixed rate, or as fast as possible if rate is None."""
+        interval = 1 / rate if rate else 0
+        start = time.perf_counter()
+        for idx, (event, args) in enumerate(events):
+            self.gateway.dispatch(event, *args)
+            if interval:
+                if (delay := start + idx*interval - time.perf_counter()) > 0:
+                    await aio.sleep(delay)
+            elif idx % 256 == 0:
+                await aio.sleep(0)
+
+    async def message_flood(self, rate=None):
+        from sim_gateway import FakeAttachment
+        import discord as dc
+        from bot_common import CONST_ADMINS
+        world, gateway = self.world, self.gateway
+        count = 10000 * self.scale
+        mod = world.guild.get_member(CONST_ADMINS[0]) or world.guild.add_member('Mod', user_id=CONST_ADMINS[0])
+        mod.guild_permissions = dc.Permissions.all()
+        for channel in world.chat:
+            for rule in (r'🎲 any \dd6', f'👋 any {world.roles[0].id} thanks', '🔢 any number [0-9]*7 ', '📎 file'):
+                gateway.dispatch('message', gateway.message(channel, mod, f'D--> autoreact add {rule}'))
+        for trigger in (
+            *(f'count word number{i} n{i}' for i in range(50)), 'count word "message number" messages',
+            'alert word "number 777"', 'respond exact "thanks linky" 🐴',
+            ):
+            gateway.dispatch('message', gateway.message(world.chat[0], mod, f'D--> trigger add {trigger}'))
+        await gateway.drain()
+
+        def messages():
+            for i in range(count):
+                author = random.choice(world.members)
+                roll = random.random()
+                if roll < 0.05:
+                    msg = gateway.message(world.art, author, '', [FakeAttachment('meme.png', b'\x89PNG')])
+                elif roll < 0.07:
+                    msg = gateway.message(random.choice(world.chat), author, 'thanks arquius')
+                elif roll < 0.09:
+                    msg = gateway.message(random.choice(world.chat), author, 'D--> roll 4d6')
+                else:
+                    msg = gateway.message(random.choice(world.chat), author, f'message number {i} ' * 4)
+                yield 'message', (msg,)
+
+        await self.measure(
+            f'message flood ({"unpaced" if rate is None else f"{rate}/s"})', count,
+            lambda: self.paced(messages(), rate),
+            )
+
+    async def edit_delete_churn(self):
+        from sim_gateway import FakeAttachment
+        world, gateway = self.world, self.gateway
+        count = 500 * self.scale
+        guild_config = self.bot.get_cog('GuildConfiguration')
+        guild_config.channel_cache['archive'][world.guild.id].update(channel.id for channel in world.chat)
+        memes = [bytes([i]) * 50000 for i in range(5)] # Reposted often, so the archive should hold each once.
+        msgs = [
+            gateway.message(
+                random.choice(world.chat), random.choice(world.members), 'x' * random.choice((10, 2000)),
+                [FakeAttachment('meme.png', random.choice(memes))] if idx % 5 == 0 else (),
+                )
+            for idx in range(count)
+            ]
+        for msg in msgs:
+            self.gateway.dispatch('message', msg)
+        await self.gateway.drain()
+        await aio.gather(*guild_config.archiver._workers) # Real deletes come long after the download.
+
+        def events():
+            # Half the messages have fallen out of discord.py's cache, so only the raw events fire for them.
+            for idx, msg in enumerate(msgs):
+                if idx % 2:
+                    yield 'raw_message_edit', (gateway.edit_payload(msg, msg.content + ' (edited)'),)
+                    continue
+                edited = gateway.message(msg.channel, msg.author, msg.content + ' (edited)')
+                edited.id = msg.id
+                edited.edited_at = datetime.utcnow()
+                yield 'message_edit', (msg, edited)
+            for idx, msg in enumerate(msgs):
+                if idx % 2:
+                    yield 'raw_message_delete', (gateway.delete_payload(msg, cached=False),)
+                    continue
+                yield 'message_delete', (msg,)
+                yield 'raw_message_delete', (gateway.delete_payload(msg),)
+
+        await self.measure('edit/delete churn', 3 * count, lambda: self.paced(events(), None))
+        archiver = guild_config.archiver
+        print(f'Archived {len(archiver.urls)} attachments as {len(archiver.files)} files ({archiver.total:,} bytes).')
+
+    async def reaction_storm(self):
+        import discord as dc
+        world, gateway = self.world, self.gateway
+        count = 2000 * self.scale
+        tagger = self.bot.get_cog('ReactRoleTagger')
+        board = gateway.message(world.chat[0], world.guild.me, 'Pick your roles!')
+        emojis = [dc.PartialEmoji(name=f'role{i}', id=700000000000000000 + i) for i in range(5)]
+        for emoji, role in zip(emojis, world.roles):
+            tagger.add_entry(board.channel.id, board.id, emoji.id, role.id)
+        chatter = [gateway.message(channel, world.members[0], 'react to me') for channel in world.chat]
+
+        def events():
+            for i in range(count):
+                member = random.choice(world.members)
+                if i % 10 == 0: # One in ten reactions lands on the role board.
+                    yield 'raw_reaction_add', (gateway.reaction_payload(board, member, random.choice(emojis)),)
+                else:
+                    target = random.choice(chatter)
+                    yield 'raw_reaction_add', (gateway.reaction_payload(target, member, '\N{FIRE}'),)
+
+        await self.measure('reaction storm', count, lambda: self.paced(events(), None))
+
+    async def join_raid(self):
+        world, gateway = self.world, self.gateway
+        count = 100 * self.scale
+        now = datetime.utcnow()
+        raiders = [
+            world.guild.add_member(
+                f'RTFKT_{i}' if i % 4 == 0 else f'freenitro{i:03}',
+                created_at=now - timedelta(minutes=random.randrange(5, 600)),
+                joined_at=now,
+                )
+            for i in range(count)
+            ]
+        raid_guard = self.bot.get_cog('RaidGuard')
+        raid_guard.alert_delay = 0.1
+
+        async def joins():
+            await self.paced((('member_join', (member,)) for member in raiders), None)
+            await self.gateway.drain()
+            await aio.gather(*raid_guard.reporters.values())
+
+        await self.measure('join raid', count, joins)
+        print(f'Raid guard flagged {len(raid_guard.flagged[world.guild.id])} of {count} raiders.')
+
+        async def ban_wave():
+            for member in raiders:
+                if member.id in world.guild.members:
+                    await world.guild.ban(member, reason='Simulated raid cleanup.')
+                gateway.dispatch('member_ban', world.guild, member)
+                await aio.sleep(0)
+
+        await self.measure('ban wave', count, ban_wave)
+
+    async def mass_ban(self):
+        from sim_gateway import FakeAttachment
+        from bot_common import CONST_ADMINS
+        world, gateway = self.world, self.gateway
+        count = 100 * self.scale
+        now = datetime.utcnow()
+        raiders = [
+            world.guild.add_member(f'raider{i}', created_at=now, joined_at=now)
+            for i in range(count)
+            ]
+        mod = world.guild.get_member(CONST_ADMINS[0]) or world.guild.add_member('Mod', user_id=CONST_ADMINS[0])
+        id_list = FakeAttachment('raiders.txt', '\n'.join(str(member.id) for member in raiders[10:]).encode())
+        msg = gateway.message(
+            world.chat[2], mod, 'D--> raidban ' + ' '.join(member.mention for member in raiders[:10]), [id_list],
+            )
+        await self.measure('mass ban', count, lambda: self.paced((('message', (msg,)),), None))
+
+    async def channel_purge(self):
+        from sim_gateway import FakeAttachment
+        from bot_common import CONST_ADMINS
+        world, gateway = self.world, self.gateway
+        count = 1000 * self.scale
+        channel = world.chat[3]
+        for i in range(count):
+            attachments = [FakeAttachment('meme.png', b'\x89PNG')] if i % 3 == 0 else ()
+            gateway.message(channel, random.choice(world.members), f'spam {i}', attachments)
+        mod = world.guild.get_member(CONST_ADMINS[0]) or world.guild.add_member('Mod', user_id=CONST_ADMINS[0])
+        msg = gateway.message(channel, mod, f'D--> ZA HANDO {count} files match:spam')
+        await self.measure('channel purge', count, lambda: self.paced((('message', (msg,)),), None))
+
+    async def mutelist_sweep(self):
+        world = self.world
+        count = 200 * self.scale
+        ban_manager = self.bot.get_cog('BanManager')
+        expired = datetime.utcnow() - timedelta(hours=1)
+        for member in random.sample(world.members, min(count, len(world.members))):
+            ban_manager.push((world.guild.id, member.id, world.roles[0].id), expired)
+        await self.measure('mutelist sweep', count, ban_manager.manage_mutelist)
+
+    async def linky_chatter(self):
+        from bot_common import CONST_ADMINS
+        world, gateway = self.world, self.gateway
+        count = 1000 * self.scale
+        linky = world.guild.add_member('Linky', user_id=CONST_ADMINS[1])
+
+        def events():
+            for i in range(count):
+                if i % 5 == 0:
+                    yield 'message', (gateway.message(world.chat[1], random.choice(world.members), 'D--> linky'),)
+                else:
+                    yield 'message', (gateway.message(world.chat[1], linky, f'i love dirt {i}'),)
+
+        await self.measure('linky chatter', count, lambda: self.paced(events(), None))
+
+    async def activity_queries(self):
+        from bot_common import CONST_ADMINS, member_stalker
+        from cogs_modtools import to_epoch
+        world, gateway = self.world, self.gateway
+        count = 200 * self.scale
+        now = datetime.utcnow()
+        for member in world.members:
+            member_stalker.update('first_join', member)
+            if random.random() < 0.8:
+                row = member_stalker.find_row(member.id, world.guild.id)
+                member_stalker.last_seen[row] = to_epoch(now - timedelta(days=random.expovariate(1/20)))
+        mod = world.guild.get_member(CONST_ADMINS[0]) or world.guild.add_member('Mod', user_id=CONST_ADMINS[0])
+        channel = world.chat[4]
+        queries = ('active 30', 'inactive 30 2', 'retention 6 30', 'histogram')
+
+        def events():
+            for i in range(count):
+                yield 'message', (gateway.message(channel, mod, f'D--> activity {queries[i % len(queries)]}'),)
+
+        await self.measure('activity queries', count, lambda: self.paced(events(), None))
+        for msg in channel.sent[-len(queries):]:
+            print(msg.content)
+
+    async def rejoin_wave(self):
+        world, gateway, guild = self.world, self.gateway, self.world.guild
+        count = min(200 * self.scale, len(world.members))
+        guild.me.top_role.position = len(guild.roles) # Put the bot above the member roles.
+        above = guild.add_role('Council') # ... but not this one.
+        integration = guild.add_role('Server Booster', managed=True)
+        leavers = world.members[:count]
+        for i, member in enumerate(leavers):
+            if i % 4 == 0:
+                member.roles += [above, integration]
+            if i % 5 == 0:
+                member.roles = [guild.default_role] # Nothing to give back.
+            guild.members.pop(member.id)
+            gateway.dispatch('member_remove', member)
+        await gateway.drain()
+        deleted = world.roles.pop()
+        guild.roles.remove(deleted)
+        restorer = self.bot.get_cog('GuildConfiguration').role_restorer
+        restorer.interval = 0.01
+        restored = restorer.restored
+        returners = [
+            guild.add_member(member.name, user_id=member.id, created_at=member.created_at) for member in leavers
+            ]
+
+        async def joins():
+            await self.paced((('member_join', (member,)) for member in returners), None)
+            await gateway.drain()
+            await aio.gather(*restorer._workers.values())
+
+        await self.measure('rejoin wave', count, joins)
+        wrong = sum(
+            any(role in (above, integration, deleted, None) for role in member.roles)
+            or {role.id for role in member.roles[1:]} != {role.id for role in old.roles[1:]} - {above.id, integration.id, deleted.id}
+            for member, old in zip(returners, leavers)
+            )
+        print(f'Restored roles to {restorer.restored - restored} of {count} rejoiners, {wrong} with the wrong roles.')
+
+    async def history_search(self):
+        import discord as dc
+        from bot_common import CONST_ADMINS
+        world, gateway = self.world, self.gateway
+        count = 5000 * self.scale
+        words = ('horse', 'stallion', 'muscles', 'strong', 'sweat', 'towel', 'milk', 'bucket', 'hoof', 'mane')
+        mod = world.guild.get_member(CONST_ADMINS[0]) or world.guild.add_member('Mod', user_id=CONST_ADMINS[0])
+        mod.guild_permissions = dc.Permissions.all()
+        search = self.bot.get_cog('MessageSearch')
+        search.backfill_pause = 0
+        posted = [
+            gateway.message(
+                random.choice(world.chat), random.choice(world.members[:50]),
+                ' '.join(random.choice(words) for _ in range(8)),
+                )
+            for _ in range(count)
+            ]
+        for msg in posted[count//2:]: # The older half is only reachable through the backfill.
+            gateway.dispatch('message', msg)
+        await gateway.drain()
+
+        async def backfill():
+            gateway.dispatch('message', gateway.message(world.chat[5], mod, 'D--> search backfill'))
+            await gateway.drain()
+            await aio.gather(*search.backfills.values())
+
+        await self.measure('search backfill', count, backfill)
+        queries = ('search "strong stallion"', f'search count {world.members[0].id} milk', 'search top hoof OR mane', 'search status')
+
+        async def queries_run():
+            for i in range(200):
+                gateway.dispatch('message', gateway.message(world.chat[5], mod, f'D--> {queries[i % len(queries)]}'))
+                await gateway.drain()
+
+        await self.measure('search queries', 200, queries_run)
+        for msg in world.chat[5].sent[-len(queries):]:
+            print(msg.content or msg.embeds[0].description[:300])
+
+    def summary(self):
+        print('\n=== Summary ===')
+        for name, events, elapsed in self.results:
+            print(f'{name:<40} {events:>8} events {elapsed:>8.2f}s {events/elapsed:>12,.0f} events/sec')
+
+
+scenarios = {
+    'messages': lambda test, args: test.message_flood(args.rate),
+    'edits': lambda test, args: test.edit_delete_churn(),
+    'reactions': lambda test, args: test.reaction_storm(),
+    'raid': lambda test, args: test.join_raid(),
+    'massban': lambda test, args: test.mass_ban(),
+    'purge': lambda test, args: test.channel_purge(),
+    'mutelist': lambda test, args: test.mutelist_sweep(),
+    'linky': lambda test, args: test.linky_chatter(),
+    'activity': lambda test, args: test.activity_queries(),
+    'rejoin': lambda test, args: test.rejoin_wave(),
+    'search': lambda test, args: test.history_search(),
+    }
+
+
+async def run(args):
+    from bot_common import bot, guild_whitelist, perf_tracker, sql_engine
+    sql_engine.echo = False
+    from sim_gateway import FakeGateway, FakeHTTP
+    http = FakeHTTP(latency=args.latency, jitter=args.latency/2, ratelimit=args.ratelimit)
+    gateway = FakeGateway(bot, http)
+    world = World(gateway, guild_whitelist[0], args.members)
+    with open(os.path.join('data', 'config.pkl'), 'wb') as config_file:
+        pickle.dump(world.legacy_config(), config_file)
+    for name in _COGS:
+        importlib.import_module(name)
+    test = LoadTest(bot, gateway, world, perf_tracker, args.scale)
+    for name in args.scenarios or scenarios:
+        await scenarios[name](test, args)
+    test.summary()
+    for task in aio.all_tasks():
+        if task is not aio.current_task():
+            task.cancel()
+
+
+async def report_error_once(event_method, *args, **kwargs):
+    # Handler errors are already counted by the perf tracker; only show each distinct one once.
+    etype, evalue, etrace = sys.exc_info()
+    key = (event_method, etype, str(evalue))
+    if key not in _seen_errors:
+        _seen_errors.add(key)
+        print(f'Ignoring exception in {event_method}:', file=sys.stderr)
+        traceback.print_exception(etype, evalue, etrace)
+
+_seen_errors = set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load tests for the bot cogs.')
+    parser.add_argument('scenarios', nargs='*', choices=[[], *scenarios], metavar='scenario',
+        help=f'Scenarios to run, out of: {", ".join(scenarios)}. Runs all of them by default.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Fake API latency in seconds.')
+    parser.add_argument('--no-ratelimit', dest='ratelimit', action='store_false',
+        help='Disable the fake per-route rate limits.')
+    parser.add_argument('--rate', type=float, default=None,
+        help='Pace the message flood at this many events per second.')
+    parser.add_argument('--members', type=int, default=500, help='Members in the simulated guild.')
+    parser.add_argument('--scale', type=int, default=1, help='Multiply every scenario size.')
+    args = parser.parse_args()
+    prepare_sandbox()
+    from bot_common import bot
+    bot.on_error = report_error_once
+    bot.loop.run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()